@@ -1,5 +1,5 @@
 """Configuration module for the bot."""
 
-from .settings import Settings
+from .settings import Settings, settings
 
-__all__ = ["Settings"]
+__all__ = ["Settings", "settings"]
@@ -2,7 +2,7 @@
 
 import os
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -18,25 +18,164 @@ class Settings:
         int(os.getenv("AUTHORIZED_USER_ID")) if os.getenv("AUTHORIZED_USER_ID") else None
     )
 
+    # More users as "id[:role]" entries (role "operator" or "admin"), from env, a file or SQLite;
+    # the file and database are reloaded when they change
+    AUTHORIZED_USERS: str = os.getenv("AUTHORIZED_USERS", "")
+    AUTHORIZED_USERS_FILE: Optional[Path] = (
+        Path(os.getenv("AUTHORIZED_USERS_FILE")) if os.getenv("AUTHORIZED_USERS_FILE") else None
+    )
+    AUTHORIZED_USERS_DB: Optional[Path] = (
+        Path(os.getenv("AUTHORIZED_USERS_DB")) if os.getenv("AUTHORIZED_USERS_DB") else None
+    )
+    ACCESS_RELOAD_INTERVAL: float = float(os.getenv("ACCESS_RELOAD_INTERVAL", "5"))
+
+    # Per-user quotas so one operator cannot fill the render pool
+    USER_MAX_CONCURRENT_CARDS: int = int(os.getenv("USER_MAX_CONCURRENT_CARDS", "2"))
+    USER_CARDS_PER_MINUTE: float = float(os.getenv("USER_CARDS_PER_MINUTE", "30"))
+
+    # Update delivery: "polling" or "webhook"
+    BOT_MODE: str = os.getenv("BOT_MODE", "polling").lower()
+    WEBHOOK_LISTEN: str = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", "8443"))
+    WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "").rstrip("/")
+    WEBHOOK_SECRET_TOKEN: str = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+    CONCURRENT_UPDATES: int = int(os.getenv("CONCURRENT_UPDATES", "1"))
+    TELEGRAM_API_BASE_URL: str = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+
     # Paths
     BASE_DIR: Path = Path(__file__).resolve().parent.parent.parent
     ASSETS_DIR: Path = BASE_DIR / "assets"
     FONTS_DIR: Path = ASSETS_DIR / "fonts"
     TEMPLATES_DIR: Path = BASE_DIR / "templates"
     TEMP_DIR: Path = BASE_DIR / "temp"
+    DATA_DIR: Path = BASE_DIR / "data"
+
+    # Conversation state store: "sqlite", "redis" or "memory" (lost on restart)
+    STATE_BACKEND: str = os.getenv("STATE_BACKEND", "sqlite").lower()
+    STATE_DB_PATH: Path = Path(os.getenv("STATE_DB_PATH", str(DATA_DIR / "state.db")))
+    STATE_REDIS_URL: str = os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0")
+    STATE_KEY_PREFIX: str = os.getenv("STATE_KEY_PREFIX", "fggstore:")
+    STATE_FLUSH_INTERVAL: float = float(os.getenv("STATE_FLUSH_INTERVAL", "1.0"))
 
-    # Font settings
+    # Default font and template (layouts may use others from the same directories)
     FONT_NAME: str = "tahoma.ttf"
     FONT_PATH: Path = FONTS_DIR / FONT_NAME
-    BASE_FONT_SIZE: int = int(40 * 3.125)
-    SMALL_FONT_SIZE: int = int(16 * 3.125)
-    CODE_MAX_FONT_SIZE: int = int(60 * 3.125)
-    CODE_MIN_FONT_SIZE: int = int(10 * 3.125)
-
-    # Image settings
     TEMPLATE_IMAGE: str = "card.png"
     TEMPLATE_PATH: Path = TEMPLATES_DIR / TEMPLATE_IMAGE
-    SCALE_FACTOR: float = 3.125
+
+    # Card layouts (one JSON/TOML file per design) and the one used when none matches
+    LAYOUTS_DIR: Path = Path(os.getenv("LAYOUTS_DIR", str(BASE_DIR / "layouts")))
+    DEFAULT_LAYOUT: str = os.getenv("DEFAULT_LAYOUT", "default")
+    # Seconds between checks for changed layouts, templates and fonts (0 checks on every card)
+    FILE_RELOAD_INTERVAL: float = float(os.getenv("FILE_RELOAD_INTERVAL", "5"))
+
+    # Output size presets (scale relative to the layout's template) and the default one
+    OUTPUT_PRESETS: Dict[str, float] = {
+        "print": 1.0,  # full template resolution (1875x3125 for the default card)
+        "telegram": 0.4096,  # 1280 px on the long side, the size Telegram delivers photos at
+        "thumbnail": 0.1024,  # 320 px on the long side
+    }
+    OUTPUT_PRESET: str = os.getenv("OUTPUT_PRESET", "telegram")
+
+    # Output encoding for cards sent to Telegram ("PNG", "JPEG" or "WEBP")
+    OUTPUT_FORMAT: str = os.getenv("OUTPUT_FORMAT", "PNG").upper()
+    OUTPUT_PNG_COMPRESS_LEVEL: int = int(os.getenv("OUTPUT_PNG_COMPRESS_LEVEL", "6"))
+    OUTPUT_OPTIMIZE: bool = os.getenv("OUTPUT_OPTIMIZE", "false").lower() == "true"
+    OUTPUT_QUALITY: int = int(os.getenv("OUTPUT_QUALITY", "90"))
+
+    # Pre-rendered price/country variants, optionally saved to a directory between runs
+    VARIANT_CACHE: bool = os.getenv("VARIANT_CACHE", "true").lower() == "true"
+    VARIANT_CACHE_DIR: Optional[Path] = (
+        Path(os.getenv("VARIANT_CACHE_DIR")) if os.getenv("VARIANT_CACHE_DIR") else None
+    )
+
+    # Encoded cards reused when the same card is sent again, with an optional disk tier
+    RENDER_CACHE: bool = os.getenv("RENDER_CACHE", "true").lower() == "true"
+    RENDER_CACHE_MAX_MB: int = int(os.getenv("RENDER_CACHE_MAX_MB", "64"))
+    RENDER_CACHE_TTL: float = float(os.getenv("RENDER_CACHE_TTL", "86400"))
+    RENDER_CACHE_FILE_IDS: int = int(os.getenv("RENDER_CACHE_FILE_IDS", "10000"))
+    RENDER_CACHE_DISK: bool = os.getenv("RENDER_CACHE_DISK", "false").lower() == "true"
+    RENDER_CACHE_DIR: Path = Path(os.getenv("RENDER_CACHE_DIR", str(TEMP_DIR / "render_cache")))
+    RENDER_CACHE_DISK_MAX_MB: int = int(os.getenv("RENDER_CACHE_DISK_MAX_MB", "512"))
+
+    # Card text assembled from cached glyph masks instead of rasterized on every card
+    GLYPH_ATLAS: bool = os.getenv("GLYPH_ATLAS", "true").lower() == "true"
+    GLYPH_ATLAS_MAX_MB: int = int(os.getenv("GLYPH_ATLAS_MAX_MB", "16"))
+
+    # Entries kept by each Arabic reshaping cache (words and full strings)
+    TEXT_CACHE_SIZE: int = int(os.getenv("TEXT_CACHE_SIZE", "1024"))
+
+    # Render pool ("thread" or "process" workers)
+    RENDER_POOL_TYPE: str = os.getenv("RENDER_POOL_TYPE", "thread")
+    RENDER_WORKERS: int = int(os.getenv("RENDER_WORKERS", "2"))
+    RENDER_QUEUE_SIZE: int = int(os.getenv("RENDER_QUEUE_SIZE", "8"))
+    # Cap on the image memory of renders in flight (0 for none) and how long a render
+    # waits for memory before it is turned away
+    RENDER_MEMORY_MAX_MB: int = int(os.getenv("RENDER_MEMORY_MAX_MB", "256"))
+    RENDER_MEMORY_WAIT: float = float(os.getenv("RENDER_MEMORY_WAIT", "10"))
+
+    # Render service: the bot sends renders to RENDER_SERVICE_URL when set, and
+    # `python -m app.render_server` listens on RENDER_SERVICE_LISTEN
+    # (http://host:port or unix:///path/to/socket)
+    RENDER_SERVICE_URL: str = os.getenv("RENDER_SERVICE_URL", "")
+    RENDER_SERVICE_LISTEN: str = os.getenv("RENDER_SERVICE_LISTEN", "http://127.0.0.1:8090")
+    RENDER_SERVICE_TIMEOUT: float = float(os.getenv("RENDER_SERVICE_TIMEOUT", "30"))
+    # Secret the bot sends with every render; the service requires one to listen on
+    # anything but a loopback address or a Unix socket
+    RENDER_SERVICE_SECRET: str = os.getenv("RENDER_SERVICE_SECRET", "")
+    # Largest render request the service reads, in bytes
+    RENDER_SERVICE_MAX_BODY: int = int(os.getenv("RENDER_SERVICE_MAX_BODY", "16384"))
+
+    # Full-size canvases reused between renders instead of allocated per card
+    BUFFER_POOL: bool = os.getenv("BUFFER_POOL", "true").lower() == "true"
+    BUFFER_POOL_MAX_MB: int = int(os.getenv("BUFFER_POOL_MAX_MB", "64"))
+
+    # Card delivery: upload slots, flood limits (messages/sec), retries and dead letters
+    UPLOAD_CONCURRENCY: int = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+    DELIVERY_GLOBAL_RATE: float = float(os.getenv("DELIVERY_GLOBAL_RATE", "25"))
+    DELIVERY_CHAT_RATE: float = float(os.getenv("DELIVERY_CHAT_RATE", "1"))
+    DELIVERY_CHAT_BURST: int = int(os.getenv("DELIVERY_CHAT_BURST", "3"))
+    DELIVERY_MAX_ATTEMPTS: int = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+    DELIVERY_RETRY_BASE_DELAY: float = float(os.getenv("DELIVERY_RETRY_BASE_DELAY", "1.0"))
+    DELIVERY_RETRY_MAX_DELAY: float = float(os.getenv("DELIVERY_RETRY_MAX_DELAY", "30.0"))
+    DEAD_LETTER_DB_PATH: Path = Path(
+        os.getenv("DEAD_LETTER_DB_PATH", str(DATA_DIR / "dead_letters.db"))
+    )
+
+    # Order ledger: any of "sqlite" and "jsonl" (comma separated), or "none"
+    LEDGER_BACKEND: List[str] = [
+        backend.strip()
+        for backend in os.getenv("LEDGER_BACKEND", "sqlite").lower().split(",")
+        if backend.strip() not in ("", "none")
+    ]
+    LEDGER_DB_PATH: Path = Path(os.getenv("LEDGER_DB_PATH", str(DATA_DIR / "orders.db")))
+    LEDGER_JSONL_PATH: Path = Path(os.getenv("LEDGER_JSONL_PATH", str(DATA_DIR / "orders.jsonl")))
+    LEDGER_FLUSH_INTERVAL: float = float(os.getenv("LEDGER_FLUSH_INTERVAL", "1.0"))
+    LEDGER_BATCH_SIZE: int = int(os.getenv("LEDGER_BATCH_SIZE", "100"))
+
+    # Duplicate activation code check: a Bloom filter over the ledger's issued codes
+    DUPLICATE_CODE_CHECK: bool = os.getenv("DUPLICATE_CODE_CHECK", "true").lower() == "true"
+    CODE_INDEX_CAPACITY: int = int(os.getenv("CODE_INDEX_CAPACITY", "1000000"))
+    CODE_INDEX_ERROR_RATE: float = float(os.getenv("CODE_INDEX_ERROR_RATE", "0.001"))
+    CODE_INDEX_RECENT: int = int(os.getenv("CODE_INDEX_RECENT", "10000"))
+    # Other replicas write to the same SQLite ledger, so every new code is confirmed against it
+    CODE_INDEX_SHARED: bool = os.getenv("CODE_INDEX_SHARED", "false").lower() == "true"
+
+    # Bulk generation (0 workers means one per CPU core)
+    BATCH_WORKERS: int = int(os.getenv("BATCH_WORKERS", "0"))
+    BATCH_MAX_CARDS: int = int(os.getenv("BATCH_MAX_CARDS", "500"))
+
+    # Metrics endpoint (port 0 disables it) and per-stage JSON timing logs
+    METRICS_HOST: str = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT: int = int(os.getenv("METRICS_PORT", "0"))
+    METRICS_LOG_JSON: bool = os.getenv("METRICS_LOG_JSON", "false").lower() == "true"
+
+    # Liveness (/healthz) and readiness (/readyz) checks (port 0 disables them); liveness fails
+    # when the event loop has not run for HEALTH_LOOP_TIMEOUT seconds
+    HEALTH_HOST: str = os.getenv("HEALTH_HOST", "0.0.0.0")
+    HEALTH_PORT: int = int(os.getenv("HEALTH_PORT", "8080"))
+    HEALTH_LOOP_TIMEOUT: float = float(os.getenv("HEALTH_LOOP_TIMEOUT", "30"))
 
     # Timezone offset (UTC+3 for Saudi Arabia)
     TIMEZONE_OFFSET_HOURS: int = 3
@@ -50,17 +189,88 @@ class Settings:
         """Validate required settings."""
         if not cls.BOT_TOKEN:
             raise ValueError("BOT_TOKEN environment variable is required")
-        if cls.AUTHORIZED_USER_ID is None:
-            raise ValueError("AUTHORIZED_USER_ID environment variable is required")
+        if not (
+            cls.AUTHORIZED_USER_ID is not None
+            or cls.AUTHORIZED_USERS
+            or cls.AUTHORIZED_USERS_FILE
+            or cls.AUTHORIZED_USERS_DB
+        ):
+            raise ValueError(
+                "AUTHORIZED_USER_ID, AUTHORIZED_USERS, AUTHORIZED_USERS_FILE or "
+                "AUTHORIZED_USERS_DB is required"
+            )
+        if cls.AUTHORIZED_USERS_FILE is not None and not cls.AUTHORIZED_USERS_FILE.exists():
+            raise FileNotFoundError(f"Users file not found: {cls.AUTHORIZED_USERS_FILE}")
+        if cls.USER_MAX_CONCURRENT_CARDS < 1 or cls.USER_CARDS_PER_MINUTE <= 0:
+            raise ValueError("USER_MAX_CONCURRENT_CARDS and USER_CARDS_PER_MINUTE must be positive")
         if not cls.TEMPLATE_PATH.exists():
             raise FileNotFoundError(f"Template image not found: {cls.TEMPLATE_PATH}")
         if not cls.FONT_PATH.exists():
             raise FileNotFoundError(f"Font file not found: {cls.FONT_PATH}")
+        if not any(
+            (cls.LAYOUTS_DIR / f"{cls.DEFAULT_LAYOUT}{extension}").exists()
+            for extension in (".json", ".toml")
+        ):
+            raise FileNotFoundError(f"Default layout not found: {cls.DEFAULT_LAYOUT}")
+        if cls.BOT_MODE not in ("polling", "webhook"):
+            raise ValueError("BOT_MODE must be 'polling' or 'webhook'")
+        if cls.BOT_MODE == "webhook" and not cls.WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL environment variable is required in webhook mode")
+        if cls.BOT_MODE == "webhook" and not cls.WEBHOOK_SECRET_TOKEN:
+            raise ValueError("WEBHOOK_SECRET_TOKEN is required in webhook mode")
+        if cls.STATE_BACKEND not in ("sqlite", "redis", "memory"):
+            raise ValueError("STATE_BACKEND must be 'sqlite', 'redis' or 'memory'")
+        if cls.STATE_FLUSH_INTERVAL <= 0:
+            raise ValueError("STATE_FLUSH_INTERVAL must be positive")
+        if cls.OUTPUT_PRESET not in cls.OUTPUT_PRESETS:
+            raise ValueError(f"OUTPUT_PRESET must be one of {', '.join(cls.OUTPUT_PRESETS)}")
+        if cls.OUTPUT_FORMAT not in ("PNG", "JPEG", "WEBP"):
+            raise ValueError("OUTPUT_FORMAT must be PNG, JPEG or WEBP")
+        if cls.RENDER_CACHE_TTL <= 0:
+            raise ValueError("RENDER_CACHE_TTL must be positive")
+        if cls.UPLOAD_CONCURRENCY < 1:
+            raise ValueError("UPLOAD_CONCURRENCY must be at least 1")
+        if cls.DELIVERY_GLOBAL_RATE <= 0 or cls.DELIVERY_CHAT_RATE <= 0:
+            raise ValueError("DELIVERY_GLOBAL_RATE and DELIVERY_CHAT_RATE must be positive")
+        if cls.DELIVERY_MAX_ATTEMPTS < 1:
+            raise ValueError("DELIVERY_MAX_ATTEMPTS must be at least 1")
+        if any(backend not in ("sqlite", "jsonl") for backend in cls.LEDGER_BACKEND):
+            raise ValueError("LEDGER_BACKEND must list 'sqlite' and/or 'jsonl', or be 'none'")
+        if cls.LEDGER_FLUSH_INTERVAL <= 0:
+            raise ValueError("LEDGER_FLUSH_INTERVAL must be positive")
+        if not 0 < cls.CODE_INDEX_ERROR_RATE < 1:
+            raise ValueError("CODE_INDEX_ERROR_RATE must be between 0 and 1")
+        if cls.FILE_RELOAD_INTERVAL < 0:
+            raise ValueError("FILE_RELOAD_INTERVAL must not be negative")
+        if cls.CODE_INDEX_RECENT < 1:
+            raise ValueError("CODE_INDEX_RECENT must be positive")
+        if (
+            cls.DUPLICATE_CODE_CHECK
+            and cls.CODE_INDEX_SHARED
+            and "sqlite" not in cls.LEDGER_BACKEND
+        ):
+            raise ValueError("CODE_INDEX_SHARED needs the sqlite order ledger")
+        if cls.RENDER_POOL_TYPE not in ("thread", "process"):
+            raise ValueError("RENDER_POOL_TYPE must be 'thread' or 'process'")
+        if cls.RENDER_WORKERS < 1:
+            raise ValueError("RENDER_WORKERS must be at least 1")
+        if cls.RENDER_MEMORY_MAX_MB < 0 or cls.BUFFER_POOL_MAX_MB < 0:
+            raise ValueError("RENDER_MEMORY_MAX_MB and BUFFER_POOL_MAX_MB must not be negative")
+        if cls.RENDER_MEMORY_WAIT <= 0:
+            raise ValueError("RENDER_MEMORY_WAIT must be positive")
+        service_url = cls.RENDER_SERVICE_URL
+        if service_url and not service_url.startswith(("http://", "unix://")):
+            raise ValueError("RENDER_SERVICE_URL must start with http:// or unix://")
+        if cls.RENDER_SERVICE_MAX_BODY < 1024:
+            raise ValueError("RENDER_SERVICE_MAX_BODY must be at least 1024")
 
     @classmethod
     def setup_directories(cls) -> None:
         """Create necessary directories if they don't exist."""
         cls.TEMP_DIR.mkdir(exist_ok=True, parents=True)
+        cls.DEAD_LETTER_DB_PATH.parent.mkdir(exist_ok=True, parents=True)
+        if cls.STATE_BACKEND == "sqlite":
+            cls.STATE_DB_PATH.parent.mkdir(exist_ok=True, parents=True)
 
 
 # Create a singleton instance
@@ -1,5 +1,7 @@
 """Telegram bot handlers."""
 
+from .bulk_handler import BulkConversationHandler
 from .card_handler import CardConversationHandler
+from .update_processor import PerChatUpdateProcessor
 
-__all__ = ["CardConversationHandler"]
+__all__ = ["BulkConversationHandler", "CardConversationHandler", "PerChatUpdateProcessor"]
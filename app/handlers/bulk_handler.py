@@ -0,0 +1,369 @@
+"""Telegram conversation handler for bulk card generation."""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import (
+    CommandHandler,
+    ContextTypes,
+    ConversationHandler,
+    MessageHandler,
+    filters,
+)
+
+from app.config import settings
+from app.models import CardData
+from app.services import (
+    CodeIndex,
+    Delivery,
+    DeliveryError,
+    DeliveryQueue,
+    OrderLedger,
+    OrderRecord,
+    QuotaExceededError,
+    RenderPool,
+    RenderQueueFullError,
+    access_control,
+    create_delivery_queue,
+    user_quotas,
+)
+from app.services.bulk_orders import build_zip, parse_orders
+from app.services.order_ledger import DEAD_LETTER, DELIVERED, FAILED
+from app.utils import MESSAGES, ConversationStates
+from app.utils.clock import issue_stamp, local_now
+
+logger = logging.getLogger(__name__)
+
+# Telegram accepts at most 10 photos per media group
+MEDIA_GROUP_LIMIT = 10
+
+# Minimum seconds between progress message edits
+PROGRESS_INTERVAL_SECONDS = 2.0
+
+# Maximum number of row errors listed back to the user
+MAX_REPORTED_ERRORS = 10
+
+# Times a card waits out a full render queue before the batch gives up
+RENDER_ATTEMPTS = 10
+
+
+class BulkConversationHandler:
+    """Handles the /bulk flow: upload a list of orders, receive all the cards."""
+
+    def __init__(
+        self,
+        order_ledger: Optional[OrderLedger] = None,
+        code_index: Optional[CodeIndex] = None,
+        render_pool: Optional[RenderPool] = None,
+        delivery_queue: Optional[DeliveryQueue] = None,
+    ):
+        """
+        Initialize the bulk handler.
+
+        Args:
+            order_ledger: Ledger recording every issued card (None records nothing)
+            code_index: Index of issued activation codes (None skips the duplicate check)
+            render_pool: Pool or render service rendering the cards, shared with
+                single cards (defaults to a new pool from the settings)
+            delivery_queue: Queue sending the cards, shared with single cards
+                (defaults to a new queue from the settings)
+        """
+        self.order_ledger = order_ledger
+        self.code_index = code_index
+        self.render_pool = render_pool or RenderPool()
+        self.delivery_queue = delivery_queue or create_delivery_queue()
+        # Chats with a batch in progress
+        self._running: Set[int] = set()
+
+    async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """
+        Handle the /bulk command - ask for the order list.
+
+        Args:
+            update: Telegram update object
+            context: Telegram context
+
+        Returns:
+            Next conversation state
+        """
+        if not access_control.is_authorized(update.effective_user.id):
+            await update.message.reply_text(MESSAGES["unauthorized"])
+            return ConversationHandler.END
+
+        await update.message.reply_text(MESSAGES["bulk_instructions"])
+        return ConversationStates.BULK_INPUT
+
+    async def handle_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """
+        Handle an uploaded CSV file or pasted list and send back the cards.
+
+        Args:
+            update: Telegram update object
+            context: Telegram context
+
+        Returns:
+            Next conversation state
+        """
+        if not access_control.is_authorized(update.effective_user.id):
+            await update.message.reply_text(MESSAGES["unauthorized"])
+            return ConversationHandler.END
+
+        if update.message.document:
+            file = await update.message.document.get_file()
+            text = bytes(await file.download_as_bytearray()).decode("utf-8-sig", "replace")
+        else:
+            text = update.message.text
+
+        now = local_now()
+        cards, errors = parse_orders(text, *issue_stamp(now))
+        # New codes are claimed right away, so an operator entering one of them meanwhile is
+        # warned; the claims are released if the batch does not run
+        loop = asyncio.get_running_loop()
+        duplicates, claimed = await loop.run_in_executor(None, self._claim_codes, cards)
+        errors.extend(duplicates)
+        running = False
+        try:
+            if errors:
+                listed = "\n".join(errors[:MAX_REPORTED_ERRORS])
+                await update.message.reply_text(MESSAGES["bulk_invalid"].format(errors=listed))
+                return ConversationStates.BULK_INPUT
+            if not cards:
+                await update.message.reply_text(MESSAGES["bulk_empty"])
+                return ConversationStates.BULK_INPUT
+            if len(cards) > settings.BATCH_MAX_CARDS:
+                await update.message.reply_text(
+                    MESSAGES["bulk_too_many"].format(limit=settings.BATCH_MAX_CARDS)
+                )
+                return ConversationStates.BULK_INPUT
+            if update.effective_chat.id in self._running:
+                await update.message.reply_text(MESSAGES["bulk_busy"])
+                return ConversationHandler.END
+
+            try:
+                # The whole batch counts against the operator's card quota
+                with user_quotas.slot(update.effective_user.id, cards=len(cards)):
+                    running = True
+                    await self._run_batch(update, context, cards, now)
+            except QuotaExceededError as e:
+                seconds = max(1, round(e.retry_after))
+                await update.message.reply_text(MESSAGES["bulk_quota"].format(seconds=seconds))
+                return ConversationStates.BULK_INPUT
+        finally:
+            if not running:
+                self._release(claimed)
+
+        return ConversationHandler.END
+
+    async def _run_batch(
+        self,
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        cards: List[CardData],
+        now: datetime,
+    ) -> None:
+        """
+        Generate a batch of cards and send them back as an album or ZIP file.
+
+        Args:
+            update: Telegram update object
+            context: Telegram context
+            cards: Parsed orders
+            now: Local time the batch was requested
+        """
+        chat_id = update.effective_chat.id
+        user_id = update.effective_user.id
+        self._running.add(chat_id)
+        total = len(cards)
+        status = await update.message.reply_text(
+            MESSAGES["bulk_progress"].format(done=0, total=total)
+        )
+        last_report = [time.monotonic()]
+
+        async def edit_status(text: str) -> None:
+            """Edit the status message; a failed edit does not stop the batch."""
+            try:
+                await status.edit_text(text)
+            except TelegramError as e:
+                logger.debug(f"Could not edit bulk status message: {e}")
+
+        async def report_progress(done: int) -> None:
+            """Edit the status message, at most once per interval."""
+            now_seconds = time.monotonic()
+            if done < total and now_seconds - last_report[0] >= PROGRESS_INTERVAL_SECONDS:
+                last_report[0] = now_seconds
+                await edit_status(MESSAGES["bulk_progress"].format(done=done, total=total))
+
+        started = time.perf_counter()
+        try:
+            try:
+                images = await self._render(cards, report_progress)
+            except Exception as e:
+                logger.error(f"Error generating bulk batch: {e}")
+                self._record(user_id, cards, FAILED)
+                await update.message.reply_text(MESSAGES["bulk_failed"])
+                return
+            render_seconds = (time.perf_counter() - started) / total
+
+            try:
+                await self._deliver(context, chat_id, cards, images, now)
+            except DeliveryError:
+                # The cards were issued and are kept for /replay
+                self._record(user_id, cards, DEAD_LETTER, render_seconds)
+                await update.message.reply_text(MESSAGES["delivery_failed"])
+                return
+
+            self._record(user_id, cards, DELIVERED, render_seconds)
+            await edit_status(MESSAGES["bulk_done"].format(total=total))
+            logger.info(f"Bulk batch of {total} cards sent to user {user_id}")
+
+        finally:
+            self._running.discard(chat_id)
+
+    async def _render(
+        self, cards: List[CardData], progress: Callable[[int], Awaitable[None]]
+    ) -> List[bytes]:
+        """
+        Render a batch on the shared render pool, a pool's worth of cards at a time.
+
+        Rendering in chunks keeps a batch from filling the render queue ahead of
+        single cards, and keeps the pool's memory cap in force.
+
+        Args:
+            cards: Parsed orders
+            progress: Called with the number of cards rendered after each chunk
+
+        Returns:
+            Encoded card images, in the same order as ``cards``
+        """
+        images: List[bytes] = []
+        chunk_size = self.render_pool.workers
+        for start in range(0, len(cards), chunk_size):
+            chunk = cards[start : start + chunk_size]
+            images.extend(await asyncio.gather(*(self._render_card(card) for card in chunk)))
+            await progress(len(images))
+        return images
+
+    async def _render_card(self, card: CardData) -> bytes:
+        """Render one card of a batch, waiting while the render queue is full."""
+        for attempt in range(1, RENDER_ATTEMPTS + 1):
+            try:
+                return await self.render_pool.render(card.to_dict())
+            except RenderQueueFullError as e:
+                if attempt == RENDER_ATTEMPTS:
+                    raise
+                await asyncio.sleep(max(0.1, e.estimated_wait))
+        raise AssertionError("unreachable")
+
+    async def _deliver(
+        self,
+        context: ContextTypes.DEFAULT_TYPE,
+        chat_id: int,
+        cards: List[CardData],
+        images: List[bytes],
+        now: datetime,
+    ) -> None:
+        """
+        Send a rendered batch through the delivery queue: an album, or a ZIP file if large.
+
+        Raises:
+            DeliveryError: If the batch could not be delivered (it is kept for /replay)
+        """
+        if len(images) <= MEDIA_GROUP_LIMIT:
+            deliveries = [Delivery(chat_id, image) for image in images]
+            await self.delivery_queue.send_media_group(context.bot, deliveries)
+            return
+
+        extension = settings.OUTPUT_FORMAT.lower().replace("jpeg", "jpg")
+        loop = asyncio.get_running_loop()
+        archive = await loop.run_in_executor(None, build_zip, cards, images, extension)
+        filename = f"cards_{now.strftime('%Y%m%d_%H%M')}.zip"
+        await self.delivery_queue.send_document(
+            context.bot, Delivery(chat_id, archive, filename=filename)
+        )
+
+    def _claim_codes(self, cards: List[CardData]) -> Tuple[List[str], List[str]]:
+        """
+        Claim the activation codes of a batch in the code index.
+
+        Blocks on the index's lock and possibly the SQLite ledger, so it runs off the event loop.
+
+        Returns:
+            Errors for the cards whose code was issued before or repeats in the batch,
+            and the codes claimed
+        """
+        if self.code_index is None:
+            return [], []
+        errors = []
+        claimed = []
+        for number, card in enumerate(cards, start=1):
+            code = card.activation_code
+            if self.code_index.check_and_add(code):
+                errors.append(f"card {number}: activation code {code} was already issued")
+            else:
+                claimed.append(code)
+        return errors, claimed
+
+    def _release(self, codes: List[str]) -> None:
+        """Release claimed codes whose cards will not be issued."""
+        if self.code_index is not None:
+            for code in codes:
+                self.code_index.discard(code)
+
+    def _record(
+        self,
+        user_id: int,
+        cards: List[CardData],
+        status: str,
+        render_seconds: Optional[float] = None,
+    ) -> None:
+        """Add the cards of a batch to the order ledger and the code index, if there are ones."""
+        if status == FAILED:
+            # Release the claims taken when the batch was uploaded
+            self._release([card.activation_code for card in cards])
+        elif self.code_index is not None:
+            for card in cards:
+                self.code_index.add(card.activation_code)
+        if self.order_ledger is not None:
+            for card in cards:
+                self.order_ledger.record(OrderRecord.create(user_id, card, status, render_seconds))
+
+    async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """
+        Handle /cancel command - abort the bulk flow.
+
+        Args:
+            update: Telegram update object
+            context: Telegram context
+
+        Returns:
+            Conversation end state
+        """
+        await update.message.reply_text(MESSAGES["cancelled"])
+        return ConversationHandler.END
+
+    def get_handler(self) -> ConversationHandler:
+        """
+        Get the configured conversation handler.
+
+        Returns:
+            ConversationHandler instance
+        """
+        return ConversationHandler(
+            entry_points=[CommandHandler("bulk", self.start)],
+            states={
+                ConversationStates.BULK_INPUT: [
+                    MessageHandler(
+                        filters.Document.ALL | (filters.TEXT & ~filters.COMMAND),
+                        self.handle_input,
+                    )
+                ],
+            },
+            fallbacks=[CommandHandler("cancel", self.cancel)],
+            name="bulk_conversation",
+            persistent=settings.STATE_BACKEND != "memory",
+        )
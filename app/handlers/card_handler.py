@@ -1,9 +1,9 @@
 """Telegram conversation handler for card generation."""
 
+import asyncio
 import logging
-import os
-from datetime import datetime, timedelta
-from pathlib import Path
+import time
+from typing import Dict, List, Optional, Tuple
 
 from telegram import ReplyKeyboardMarkup, Update
 from telegram.ext import (
@@ -16,22 +16,58 @@ from telegram.ext import (
 
 from app.config import settings
 from app.models import CardData
-from app.services import CardGeneratorService
+from app.services import (
+    CodeIndex,
+    Delivery,
+    DeliveryError,
+    OrderLedger,
+    OrderRecord,
+    QuotaExceededError,
+    RenderPool,
+    RenderQueueFullError,
+    access_control,
+    create_delivery_queue,
+    create_render_cache,
+    user_quotas,
+)
+from app.services.order_ledger import DEAD_LETTER, DELIVERED, FAILED
 from app.utils import MESSAGES, COUNTRY_KEYBOARD, PRICE_KEYBOARD, ConversationStates
+from app.utils.clock import issue_stamp
+from app.utils.metrics import (
+    CARD_ERRORS_TOTAL,
+    CARDS_TOTAL,
+    RENDER_CACHE_HITS_TOTAL,
+    RENDER_CACHE_MISSES_TOTAL,
+)
 
 logger = logging.getLogger(__name__)
 
+# Orders listed by /lookup
+LOOKUP_LIMIT = 10
+
 
 class CardConversationHandler:
     """Handles the conversation flow for card generation."""
 
-    def __init__(self):
-        """Initialize the conversation handler."""
-        self.card_generator = CardGeneratorService()
+    def __init__(
+        self,
+        order_ledger: Optional[OrderLedger] = None,
+        code_index: Optional[CodeIndex] = None,
+        render_pool: Optional[RenderPool] = None,
+    ):
+        """
+        Initialize the conversation handler.
 
-    def _is_authorized(self, user_id: int) -> bool:
-        """Check if the user is authorized to use the bot."""
-        return user_id == settings.AUTHORIZED_USER_ID
+        Args:
+            order_ledger: Ledger recording every issued card (None records nothing)
+            code_index: Index of issued activation codes (None skips the duplicate check)
+            render_pool: Pool rendering the cards (defaults to a new pool from the settings)
+        """
+        self.order_ledger = order_ledger
+        self.code_index = code_index
+        self.render_pool = render_pool or RenderPool()
+        self.render_cache = create_render_cache()
+        self.delivery_queue = create_delivery_queue()
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """
@@ -44,7 +80,7 @@ class CardConversationHandler:
         Returns:
             Next conversation state
         """
-        if not self._is_authorized(update.effective_user.id):
+        if not access_control.is_authorized(update.effective_user.id):
             await update.message.reply_text(MESSAGES["unauthorized"])
             return ConversationHandler.END
 
@@ -101,7 +137,26 @@ class CardConversationHandler:
         """
         user_input = update.message.text.strip()
         formatted_code = CardData.format_activation_code(user_input)
+
+        # A code that was issued before needs to be sent a second time to confirm it. A new
+        # code is claimed right away, so an operator entering it at the same time is warned
+        claimed = False
+        if (
+            self.code_index is not None
+            and context.user_data.pop("duplicate_code", None) != formatted_code
+        ):
+            loop = asyncio.get_running_loop()
+            if await loop.run_in_executor(None, self.code_index.check_and_add, formatted_code):
+                logger.info(f"User {update.effective_user.id} entered an issued code")
+                context.user_data["duplicate_code"] = formatted_code
+                await update.message.reply_text(MESSAGES["duplicate_code"])
+                return ConversationStates.CODE
+            claimed = True
+
         context.user_data["activation_code"] = formatted_code
+        # Only a claim this conversation took may be released; a confirmed duplicate's claim
+        # belongs to whichever order entered the code first
+        context.user_data["code_claimed"] = claimed
 
         await update.message.reply_text(MESSAGES["enter_name"])
         return ConversationStates.NAME
@@ -117,47 +172,243 @@ class CardConversationHandler:
         Returns:
             Conversation end state
         """
-        if not self._is_authorized(update.effective_user.id):
+        if not access_control.is_authorized(update.effective_user.id):
             await update.message.reply_text(MESSAGES["unauthorized"])
             return ConversationHandler.END
 
-        # Get current time with timezone offset
-        now = datetime.utcnow() + timedelta(hours=settings.TIMEZONE_OFFSET_HOURS)
+        price = context.user_data["price"]
+        country = context.user_data["country"]
+        code = context.user_data["activation_code"]
+        customer_name = update.message.text.strip()
+        claimed = context.user_data.get("code_claimed", False)
+
+        # A resent order keeps the date and time of the original card, so it is the same card
+        # and comes from the render cache; a claimed code is new and has no earlier order
+        stamp = None
+        if not claimed and self.order_ledger is not None:
+            loop = asyncio.get_running_loop()
+            stamp = await loop.run_in_executor(
+                None, self._original_stamp, price, country, code, customer_name
+            )
+        # Otherwise the current local date and time, formatted once per minute
+        issue_date, issue_time = stamp or issue_stamp()
 
         # Create card data
         card_data = CardData(
-            price=context.user_data["price"],
-            country=context.user_data["country"],
-            activation_code=context.user_data["activation_code"],
-            customer_name=update.message.text.strip(),
-            issue_date=now.strftime("%Y-%m-%d"),
-            issue_time=now.strftime("%I:%M %p"),
+            price=price,
+            country=country,
+            activation_code=code,
+            customer_name=customer_name,
+            issue_date=issue_date,
+            issue_time=issue_time,
         )
 
-        # Generate output path
-        output_path = settings.TEMP_DIR / f"output_{update.message.chat_id}_{now.timestamp()}.png"
-
+        user_id = update.effective_user.id
         try:
-            # Generate the card
-            self.card_generator.generate_card(card_data.to_dict(), output_path)
-
-            # Send the card to the user
-            with open(output_path, "rb") as photo:
-                await update.message.reply_photo(photo=photo)
-
-            logger.info(f"Card generated and sent to user {update.effective_user.id}")
+            # One operator may only have a few cards in progress at a time; a card the
+            # render queue turns away does not count against the rate quota
+            with user_quotas.slot(user_id, refund_on=(RenderQueueFullError,)):
+                render_seconds = await self._send_card(update, context, card_data.to_dict())
+            CARDS_TOTAL.inc()
+            self._record(user_id, card_data, DELIVERED, render_seconds)
+            logger.info(f"Card generated and sent to user {user_id}")
+
+        except RenderQueueFullError as e:
+            logger.warning(f"Render queue full, asking user to retry in {e.estimated_wait:.1f}s")
+            seconds = max(1, round(e.estimated_wait))
+            await update.message.reply_text(MESSAGES["busy"].format(seconds=seconds))
+            return ConversationStates.NAME
+
+        except QuotaExceededError as e:
+            logger.info(f"User {update.effective_user.id} over quota for {e.retry_after:.1f}s")
+            seconds = max(1, round(e.retry_after))
+            await update.message.reply_text(MESSAGES["busy"].format(seconds=seconds))
+            return ConversationStates.NAME
+
+        except DeliveryError:
+            CARD_ERRORS_TOTAL.inc()
+            self._record(user_id, card_data, DEAD_LETTER)
+            try:
+                await update.message.reply_text(MESSAGES["delivery_failed"])
+            except Exception as e:
+                logger.error(f"Could not report failed delivery: {e}")
 
         except Exception as e:
+            CARD_ERRORS_TOTAL.inc()
+            self._record(user_id, card_data, FAILED, claimed=claimed)
             logger.error(f"Error generating card: {e}")
             await update.message.reply_text("❌ حدث خطأ أثناء إنشاء البطاقة. حاول مرة أخرى.")
 
-        finally:
-            # Clean up the generated file
-            if output_path.exists():
-                os.remove(output_path)
-
+        # The order is done, so a later /cancel has no claim to release
+        context.user_data.pop("code_claimed", None)
         return ConversationHandler.END
 
+    def _original_stamp(
+        self, price: str, country: str, code: str, customer_name: str
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Find the issue date and time of an earlier card for the same order.
+
+        Queries the SQLite ledger, so it runs off the event loop.
+
+        Returns:
+            Issue date and time of the newest earlier card that did not fail, if any
+        """
+        if self.order_ledger is None:
+            return None
+        orders = self.order_ledger.find(
+            activation_code=code, customer_name=customer_name, limit=LOOKUP_LIMIT
+        )
+        for order in orders:
+            if order.price == price and order.country == country and order.status != FAILED:
+                return order.issue_date, order.issue_time
+        return None
+
+    def _record(
+        self,
+        user_id: int,
+        card_data: CardData,
+        status: str,
+        render_seconds: Optional[float] = None,
+        claimed: bool = False,
+    ) -> None:
+        """
+        Add a card to the order ledger and the code index, if there are ones.
+
+        Args:
+            user_id: Operator who ordered the card
+            card_data: The card
+            status: Order status
+            render_seconds: Time the card took to render
+            claimed: Whether this order claimed the code (a failed card releases the claim)
+        """
+        if self.code_index is not None:
+            if status == FAILED:
+                if claimed:
+                    self.code_index.discard(card_data.activation_code)
+            else:
+                self.code_index.add(card_data.activation_code)
+        if self.order_ledger is not None:
+            self.order_ledger.record(OrderRecord.create(user_id, card_data, status, render_seconds))
+
+    async def _send_card(
+        self, update: Update, context: ContextTypes.DEFAULT_TYPE, card: Dict[str, str]
+    ) -> Optional[float]:
+        """
+        Send a card, reusing an earlier upload or render of the same card if cached.
+
+        Args:
+            update: Telegram update object
+            context: Telegram context
+            card: Card data dictionary
+
+        Returns:
+            Seconds spent rendering the card, or None if it came from the cache
+
+        Raises:
+            RenderQueueFullError: If the card has to be rendered and the pool is full
+            DeliveryError: If the card could not be delivered (it is kept for /replay)
+        """
+        chat_id = update.effective_chat.id
+        render_seconds: Optional[float] = None
+        if self.render_cache is None:
+            started = time.perf_counter()
+            photo = await self.render_pool.render(card)
+            render_seconds = time.perf_counter() - started
+            await self.delivery_queue.send_photo(context.bot, Delivery(chat_id, photo))
+            return render_seconds
+
+        # Cache lookups may touch the disk tier, so keep them off the event loop
+        loop = asyncio.get_running_loop()
+        cache = self.render_cache
+        key = await loop.run_in_executor(None, cache.key, card)
+
+        file_id = await loop.run_in_executor(None, cache.get_file_id, key)
+        if file_id is not None:
+            try:
+                await self.delivery_queue.send_photo(
+                    context.bot, Delivery(chat_id, file_id), dead_letter=False
+                )
+                RENDER_CACHE_HITS_TOTAL.inc(source="file_id")
+                return None
+            except DeliveryError as e:
+                logger.warning(f"Cached photo not delivered, uploading again: {e.cause}")
+                await loop.run_in_executor(None, cache.forget_file_id, key)
+
+        cached = await loop.run_in_executor(None, cache.get, key)
+        if cached is not None:
+            RENDER_CACHE_HITS_TOTAL.inc(source="image")
+            photo = cached
+        else:
+            RENDER_CACHE_MISSES_TOTAL.inc()
+            started = time.perf_counter()
+            photo = await self.render_pool.render(card)
+            render_seconds = time.perf_counter() - started
+            await loop.run_in_executor(None, cache.put, key, photo)
+
+        # Send the card to the user straight from memory
+        message = await self.delivery_queue.send_photo(context.bot, Delivery(chat_id, photo))
+        if message.photo:
+            await loop.run_in_executor(None, cache.set_file_id, key, message.photo[-1].file_id)
+        return render_seconds
+
+    async def replay(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Handle the /replay command - resend cards whose delivery failed.
+
+        Args:
+            update: Telegram update object
+            context: Telegram context
+        """
+        if not access_control.is_authorized(update.effective_user.id, role="admin"):
+            await update.message.reply_text(MESSAGES["unauthorized"])
+            return
+
+        replayed = await self.delivery_queue.replay(context.bot)
+        remaining = 0
+        if self.delivery_queue.dead_letters is not None:
+            loop = asyncio.get_running_loop()
+            remaining = await loop.run_in_executor(None, self.delivery_queue.dead_letters.count)
+        await update.message.reply_text(
+            MESSAGES["replay_done"].format(replayed=replayed, remaining=remaining)
+        )
+
+    async def lookup(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Handle the /lookup command - find issued cards by activation code or customer name.
+
+        Args:
+            update: Telegram update object
+            context: Telegram context
+        """
+        if not access_control.is_authorized(update.effective_user.id):
+            await update.message.reply_text(MESSAGES["unauthorized"])
+            return
+        if self.order_ledger is None or self.order_ledger.sqlite is None:
+            await update.message.reply_text(MESSAGES["lookup_disabled"])
+            return
+        query = " ".join(context.args or []).strip()
+        if not query:
+            await update.message.reply_text(MESSAGES["lookup_usage"])
+            return
+
+        def find() -> List[OrderRecord]:
+            """Look the query up as an activation code, then as a customer name."""
+            code = CardData.format_activation_code(query)
+            orders = self.order_ledger.find(activation_code=code, limit=LOOKUP_LIMIT)
+            return orders or self.order_ledger.find(customer_name=query, limit=LOOKUP_LIMIT)
+
+        orders = await asyncio.get_running_loop().run_in_executor(None, find)
+        if not orders:
+            await update.message.reply_text(MESSAGES["lookup_none"])
+            return
+        lines = [
+            f"{order.issue_date} {order.issue_time} | {order.price} {order.country} | "
+            f"{order.activation_code} | {order.customer_name} | {order.status}"
+            for order in orders
+        ]
+        await update.message.reply_text("\n".join(lines))
+
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """
         Handle /cancel command - abort the conversation.
@@ -169,6 +420,14 @@ class CardConversationHandler:
         Returns:
             Conversation end state
         """
+        code = context.user_data.pop("activation_code", None)
+        if (
+            self.code_index is not None
+            and code is not None
+            and context.user_data.pop("code_claimed", False)
+        ):
+            # The card will not be issued, so release the code's claim
+            self.code_index.discard(code)
         await update.message.reply_text(MESSAGES["cancelled"])
         return ConversationHandler.END
 
@@ -196,4 +455,6 @@ class CardConversationHandler:
                 ],
             },
             fallbacks=[CommandHandler("cancel", self.cancel)],
+            name="card_conversation",
+            persistent=settings.STATE_BACKEND != "memory",
         )
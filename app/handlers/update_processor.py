@@ -0,0 +1,65 @@
+"""Update processor that runs different chats concurrently and each chat in order."""
+
+import asyncio
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates from different chats concurrently, one at a time per chat.
+
+    Conversation state is saved only after a handler returns, so a user who
+    answers quickly could otherwise have their next message handled in the
+    previous state.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        """
+        Initialize the processor.
+
+        Args:
+            max_concurrent_updates: Maximum number of updates processed at once
+        """
+        super().__init__(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiting: Dict[int, int] = {}
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        """
+        Await the update's coroutine while holding its chat's lock.
+
+        Args:
+            update: The update to be processed
+            coroutine: The coroutine that processes the update
+        """
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            await coroutine
+            return
+
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        self._waiting[chat_id] = self._waiting.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            self._waiting[chat_id] -= 1
+            if not self._waiting[chat_id]:
+                del self._waiting[chat_id]
+                del self._locks[chat_id]
+
+    async def initialize(self) -> None:
+        """Nothing to set up."""
+
+    async def shutdown(self) -> None:
+        """Nothing to tear down."""
+
+    @staticmethod
+    def _chat_id(update: object) -> Optional[int]:
+        """Get the chat an update belongs to, if any."""
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
@@ -45,8 +45,15 @@ class CardData:
         return f"يا {self.customer_name}"
 
     def to_dict(self) -> dict:
-        """Convert card data to dictionary for image generation."""
+        """
+        Convert card data to dictionary for image generation.
+
+        The Arabic keys are the fields drawn on the card; ``price`` and
+        ``country`` are used to pick the card's layout.
+        """
         return {
+            "price": self.price,
+            "country": self.country,
             "الفئة": self.category,
             "رمز التفعيل": self.activation_code,
             "اسم العميل": self.formatted_name,
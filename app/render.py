@@ -0,0 +1,145 @@
+"""
+Headless card renderer.
+
+Renders cards from a CSV/text list or JSON Lines file (or stdin) without a bot
+token, for scripts and cron jobs:
+
+    python -m app.render orders.csv --output-dir cards/
+    python -m app.render orders.jsonl --tar - > cards.tar
+"""
+
+import argparse
+import io
+import logging
+import sys
+import tarfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from app.config import settings
+from app.services import CardGeneratorService
+from app.services.bulk_orders import parse_jsonl_orders, parse_orders
+from app.utils.clock import issue_stamp
+
+logger = logging.getLogger("app.render")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        prog="python -m app.render", description="Render PlayStation cards without the bot."
+    )
+    parser.add_argument("input", help="CSV/text or JSONL file with orders, or - for stdin")
+    parser.add_argument(
+        "--input-format",
+        choices=["auto", "csv", "jsonl"],
+        default="auto",
+        help="input format (default: detected from the file extension or content)",
+    )
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--output-dir", type=Path, help="directory to write card images to")
+    output.add_argument("--tar", help="tar file to stream card images to, or - for stdout")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="worker processes (default: BATCH_WORKERS)"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["PNG", "JPEG", "WEBP"],
+        type=str.upper,
+        default=None,
+        help="image format (default: OUTPUT_FORMAT)",
+    )
+    parser.add_argument(
+        "--preset",
+        choices=sorted(settings.OUTPUT_PRESETS),
+        default=None,
+        help="output size preset (default: OUTPUT_PRESET)",
+    )
+    parser.add_argument("--date", help="issue date for rows without one (default: today)")
+    parser.add_argument("--time", help="issue time for rows without one (default: now)")
+    return parser.parse_args(argv)
+
+
+def read_input(source: str) -> str:
+    """Read the order list from a file or stdin."""
+    if source == "-":
+        return sys.stdin.read()
+    return Path(source).read_text(encoding="utf-8-sig")
+
+
+def detect_format(source: str, text: str) -> str:
+    """Guess whether the input is JSON Lines or CSV/text."""
+    if source.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if source.endswith((".csv", ".txt")):
+        return "csv"
+    return "jsonl" if text.lstrip().startswith("{") else "csv"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Render every order in the input and report throughput."""
+    logging.basicConfig(
+        format=settings.LOG_FORMAT,
+        level=getattr(logging, settings.LOG_LEVEL.upper()),
+        handlers=[logging.StreamHandler(sys.stderr)],
+    )
+    args = parse_args(argv)
+
+    issue_date, issue_time = issue_stamp()
+    issue_date = args.date or issue_date
+    issue_time = args.time or issue_time
+
+    text = read_input(args.input)
+    input_format = args.input_format
+    if input_format == "auto":
+        input_format = detect_format(args.input, text)
+    parser = parse_jsonl_orders if input_format == "jsonl" else parse_orders
+    cards, errors = parser(text, issue_date, issue_time)
+
+    for error in errors:
+        logger.error(f"Skipped line {error}")
+    if not cards:
+        logger.error("No valid orders to render")
+        return 1
+
+    output_format = args.format or settings.OUTPUT_FORMAT
+    extension = output_format.lower().replace("jpeg", "jpg")
+    generator = CardGeneratorService()
+
+    tar: Optional[tarfile.TarFile] = None
+    if args.tar == "-":
+        tar = tarfile.open(fileobj=sys.stdout.buffer, mode="w|")
+    elif args.tar:
+        tar = tarfile.open(args.tar, mode="w")
+    else:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    started = time.perf_counter()
+    try:
+        images = generator.iter_batch(
+            [card.to_dict() for card in cards], args.workers, output_format, args.preset
+        )
+        for index, (card, image) in enumerate(zip(cards, images), start=1):
+            name = f"{index:05d}_{card.activation_code}.{extension}"
+            if tar is not None:
+                info = tarfile.TarInfo(name)
+                info.size = len(image)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(image))
+            else:
+                (args.output_dir / name).write_bytes(image)
+    finally:
+        if tar is not None:
+            tar.close()
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Rendered {len(cards)} cards in {elapsed:.2f}s "
+        f"({len(cards) / elapsed:.2f} cards/sec), skipped {len(errors)}"
+    )
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""
+Render service.
+
+Serves card renders to the bot from pre-forked worker processes that share one
+warmed-up template, font and variant cache:
+
+    python -m app.render_server
+    python -m app.render_server --listen unix:///run/fggstore/render.sock --workers 4
+
+Point the bot at it with ``RENDER_SERVICE_URL``.
+"""
+
+import argparse
+import logging
+import sys
+from typing import List, Optional
+
+from app.config import settings
+from app.services import RenderServer
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        prog="python -m app.render_server", description="Render cards for the bot over HTTP."
+    )
+    parser.add_argument(
+        "--listen",
+        default=None,
+        help="http://host:port or unix:///path to listen on (default: RENDER_SERVICE_LISTEN)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="worker processes (default: RENDER_WORKERS)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the render service until it is stopped."""
+    logging.basicConfig(
+        format=settings.LOG_FORMAT,
+        level=getattr(logging, settings.LOG_LEVEL.upper()),
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+    args = parse_args(argv)
+    RenderServer(args.listen, args.workers).serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
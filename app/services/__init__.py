@@ -1,5 +1,97 @@
 """Business logic services."""
 
+from .access_control import (
+    AccessControl,
+    QuotaExceededError,
+    UserQuotas,
+    access_control,
+    user_quotas,
+)
+from .buffer_pool import BufferPool, buffer_pool
 from .card_generator import CardGeneratorService
+from .code_index import BloomFilter, CodeIndex, create_code_index
+from .delivery import (
+    DeadLetterStore,
+    Delivery,
+    DeliveryError,
+    DeliveryQueue,
+    TokenBucket,
+    create_delivery_queue,
+)
+from .glyph_atlas import GlyphAtlas, glyph_atlas
+from .layout_engine import Layout, LayoutEngine, LayoutError, layout_engine
+from .order_ledger import (
+    JsonlLedgerStore,
+    LedgerStore,
+    OrderLedger,
+    OrderRecord,
+    SQLiteLedgerStore,
+    create_order_ledger,
+)
+from .render_cache import RenderCache, create_render_cache
+from .render_pool import RenderPool, RenderQueueFullError
+from .render_service import (
+    RenderServer,
+    RenderServiceClient,
+    RenderServiceError,
+    create_render_pool,
+)
+from .resource_cache import ResourceCache, resource_cache
+from .state_store import (
+    RedisStateStore,
+    SharedStateApplication,
+    SQLiteStateStore,
+    StatePersistence,
+    StateStore,
+    create_persistence,
+)
+from .variant_cache import VariantCache
 
-__all__ = ["CardGeneratorService"]
+__all__ = [
+    "AccessControl",
+    "BloomFilter",
+    "BufferPool",
+    "CardGeneratorService",
+    "CodeIndex",
+    "DeadLetterStore",
+    "Delivery",
+    "DeliveryError",
+    "DeliveryQueue",
+    "GlyphAtlas",
+    "JsonlLedgerStore",
+    "Layout",
+    "LayoutEngine",
+    "LayoutError",
+    "LedgerStore",
+    "OrderLedger",
+    "OrderRecord",
+    "QuotaExceededError",
+    "RedisStateStore",
+    "RenderCache",
+    "RenderPool",
+    "RenderQueueFullError",
+    "RenderServer",
+    "RenderServiceClient",
+    "RenderServiceError",
+    "ResourceCache",
+    "SQLiteLedgerStore",
+    "SQLiteStateStore",
+    "SharedStateApplication",
+    "StatePersistence",
+    "StateStore",
+    "TokenBucket",
+    "UserQuotas",
+    "VariantCache",
+    "access_control",
+    "buffer_pool",
+    "create_code_index",
+    "create_delivery_queue",
+    "create_order_ledger",
+    "create_persistence",
+    "create_render_cache",
+    "create_render_pool",
+    "glyph_atlas",
+    "layout_engine",
+    "resource_cache",
+    "user_quotas",
+]
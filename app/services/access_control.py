@@ -0,0 +1,306 @@
+"""Authorized users, their roles and per-user quotas."""
+
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple, Type
+
+from app.config import settings
+
+from .delivery import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Roles in increasing order of access: operators make cards, admins also manage deliveries
+ROLES = ("operator", "admin")
+
+
+class AccessControl:
+    """
+    Allowlist of Telegram users and their roles.
+
+    Users come from ``AUTHORIZED_USER_ID`` and ``AUTHORIZED_USERS`` in the
+    environment, an optional users file (one ``user_id [role]`` per line) and
+    an optional SQLite table ``authorized_users(user_id, role)``. They are
+    merged into one dictionary, so a lookup is a single hash probe. The file
+    and database are checked for changes at most every ``reload_interval``
+    seconds and reloaded without a restart; a source that fails to reload
+    keeps its previous users.
+    """
+
+    def __init__(
+        self,
+        users_file: Optional[Path] = None,
+        users_db: Optional[Path] = None,
+        reload_interval: Optional[float] = None,
+    ):
+        """
+        Initialize the access control.
+
+        Args:
+            users_file: Users file (defaults to settings.AUTHORIZED_USERS_FILE)
+            users_db: SQLite database of users (defaults to settings.AUTHORIZED_USERS_DB)
+            reload_interval: Seconds between change checks
+                (defaults to settings.ACCESS_RELOAD_INTERVAL)
+        """
+        self.users_file = users_file or settings.AUTHORIZED_USERS_FILE
+        self.users_db = users_db or settings.AUTHORIZED_USERS_DB
+        self.reload_interval = (
+            settings.ACCESS_RELOAD_INTERVAL if reload_interval is None else reload_interval
+        )
+        self._env_users: Dict[int, str] = {}
+        self._file_users: Dict[int, str] = {}
+        self._db_users: Dict[int, str] = {}
+        self._roles: Dict[int, str] = {}
+        self._file_mtime: Optional[float] = None
+        self._connection: Optional[sqlite3.Connection] = None
+        self._db_version: Optional[int] = None
+        self._checked = 0.0
+        self._loaded = False
+
+    @property
+    def users(self) -> Dict[int, str]:
+        """Every authorized user ID and its role."""
+        self._refresh_due()
+        return self._roles
+
+    def role(self, user_id: int) -> Optional[str]:
+        """
+        Get a user's role.
+
+        Args:
+            user_id: Telegram user ID
+
+        Returns:
+            The role, or None if the user is not authorized
+        """
+        self._refresh_due()
+        return self._roles.get(user_id)
+
+    def is_authorized(self, user_id: int, role: str = "operator") -> bool:
+        """
+        Check whether a user may use the bot.
+
+        Args:
+            user_id: Telegram user ID
+            role: Least role required
+
+        Returns:
+            True if the user has the role or a higher one
+        """
+        user_role = self.role(user_id)
+        return user_role is not None and ROLES.index(user_role) >= ROLES.index(role)
+
+    def load(self) -> None:
+        """
+        Load every source.
+
+        Raises:
+            ValueError: If AUTHORIZED_USERS, the users file or the database is invalid
+        """
+        self._env_users = parse_users(settings.AUTHORIZED_USERS, "AUTHORIZED_USERS")
+        if settings.AUTHORIZED_USER_ID is not None:
+            self._env_users[settings.AUTHORIZED_USER_ID] = "admin"
+        if self.users_file is not None:
+            self._file_users = self._read_file()
+            self._file_mtime = self.users_file.stat().st_mtime
+        if self.users_db is not None:
+            self._db_users = self._read_db()
+        self._merge()
+        self._loaded = True
+
+    def refresh_if_changed(self) -> bool:
+        """
+        Reload the users file or database if it changed.
+
+        Returns:
+            True if the users were reloaded
+        """
+        changed = False
+        if self.users_file is not None:
+            try:
+                mtime = self.users_file.stat().st_mtime
+                if mtime != self._file_mtime:
+                    # Remembered first so a broken file is reported once, not on every check
+                    self._file_mtime = mtime
+                    self._file_users = self._read_file()
+                    changed = True
+            except (OSError, ValueError) as e:
+                logger.error(f"Keeping previous users, could not reload {self.users_file}: {e}")
+        if self.users_db is not None:
+            try:
+                version = self._db_data_version()
+                if version != self._db_version:
+                    self._db_users = self._read_db()
+                    changed = True
+            except (sqlite3.Error, ValueError) as e:
+                logger.error(f"Keeping previous users, could not reload {self.users_db}: {e}")
+        if changed:
+            self._merge()
+        return changed
+
+    def _refresh_due(self) -> None:
+        """Load on first use, then check for changes once per interval."""
+        if not self._loaded:
+            self.load()
+            self._checked = time.monotonic()
+            return
+        now = time.monotonic()
+        if now - self._checked >= self.reload_interval:
+            self._checked = now
+            self.refresh_if_changed()
+
+    def _merge(self) -> None:
+        """Combine the sources; environment users take precedence."""
+        roles = dict(self._db_users)
+        roles.update(self._file_users)
+        roles.update(self._env_users)
+        self._roles = roles
+        logger.info(f"Access control loaded {len(roles)} authorized users")
+
+    def _read_file(self) -> Dict[int, str]:
+        """Parse the users file."""
+        return parse_users(self.users_file.read_text(encoding="utf-8"), self.users_file.name)
+
+    def _read_db(self) -> Dict[int, str]:
+        """Read the users table and remember the database version it reflects."""
+        if self._connection is None:
+            self.users_db.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(str(self.users_db), timeout=5.0)
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS authorized_users ("
+                    "user_id INTEGER PRIMARY KEY, role TEXT NOT NULL DEFAULT 'operator')"
+                )
+        rows = self._connection.execute("SELECT user_id, role FROM authorized_users").fetchall()
+        self._db_version = self._db_data_version()
+        users = {}
+        for user_id, role in rows:
+            if role not in ROLES:
+                raise ValueError(f"{self.users_db.name}: unknown role {role!r} for {user_id}")
+            users[int(user_id)] = role
+        return users
+
+    def _db_data_version(self) -> int:
+        """Get a counter that changes whenever another connection commits."""
+        if self._connection is None:
+            return -1
+        return self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+
+def parse_users(text: str, source: str) -> Dict[int, str]:
+    """
+    Parse a list of users.
+
+    Entries are separated by commas or new lines, each a user ID optionally
+    followed by a role (``123456789 admin`` or ``123456789:admin``). Lines
+    starting with ``#`` are comments; the role defaults to ``operator``.
+
+    Args:
+        text: Users list
+        source: Where the list came from, for error messages
+
+    Returns:
+        Roles by user ID
+
+    Raises:
+        ValueError: If an entry is invalid
+    """
+    users = {}
+    for line in text.splitlines():
+        line = line.split("#", 1)[0]
+        for entry in line.split(","):
+            parts = entry.replace(":", " ").split()
+            if not parts:
+                continue
+            role = parts[1].lower() if len(parts) > 1 else "operator"
+            if not parts[0].lstrip("-").isdigit() or role not in ROLES or len(parts) > 2:
+                raise ValueError(f"{source}: invalid user entry {entry.strip()!r}")
+            users[int(parts[0])] = role
+    return users
+
+
+class QuotaExceededError(Exception):
+    """Raised when a user has too many cards in progress or asks for them too fast."""
+
+    def __init__(self, retry_after: float):
+        """
+        Initialize the error.
+
+        Args:
+            retry_after: Estimated seconds until the user may try again
+        """
+        super().__init__(f"User quota exceeded (retry in {retry_after:.1f}s)")
+        self.retry_after = retry_after
+
+
+class UserQuotas:
+    """
+    Per-user limits on cards in progress and cards per minute.
+
+    Keeps one operator from filling the render pool while others wait: a user
+    may have ``max_concurrent`` cards rendering or sending at once and start
+    at most ``per_minute`` cards a minute (in bursts of up to that many).
+    """
+
+    def __init__(self, max_concurrent: Optional[int] = None, per_minute: Optional[float] = None):
+        """
+        Initialize the quotas.
+
+        Args:
+            max_concurrent: Cards in progress per user
+                (defaults to settings.USER_MAX_CONCURRENT_CARDS)
+            per_minute: Cards per user per minute (defaults to settings.USER_CARDS_PER_MINUTE)
+        """
+        self.max_concurrent = max_concurrent or settings.USER_MAX_CONCURRENT_CARDS
+        self.per_minute = per_minute or settings.USER_CARDS_PER_MINUTE
+        self._active: Dict[int, int] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+
+    @contextmanager
+    def slot(
+        self,
+        user_id: int,
+        cards: int = 1,
+        refund_on: Tuple[Type[BaseException], ...] = (),
+    ) -> Iterator[None]:
+        """
+        Hold one of the user's in-progress slots for the enclosed block.
+
+        Args:
+            user_id: Telegram user ID
+            cards: Cards the block produces, counted against the rate quota
+            refund_on: Errors meaning the cards were turned away before any work
+                started; the rate quota they took is given back
+
+        Raises:
+            QuotaExceededError: If the user is at either limit
+        """
+        if self._active.get(user_id, 0) >= self.max_concurrent:
+            raise QuotaExceededError(1.0)
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_minute / 60, self.per_minute)
+            self._buckets[user_id] = bucket
+        # A batch larger than the burst only has to wait for a full bucket
+        tokens = min(cards, self.per_minute)
+        if not bucket.try_acquire(tokens):
+            raise QuotaExceededError(bucket.wait_time(tokens))
+
+        self._active[user_id] = self._active.get(user_id, 0) + 1
+        try:
+            yield
+        except refund_on:
+            bucket.refund(tokens)
+            raise
+        finally:
+            self._active[user_id] -= 1
+            if not self._active[user_id]:
+                del self._active[user_id]
+
+
+# Shared allowlist and quotas used by the handlers
+access_control = AccessControl()
+user_quotas = UserQuotas()
@@ -0,0 +1,182 @@
+"""Reusable image buffers and accounting of the image memory a render takes."""
+
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+BufferKey = Tuple[str, Tuple[int, int]]
+
+# Per-thread memory usage of the render in progress
+_tracker = threading.local()
+
+
+def image_bytes(image: Image.Image) -> int:
+    """Bytes of pixel memory behind an image (Pillow stores multi-band pixels in 4 bytes)."""
+    pixel = 1 if image.mode in ("1", "L", "P") else 4
+    return image.width * image.height * pixel
+
+
+class MemoryUsage:
+    """Image memory held by one render, and the most it held at once."""
+
+    def __init__(self):
+        """Start with nothing held."""
+        self.current = 0
+        self.peak = 0
+
+    def allocate(self, nbytes: int) -> None:
+        """Record memory taken by the render."""
+        self.current += nbytes
+        self.peak = max(self.peak, self.current)
+
+    def free(self, nbytes: int) -> None:
+        """Record memory the render no longer holds."""
+        self.current -= nbytes
+
+
+@contextmanager
+def track_memory() -> Iterator[MemoryUsage]:
+    """
+    Account the image memory allocated by this thread inside the block.
+
+    The render path reports its buffers through ``allocated`` and ``freed``;
+    the usage's ``peak`` is what a container has to hold per render.
+    """
+    usage = MemoryUsage()
+    _tracker.usage = usage
+    try:
+        yield usage
+    finally:
+        _tracker.usage = None
+
+
+def allocated(nbytes: int) -> None:
+    """Record memory taken by the render in progress on this thread, if tracked."""
+    usage = getattr(_tracker, "usage", None)
+    if usage is not None:
+        usage.allocate(nbytes)
+
+
+def freed(nbytes: int) -> None:
+    """Record memory released by the render in progress on this thread, if tracked."""
+    usage = getattr(_tracker, "usage", None)
+    if usage is not None:
+        usage.free(nbytes)
+
+
+class BufferPool:
+    """
+    Full-size image buffers kept between renders.
+
+    Every card is drawn on a canvas the size of its template and, for JPEG,
+    converted to an RGB buffer of the same size. Allocating and freeing
+    buffers of several MB per card makes the allocator return memory to the
+    OS and fault it back in, and concurrent renders fragment the heap. The
+    pool hands out released buffers of the same mode and size instead,
+    filled by pasting into them. Idle buffers are kept up to a memory budget;
+    buffers released beyond it are left to the garbage collector.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        """
+        Initialize the pool.
+
+        Args:
+            max_bytes: Memory budget for idle buffers (defaults to settings.BUFFER_POOL_MAX_MB)
+        """
+        self.max_bytes = (
+            settings.BUFFER_POOL_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        )
+        self._lock = threading.Lock()
+        self._idle: Dict[BufferKey, List[Image.Image]] = {}
+        self._idle_bytes = 0
+
+    def acquire(self, mode: str, size: Tuple[int, int]) -> Image.Image:
+        """
+        Get a buffer with undefined contents.
+
+        Args:
+            mode: Image mode
+            size: Image size
+
+        Returns:
+            Buffer to draw on, to be handed back with ``release``
+        """
+        image = None
+        with self._lock:
+            idle = self._idle.get((mode, size))
+            if idle:
+                image = idle.pop()
+                self._idle_bytes -= image_bytes(image)
+        if image is None:
+            image = Image.new(mode, size)
+        allocated(image_bytes(image))
+        return image
+
+    def copy(self, image: Image.Image) -> Image.Image:
+        """
+        Get a buffer holding a copy of an image, like ``image.copy()``.
+
+        Args:
+            image: Image to copy
+
+        Returns:
+            Buffer to draw on, to be handed back with ``release``
+        """
+        buffer = self.acquire(image.mode, image.size)
+        buffer.paste(image, (0, 0))
+        return buffer
+
+    def convert_rgb(self, image: Image.Image) -> Image.Image:
+        """
+        Get a buffer holding an image converted to RGB, like ``image.convert("RGB")``.
+
+        Args:
+            image: RGB or RGBA image
+
+        Returns:
+            Buffer holding the converted image, to be handed back with ``release``
+        """
+        buffer = self.acquire("RGB", image.size)
+        # Pasting RGBA into RGB drops the alpha channel in place
+        buffer.paste(image, (0, 0))
+        return buffer
+
+    def release(self, image: Image.Image) -> None:
+        """
+        Hand back a buffer from ``acquire``, ``copy`` or ``convert_rgb``.
+
+        The buffer must not be used afterwards.
+
+        Args:
+            image: Buffer to reuse
+        """
+        nbytes = image_bytes(image)
+        freed(nbytes)
+        with self._lock:
+            if self._idle_bytes + nbytes > self.max_bytes:
+                return
+            self._idle.setdefault((image.mode, image.size), []).append(image)
+            self._idle_bytes += nbytes
+
+    def clear(self) -> None:
+        """Drop every idle buffer."""
+        with self._lock:
+            self._idle.clear()
+            self._idle_bytes = 0
+
+    @property
+    def size(self) -> int:
+        """Bytes taken by idle buffers."""
+        return self._idle_bytes
+
+
+# Shared pool used by the card generator
+buffer_pool = BufferPool()
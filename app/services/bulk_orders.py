@@ -0,0 +1,168 @@
+"""Parsing of bulk card orders from CSV files, plain text lists or JSON Lines."""
+
+import csv
+import io
+import json
+import zipfile
+from typing import List, Optional, Sequence, Tuple
+
+from app.models import CardData, CardPrice, Country
+
+# Delimiters accepted between the fields of a row
+DELIMITERS = ",;\t|"
+
+# First-row words that mark a header row
+HEADER_WORDS = ("price", "السعر", "القيمة")
+
+
+def parse_orders(text: str, issue_date: str, issue_time: str) -> Tuple[List[CardData], List[str]]:
+    """
+    Parse bulk orders, one card per row: price, country, code, customer name.
+
+    Args:
+        text: CSV content or a plain text list
+        issue_date: Issue date stamped on every card
+        issue_time: Issue time stamped on every card
+
+    Returns:
+        Parsed cards and a list of error messages for rejected rows
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return [], []
+
+    try:
+        dialect = csv.Sniffer().sniff(lines[0], delimiters=DELIMITERS)
+        delimiter = dialect.delimiter
+    except csv.Error:
+        delimiter = ","
+
+    cards: List[CardData] = []
+    errors: List[str] = []
+    rows = csv.reader(io.StringIO("\n".join(lines)), delimiter=delimiter)
+
+    for line_number, row in enumerate(rows, start=1):
+        fields = [field.strip() for field in row]
+        if line_number == 1 and fields and fields[0].lower() in HEADER_WORDS:
+            continue
+        if len(fields) < 4:
+            errors.append(f"{line_number}: expected 4 fields, got {len(fields)}")
+            continue
+
+        card = _make_card(
+            line_number,
+            fields[0],
+            fields[1],
+            fields[2],
+            delimiter.join(fields[3:]),
+            issue_date,
+            issue_time,
+            errors,
+        )
+        if card is not None:
+            cards.append(card)
+
+    return cards, errors
+
+
+def parse_jsonl_orders(
+    text: str, issue_date: str, issue_time: str
+) -> Tuple[List[CardData], List[str]]:
+    """
+    Parse bulk orders from JSON Lines, one object per card.
+
+    Each object needs ``price``, ``country``, ``code`` (or ``activation_code``)
+    and ``customer_name`` (or ``name``); ``issue_date`` and ``issue_time`` are
+    optional and default to the given values.
+
+    Args:
+        text: JSON Lines content
+        issue_date: Default issue date
+        issue_time: Default issue time
+
+    Returns:
+        Parsed cards and a list of error messages for rejected lines
+    """
+    cards: List[CardData] = []
+    errors: List[str] = []
+
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            errors.append(f"{line_number}: invalid JSON ({e.msg})")
+            continue
+        if not isinstance(row, dict):
+            errors.append(f"{line_number}: expected a JSON object")
+            continue
+
+        card = _make_card(
+            line_number,
+            str(row.get("price", "")),
+            str(row.get("country", "")),
+            str(row.get("code", row.get("activation_code", ""))),
+            str(row.get("customer_name", row.get("name", ""))),
+            str(row.get("issue_date", issue_date)),
+            str(row.get("issue_time", issue_time)),
+            errors,
+        )
+        if card is not None:
+            cards.append(card)
+
+    return cards, errors
+
+
+def _make_card(
+    line_number: int,
+    price: str,
+    country: str,
+    code: str,
+    customer_name: str,
+    issue_date: str,
+    issue_time: str,
+    errors: List[str],
+) -> Optional[CardData]:
+    """Validate one order row, recording an error if it is rejected."""
+    price, country = price.strip(), country.strip().upper()
+    code, customer_name = code.strip(), customer_name.strip()
+    if price and not price.endswith("$"):
+        price = f"{price}$"
+
+    if price not in {p.value for p in CardPrice}:
+        errors.append(f"{line_number}: unknown price {price}")
+    elif country not in {c.value for c in Country}:
+        errors.append(f"{line_number}: unknown country {country}")
+    elif not code or not customer_name:
+        errors.append(f"{line_number}: missing code or customer name")
+    else:
+        return CardData(
+            price=price,
+            country=country,
+            activation_code=CardData.format_activation_code(code),
+            customer_name=customer_name,
+            issue_date=issue_date,
+            issue_time=issue_time,
+        )
+    return None
+
+
+def build_zip(cards: Sequence[CardData], images: Sequence[bytes], extension: str) -> bytes:
+    """
+    Pack rendered cards into a ZIP archive.
+
+    Args:
+        cards: Card data, in the same order as the images
+        images: Encoded card images
+        extension: File extension of the images (e.g. "png")
+
+    Returns:
+        ZIP archive bytes
+    """
+    buffer = io.BytesIO()
+    # Images are already compressed, so store them as-is
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for index, (card, image) in enumerate(zip(cards, images), start=1):
+            archive.writestr(f"{index:03d}_{card.activation_code}.{extension}", image)
+    return buffer.getvalue()
@@ -1,66 +1,220 @@
 """Service for generating PlayStation card images."""
 
+import functools
 import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
 
 from PIL import Image, ImageDraw, ImageFont
 
 from app.config import settings
-from app.utils import POSITIONS, ArabicTextProcessor
+from app.utils import ArabicTextProcessor
+from app.utils.metrics import stage_timer
+
+from .buffer_pool import BufferPool, allocated, buffer_pool, freed, image_bytes
+from .font_fitter import FontFitter
+from .glyph_atlas import GlyphAtlas, glyph_atlas
+from .layout_engine import FieldLayout, Layout, LayoutEngine, layout_engine, preset_scale
+from .resource_cache import ResourceCache, resource_cache
+from .variant_cache import CATEGORY_FIELD, VariantCache
 
 logger = logging.getLogger(__name__)
 
 
+# Vocative prefix of customer names ("يا محمد"); "arabic_words" fields holding it are
+# reshaped word by word
+VOCATIVE = "يا"
+
+
+class TextPlacement(NamedTuple):
+    """A text string, its font, color and position on the card."""
+
+    xy: Tuple[float, float]
+    text: str
+    font: ImageFont.FreeTypeFont
+    fill: Tuple[int, int, int, int]
+
+
+class FieldTile(NamedTuple):
+    """A rendered field and the top-left corner where it goes on the card."""
+
+    image: Image.Image
+    origin: Tuple[int, int]
+
+
+# Generator, output format and preset owned by a batch worker process
+_batch_generator: Optional["CardGeneratorService"] = None
+_batch_format: Optional[str] = None
+_batch_preset: Optional[str] = None
+
+
+def _init_batch_worker(output_format: Optional[str] = None, preset: Optional[str] = None) -> None:
+    """Create and warm up the batch worker's card generator."""
+    global _batch_generator, _batch_format, _batch_preset
+    _batch_generator = CardGeneratorService()
+    _batch_generator.warm_up(preset)
+    _batch_format = output_format
+    _batch_preset = preset
+
+
+def _generate_batch_item(card_data: Dict[str, str]) -> bytes:
+    """Generate one card of a batch inside a worker process."""
+    if _batch_generator is None:
+        raise RuntimeError("Batch worker was started without _init_batch_worker")
+    return _batch_generator.generate_card_bytes(card_data, _batch_format, _batch_preset)
+
+
 class CardGeneratorService:
     """Handles the generation of PlayStation card images with custom data."""
 
-    def __init__(self):
-        """Initialize the card generator service."""
-        self.template_path = settings.TEMPLATE_PATH
-        self.font_path = settings.FONT_PATH
-        self.base_font_size = settings.BASE_FONT_SIZE
-        self.small_font_size = settings.SMALL_FONT_SIZE
+    # Fields whose rendered tiles are reused between cards
+    CACHED_FIELDS = ("الفئة",)
+    TILE_CACHE_SIZE = 64
+    TILE_MARGIN = 2
+
+    # Issue date and time: their tiles are shared by every card issued in the same minute
+    CLOCK_FIELDS = ("تاريخ الاصدار", "وقت الاصدار")
+    # Minutes whose tiles are kept, so renders still in flight at a rollover share them
+    CLOCK_MINUTES_KEPT = 2
+
+    def __init__(
+        self,
+        resources: Optional[ResourceCache] = None,
+        layouts: Optional[LayoutEngine] = None,
+        glyphs: Optional[GlyphAtlas] = None,
+        buffers: Optional[BufferPool] = None,
+    ):
+        """
+        Initialize the card generator service.
+
+        Args:
+            resources: Template and font cache (defaults to the shared cache)
+            layouts: Card layouts (defaults to the shared layout engine)
+            glyphs: Glyph atlas to draw text from (defaults to the shared atlas, unless
+                settings.GLYPH_ATLAS is off)
+            buffers: Pool of canvases to draw on (defaults to the shared pool, unless
+                settings.BUFFER_POOL is off)
+        """
         self.text_processor = ArabicTextProcessor()
+        self.resources = resources or resource_cache
+        self.layouts = layouts or layout_engine
+        if glyphs is None and settings.GLYPH_ATLAS:
+            # The shared atlas follows the reloads of the shared resource cache
+            shared = self.resources is resource_cache
+            glyphs = glyph_atlas if shared else GlyphAtlas(resources=self.resources)
+        self.glyphs = glyphs
+        if buffers is None and settings.BUFFER_POOL:
+            buffers = buffer_pool
+        self.buffers = buffers
+        self._tile_cache: "OrderedDict[Tuple, FieldTile]" = OrderedDict()
+        self._clock_tiles: "OrderedDict[Tuple[str, ...], Dict[Tuple, FieldTile]]" = OrderedDict()
+        self._tile_lock = threading.Lock()
+        # Font fitters and variant caches per layout, reset when the layouts reload
+        self._fitters: Dict[Tuple[str, str], FontFitter] = {}
+        self._variants: Dict[str, Optional[VariantCache]] = {}
+        self._layouts_version = self.layouts.version
+
+    def warm_up(self, preset: Optional[str] = None) -> None:
+        """
+        Preload templates, fonts and variants so the first card renders at full speed.
+
+        Args:
+            preset: Output preset to warm up (defaults to settings.OUTPUT_PRESET)
+        """
+        # Load the layouts and note their version before building on them, so the first
+        # card does not take the load for a reload and drop what is built here
+        base_layouts = list(self.layouts.layouts.values())
+        self._refresh_layouts()
+        scale = preset_scale(preset)
+        for base_layout in base_layouts:
+            layout = self.layouts.scaled(base_layout, scale)
+            sizes = {field.font_size for field in layout.fields.values() if field.align != "fit"}
+            self.resources.warm_up(
+                sorted(sizes), layout.template_path, layout.font_path, layout.scale
+            )
+            variants = self.get_variants(layout)
+            if variants is not None:
+                variants.build()
+
+    def reload_resources(self) -> None:
+        """Drop cached templates, fonts, layouts and tiles, e.g. after replacing them on disk."""
+        self.resources.invalidate()
+        self.layouts.load()
+        with self._tile_lock:
+            self._tile_cache.clear()
+            self._clock_tiles.clear()
+
+    def get_fitter(self, layout: Layout, field_name: str) -> FontFitter:
+        """
+        Get the font fitter of a fitted field, keeping its size hints between cards.
+
+        Args:
+            layout: Card layout
+            field_name: Name of a field with ``align = "fit"``
+
+        Returns:
+            Font fitter for the field
+        """
+        key = (layout.key, field_name)
+        fitter = self._fitters.get(key)
+        if fitter is None:
+            field = layout.fields[field_name]
+            fitter = FontFitter(
+                field.min_font_size, field.font_size, self.resources, layout.font_path
+            )
+            self._fitters[key] = fitter
+        return fitter
+
+    def get_variants(self, layout: Layout) -> Optional[VariantCache]:
+        """
+        Get the variant cache of a layout.
+
+        Args:
+            layout: Card layout
+
+        Returns:
+            Variant cache, or None if disabled or the layout has no category field
+        """
+        if layout.key not in self._variants:
+            variants = None
+            if settings.VARIANT_CACHE and CATEGORY_FIELD in layout.fields:
+                variants = VariantCache(
+                    functools.partial(self._render_field_tile, layout, CATEGORY_FIELD),
+                    self.resources,
+                    layout,
+                    settings.VARIANT_CACHE_DIR,
+                )
+            self._variants[layout.key] = variants
+        return self._variants[layout.key]
 
-    def generate_card(self, card_data: Dict[str, str], output_path: Path) -> None:
+    def generate_card(
+        self, card_data: Dict[str, str], output_path: Path, preset: Optional[str] = None
+    ) -> None:
         """
         Generate a PlayStation card image with the provided data.
 
         Args:
             card_data: Dictionary containing card information
             output_path: Path where the generated card will be saved
+            preset: Output size preset (defaults to settings.OUTPUT_PRESET)
 
         Raises:
             FileNotFoundError: If template or font files are not found
             Exception: If image generation fails
         """
         try:
-            # Open and prepare the base image
-            image = Image.open(self.template_path).convert("RGBA")
-            txt_layer = Image.new("RGBA", image.size, (255, 255, 255, 0))
-            draw = ImageDraw.Draw(txt_layer)
-
-            # Load fonts
-            font = ImageFont.truetype(str(self.font_path), self.base_font_size)
-            small_font = ImageFont.truetype(str(self.font_path), self.small_font_size)
-
-            # Draw each field on the card
-            for key, value in card_data.items():
-                position = POSITIONS.get(key)
-                if not position:
-                    continue
-
-                if key == "رمز التفعيل":
-                    self._draw_activation_code(draw, value, position, image.width)
-                elif key in ["تاريخ الاصدار", "وقت الاصدار"]:
-                    self._draw_datetime_field(draw, value, position, small_font)
-                else:
-                    self._draw_centered_field(draw, value, position, font, image.width, key)
-
-            # Combine layers and save
-            combined = Image.alpha_composite(image, txt_layer)
-            combined.save(output_path)
+            image = self.render_card(card_data, preset)
+            try:
+                with stage_timer("disk_io"):
+                    image.save(output_path)
+            finally:
+                self.release(image)
             logger.info(f"Card generated successfully: {output_path}")
 
         except FileNotFoundError as e:
@@ -70,93 +224,482 @@ class CardGeneratorService:
             logger.error(f"Error generating card: {e}")
             raise
 
-    def _draw_activation_code(
-        self, draw: ImageDraw.ImageDraw, code: str, position: Tuple[float, float], image_width: int
-    ) -> None:
+    def generate_card_bytes(
+        self,
+        card_data: Dict[str, str],
+        output_format: Optional[str] = None,
+        preset: Optional[str] = None,
+    ) -> bytes:
         """
-        Draw the activation code with dynamic font sizing to fit the box.
+        Generate a PlayStation card image and encode it in memory.
 
         Args:
-            draw: ImageDraw object
-            code: Activation code text
-            position: Position to draw the code
-            image_width: Width of the image
+            card_data: Dictionary containing card information
+            output_format: "PNG", "JPEG" or "WEBP" (defaults to settings.OUTPUT_FORMAT)
+            preset: Output size preset (defaults to settings.OUTPUT_PRESET)
+
+        Returns:
+            Encoded image bytes
+
+        Raises:
+            FileNotFoundError: If template or font files are not found
+            Exception: If image generation fails
         """
-        box_width = 320 * settings.SCALE_FACTOR
-        box_height = 70 * settings.SCALE_FACTOR
-        box_x = int((image_width - box_width) / 2)
-        box_y = int(position[1])
+        try:
+            image = self.render_card(card_data, preset)
+            try:
+                return self.encode(image, output_format, self.buffers)
+            finally:
+                self.release(image)
 
-        # Find the optimal font size
-        current_font_size = settings.CODE_MAX_FONT_SIZE
-        while current_font_size >= settings.CODE_MIN_FONT_SIZE:
-            test_font = ImageFont.truetype(str(self.font_path), current_font_size)
-            bbox = draw.textbbox((0, 0), code, font=test_font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
+        except FileNotFoundError as e:
+            logger.error(f"Required file not found: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error generating card: {e}")
+            raise
+
+    def generate_batch(
+        self,
+        cards: Sequence[Dict[str, str]],
+        workers: Optional[int] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+        output_format: Optional[str] = None,
+        preset: Optional[str] = None,
+    ) -> List[bytes]:
+        """
+        Generate and encode many cards, spreading them across worker processes.
+
+        Args:
+            cards: Card data dictionaries
+            workers: Number of worker processes (defaults to settings.BATCH_WORKERS)
+            progress: Called with (done, total) after each card
+            output_format: "PNG", "JPEG" or "WEBP" (defaults to settings.OUTPUT_FORMAT)
+            preset: Output size preset (defaults to settings.OUTPUT_PRESET)
+
+        Returns:
+            Encoded card images, in the same order as ``cards``
+        """
+        total = len(cards)
+        images: List[bytes] = []
+        for image in self.iter_batch(cards, workers, output_format, preset):
+            images.append(image)
+            if progress:
+                progress(len(images), total)
+        return images
+
+    def iter_batch(
+        self,
+        cards: Sequence[Dict[str, str]],
+        workers: Optional[int] = None,
+        output_format: Optional[str] = None,
+        preset: Optional[str] = None,
+    ) -> Iterator[bytes]:
+        """
+        Generate and encode many cards, yielding each one as soon as it is ready.
+
+        Resources are warmed up before the workers start, so on platforms that
+        fork the workers share the decoded template and fonts with this process.
+
+        Args:
+            cards: Card data dictionaries
+            workers: Number of worker processes (defaults to settings.BATCH_WORKERS)
+            output_format: "PNG", "JPEG" or "WEBP" (defaults to settings.OUTPUT_FORMAT)
+            preset: Output size preset (defaults to settings.OUTPUT_PRESET)
+
+        Yields:
+            Encoded card images, in the same order as ``cards``
+        """
+        workers = workers or settings.BATCH_WORKERS or os.cpu_count() or 1
+        workers = min(workers, len(cards))
+
+        self.warm_up(preset)
+        if workers <= 1:
+            for card_data in cards:
+                yield self.generate_card_bytes(card_data, output_format, preset)
+            return
+
+        chunksize = max(1, len(cards) // (workers * 4))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_batch_worker,
+            initargs=(output_format, preset),
+        ) as executor:
+            yield from executor.map(_generate_batch_item, cards, chunksize=chunksize)
+
+        logger.info(f"Batch of {len(cards)} cards generated with {workers} workers")
 
-            if text_width <= box_width and text_height <= box_height:
-                break
-            current_font_size -= 1
+    def render_card(self, card_data: Dict[str, str], preset: Optional[str] = None) -> Image.Image:
+        """
+        Draw the card data onto the template.
+
+        The card's layout picks the template and where each field goes, scaled
+        to the output preset so the card is drawn at its final size. Each
+        field is drawn onto a tile covering only its text and composited onto
+        a copy of the cached template, so no full-size text layer is
+        allocated; the copy is made in a canvas from the buffer pool. The
+        category comes pre-rendered from the variant cache, and tiles for
+        fields in ``CACHED_FIELDS`` are reused across cards, as are the date
+        and time tiles of cards issued in the same minute.
+
+        Args:
+            card_data: Dictionary containing card information
+            preset: Output size preset (defaults to settings.OUTPUT_PRESET)
+
+        Returns:
+            Rendered RGBA card image, to be handed back with ``release`` once encoded
+        """
+        # Start from a copy of the cached base image
+        with stage_timer("template_load"):
+            self.resources.refresh_if_due()
+            self._refresh_layouts()
+            layout = self.layouts.select(card_data, preset)
+            image = self._new_canvas(layout)
+            patch = None
+            variants = self.get_variants(layout)
+            if variants is not None:
+                patch = variants.get(card_data.get(CATEGORY_FIELD, ""))
+            if patch is not None:
+                image.paste(patch.image, patch.origin)
+
+        minute = tuple(card_data.get(field, "") for field in self.CLOCK_FIELDS)
+        for key, value in card_data.items():
+            if patch is not None and key == CATEGORY_FIELD:
+                continue
+            if key in self.CLOCK_FIELDS:
+                tile = self._get_clock_tile(layout, key, value, image.size, minute)
+            else:
+                tile = self._get_field_tile(layout, key, value, image.size)
+            if tile is not None:
+                # The tile, plus the crop and blend alpha_composite makes of the area under it
+                tile_bytes = 3 * image_bytes(tile.image)
+                allocated(tile_bytes)
+                with stage_timer("compositing"):
+                    image.alpha_composite(tile.image, tile.origin)
+                freed(tile_bytes)
+
+        return image
+
+    def release(self, image: Image.Image) -> None:
+        """
+        Hand back a card from ``render_card`` once it has been encoded or saved.
+
+        Args:
+            image: Rendered card, not to be used afterwards
+        """
+        if self.buffers is not None:
+            self.buffers.release(image)
+        else:
+            freed(image_bytes(image))
 
-        # Draw the code centered in the box
-        final_font = ImageFont.truetype(str(self.font_path), current_font_size)
-        text_width = draw.textlength(code, font=final_font)
-        text_height = final_font.getbbox(code)[3]
+    def _new_canvas(self, layout: Layout) -> Image.Image:
+        """Get a private copy of a layout's template to draw the card on."""
+        if self.buffers is not None:
+            template = self.resources.get_template(layout.template_path, layout.scale)
+            return self.buffers.copy(template)
+        image = self.resources.new_canvas(layout.template_path, layout.scale)
+        allocated(image_bytes(image))
+        return image
 
-        x_text = box_x + (box_width - text_width) / 2
-        y_text = box_y + (box_height - text_height) / 2
+    def _refresh_layouts(self) -> None:
+        """Reload changed layout files and drop state built from the old layouts."""
+        self.layouts.refresh_if_due()
+        if self._layouts_version != self.layouts.version:
+            self._fitters = {}
+            self._variants = {}
+            self._layouts_version = self.layouts.version
 
-        draw.text((x_text, y_text), code, font=final_font, fill=(255, 255, 255, 255))
+    def _get_field_tile(
+        self, layout: Layout, field_name: str, value: str, image_size: Tuple[int, int]
+    ) -> Optional[FieldTile]:
+        """
+        Get the rendered tile for a field, from the tile cache when possible.
+
+        Args:
+            layout: Card layout
+            field_name: Name of the field
+            value: Field value
+            image_size: Size of the card image
+
+        Returns:
+            Rendered tile, or None if the field has no position on the card
+        """
+        cacheable = field_name in self.CACHED_FIELDS
+        key = (
+            layout.key,
+            field_name,
+            value,
+            image_size,
+            self.resources.version,
+            self.layouts.version,
+        )
+        if cacheable:
+            with self._tile_lock:
+                tile = self._tile_cache.get(key)
+                if tile is not None:
+                    self._tile_cache.move_to_end(key)
+                    return tile
 
-    def _draw_datetime_field(
+        tile = self._render_field_tile(layout, field_name, value, image_size)
+        if tile is None:
+            return None
+
+        if cacheable:
+            with self._tile_lock:
+                self._tile_cache[key] = tile
+                while len(self._tile_cache) > self.TILE_CACHE_SIZE:
+                    self._tile_cache.popitem(last=False)
+        return tile
+
+    def _get_clock_tile(
         self,
-        draw: ImageDraw.ImageDraw,
-        text: str,
-        position: Tuple[float, float],
-        font: ImageFont.FreeTypeFont,
-    ) -> None:
+        layout: Layout,
+        field_name: str,
+        value: str,
+        image_size: Tuple[int, int],
+        minute: Tuple[str, ...],
+    ) -> Optional[FieldTile]:
         """
-        Draw date or time fields (small font, white color).
+        Get the rendered tile for the issue date or time, shared within its minute.
+
+        The first card of a new minute drops the tiles of all but the previous
+        minute.
 
         Args:
-            draw: ImageDraw object
-            text: Text to draw
-            position: Position to draw the text
-            font: Font to use
+            layout: Card layout
+            field_name: Name of a field in ``CLOCK_FIELDS``
+            value: Field value
+            image_size: Size of the card image
+            minute: Issue date and time of the card
+
+        Returns:
+            Rendered tile, or None if the field has no position on the card
+        """
+        key = (
+            layout.key,
+            field_name,
+            value,
+            image_size,
+            self.resources.version,
+            self.layouts.version,
+        )
+        with self._tile_lock:
+            tile = self._clock_tiles.get(minute, {}).get(key)
+        if tile is not None:
+            return tile
+
+        tile = self._render_field_tile(layout, field_name, value, image_size)
+        if tile is None:
+            return None
+
+        with self._tile_lock:
+            tiles = self._clock_tiles.get(minute)
+            if tiles is None:
+                tiles = self._clock_tiles[minute] = {}
+                while len(self._clock_tiles) > self.CLOCK_MINUTES_KEPT:
+                    self._clock_tiles.popitem(last=False)
+            tiles[key] = tile
+        return tile
+
+    def _render_field_tile(
+        self, layout: Layout, field_name: str, value: str, image_size: Tuple[int, int]
+    ) -> Optional[FieldTile]:
+        """Lay out and draw a field onto a new tile, or None if the layout lacks it."""
+        placement = self._layout_field(layout, field_name, value, image_size[0])
+        if placement is None:
+            return None
+        return self._render_tile(placement, image_size)
+
+    def _layout_field(
+        self, layout: Layout, field_name: str, value: str, image_width: int
+    ) -> Optional[TextPlacement]:
+        """
+        Work out where and how a field is drawn.
+
+        Args:
+            layout: Card layout
+            field_name: Name of the field
+            value: Field value
+            image_width: Width of the image
+
+        Returns:
+            Text placement, or None if the layout has no such field
+        """
+        field = layout.fields.get(field_name)
+        if field is None:
+            return None
+
+        if field.align == "fit":
+            fitter = self.get_fitter(layout, field_name)
+            return self._layout_fitted_field(value, field, fitter, layout.font_path, image_width)
+        return self._layout_aligned_field(value, field, layout.font_path, image_width)
+
+    def _render_tile(self, placement: TextPlacement, image_size: Tuple[int, int]) -> FieldTile:
+        """
+        Draw a text placement onto a transparent tile just large enough to hold it.
+
+        The tile origin is an integer offset no larger than the text position, so
+        the glyphs rasterize exactly as they would on a full-size layer.
+
+        Args:
+            placement: Text placement in card coordinates
+            image_size: Size of the card image
+
+        Returns:
+            Rendered tile and its origin on the card
+        """
+        (x, y), text, font, fill = placement
+        bbox = self.resources.measure_draw().textbbox((x, y), text, font=font)
+        margin = self.TILE_MARGIN
+
+        left = max(0, min(int(x), math.floor(bbox[0])) - margin)
+        top = max(0, min(int(y), math.floor(bbox[1])) - margin)
+        right = min(image_size[0], math.ceil(bbox[2]) + margin)
+        bottom = min(image_size[1], math.ceil(bbox[3]) + margin)
+
+        with stage_timer("text_drawing"):
+            size = (max(1, right - left), max(1, bottom - top))
+            # Transparent pixels share the text color so antialiased edges keep it
+            tile = Image.new("RGBA", size, fill[:3] + (0,))
+            if self.glyphs is not None:
+                self.glyphs.draw(tile, (x - left, y - top), text, font, fill)
+            else:
+                ImageDraw.Draw(tile).text((x - left, y - top), text, font=font, fill=fill)
+        return FieldTile(tile, (left, top))
+
+    @staticmethod
+    def encode(
+        image: Image.Image,
+        output_format: Optional[str] = None,
+        buffers: Optional[BufferPool] = None,
+    ) -> bytes:
+        """
+        Encode a rendered card using the configured output settings.
+
+        Args:
+            image: Rendered card image
+            output_format: "PNG", "JPEG" or "WEBP" (defaults to settings.OUTPUT_FORMAT)
+            buffers: Pool to take the RGB buffer JPEG encoding needs from
+
+        Returns:
+            Encoded image bytes
         """
-        draw.text(position, text, font=font, fill=(255, 255, 255, 255))
+        output_format = (output_format or settings.OUTPUT_FORMAT).upper()
+        buffer = BytesIO()
 
-    def _draw_centered_field(
+        with stage_timer("encoding"):
+            if output_format == "PNG":
+                image.save(
+                    buffer,
+                    format="PNG",
+                    compress_level=settings.OUTPUT_PNG_COMPRESS_LEVEL,
+                    optimize=settings.OUTPUT_OPTIMIZE,
+                )
+            elif output_format == "JPEG":
+                if buffers is not None:
+                    rgb = buffers.convert_rgb(image)
+                else:
+                    rgb = image.convert("RGB")
+                    allocated(image_bytes(rgb))
+                try:
+                    rgb.save(
+                        buffer,
+                        format="JPEG",
+                        quality=settings.OUTPUT_QUALITY,
+                        optimize=settings.OUTPUT_OPTIMIZE,
+                    )
+                finally:
+                    if buffers is not None:
+                        buffers.release(rgb)
+                    else:
+                        freed(image_bytes(rgb))
+            elif output_format == "WEBP":
+                image.save(buffer, format="WEBP", quality=settings.OUTPUT_QUALITY)
+            else:
+                raise ValueError(f"Unsupported output format: {output_format}")
+
+        # The encoded bytes, briefly held twice while copied out of the buffer
+        encoded = buffer.getvalue()
+        allocated(2 * len(encoded))
+        freed(len(encoded))
+        return encoded
+
+    def _layout_fitted_field(
         self,
-        draw: ImageDraw.ImageDraw,
         text: str,
-        position: Tuple[float, float],
-        font: ImageFont.FreeTypeFont,
+        field: FieldLayout,
+        fitter: FontFitter,
+        font_path: Path,
         image_width: int,
-        field_name: str,
-    ) -> None:
+    ) -> TextPlacement:
         """
-        Draw a centered text field with proper Arabic text processing.
+        Place text at the largest font size that fits its box, centered in the box.
 
         Args:
-            draw: ImageDraw object
             text: Text to draw
-            position: Position to draw the text
-            font: Font to use
+            field: Field layout with the box and font size range
+            fitter: Font fitter of the field
+            font_path: Layout font
             image_width: Width of the image
-            field_name: Name of the field (for special processing)
+
+        Returns:
+            Text placement for the field
+        """
+        # compile_layout gives every fitted field a box
+        assert field.width is not None and field.height is not None
+        box_x = field.x if field.x is not None else int((image_width - field.width) / 2)
+
+        # Find the optimal font size
+        with stage_timer("font_fitting"):
+            font_size = fitter.fit(text, field.width, field.height)
+
+        # Center the text in the box
+        font = self.resources.get_font(font_size, font_path)
+        text_width = self.resources.measure_draw().textlength(text, font=font)
+        text_height = font.getbbox(text)[3]
+
+        x_text = box_x + (field.width - text_width) / 2
+        y_text = field.y + (field.height - text_height) / 2
+
+        return TextPlacement((x_text, y_text), text, font, field.color)
+
+    def _layout_aligned_field(
+        self, text: str, field: FieldLayout, font_path: Path, image_width: int
+    ) -> TextPlacement:
         """
+        Place a left, center or right aligned field, shaping Arabic text if required.
+
+        Args:
+            text: Text to draw
+            field: Field layout
+            font_path: Layout font
+            image_width: Width of the image
+
+        Returns:
+            Text placement for the field
+        """
+        font = self.resources.get_font(field.font_size, font_path)
+
         # Process Arabic text
-        if field_name == "اسم العميل" and "يا" in text:
-            processed_text = self.text_processor.reshape_text_with_spaces(text)
-        else:
-            processed_text = self.text_processor.reshape_text(text)
+        if field.shaping != "none":
+            with stage_timer("text_reshaping"):
+                if field.shaping == "arabic_words" and VOCATIVE in text:
+                    text = self.text_processor.reshape_text_with_spaces(text)
+                else:
+                    text = self.text_processor.reshape_text(text)
 
-        # Center the text
-        bbox = draw.textbbox((0, 0), processed_text, font=font)
+        # Spans start at the card edge without an x (left-aligned fields always have one)
+        left = field.x or 0
+        if field.align == "left":
+            return TextPlacement((left, field.y), text, font, field.color)
+
+        # Align the text within its span
+        span = field.width if field.width is not None else image_width - left
+        bbox = self.resources.measure_draw().textbbox((0, 0), text, font=font)
         text_width = bbox[2] - bbox[0]
-        x_center = (image_width - text_width) / 2
-        y = position[1] + 5
+        if field.align == "center":
+            x = left + (span - text_width) / 2
+        else:
+            x = left + span - text_width
 
-        draw.text((x_center, y), processed_text, font=font, fill=(255, 255, 255, 255))
+        return TextPlacement((x, field.y), text, font, field.color)
@@ -0,0 +1,236 @@
+"""Index of issued activation codes for catching duplicates."""
+
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from app.config import settings
+
+from .order_ledger import JsonlLedgerStore, OrderLedger, SQLiteLedgerStore
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings.
+
+    Answers "definitely not seen" or "possibly seen" using about
+    ``-ln(error_rate) / ln(2)^2`` bits per item (14.4 bits at 0.1%).
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        """
+        Size the filter for a number of items and a false positive rate.
+
+        Args:
+            capacity: Items the filter is sized for
+            error_rate: False positive rate at capacity
+        """
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory taken by the bit array."""
+        return len(self._bits)
+
+    def add(self, item: str) -> None:
+        """Add an item."""
+        bits = self._bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        """Check whether an item was possibly added."""
+        bits = self._bits
+        return all(bits[bit >> 3] & (1 << (bit & 7)) for bit in self._positions(item))
+
+    def _positions(self, item: str) -> Iterable[int]:
+        """Bit positions of an item, by double hashing one 128-bit digest."""
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        size = self.size
+        return ((first + index * second) % size for index in range(self.hashes))
+
+
+class CodeIndex:
+    """
+    Every activation code issued so far, for duplicate checks.
+
+    A Bloom filter answers almost every check for a new code without touching
+    the disk. Only a possible match is confirmed against the exact sources:
+    the most recently added codes (which may still be waiting in the ledger's
+    write buffer) and the SQLite order ledger. Without a SQLite ledger a
+    possible match counts as issued, so about one new code in
+    ``1 / error_rate`` is reported as a duplicate. Codes of failed cards are
+    not counted as issued. Checks and additions hold a lock, and a possible
+    match may query SQLite, so handlers call them off the event loop.
+
+    The filter only holds the codes this process loaded or added. When other
+    replicas write to the same SQLite ledger (``shared``), a code the filter
+    has not seen is confirmed against the ledger as well, so every new code
+    costs one indexed query.
+    """
+
+    def __init__(
+        self,
+        store: Optional[SQLiteLedgerStore] = None,
+        capacity: Optional[int] = None,
+        error_rate: Optional[float] = None,
+        jsonl: Optional[JsonlLedgerStore] = None,
+        max_recent: Optional[int] = None,
+        shared: Optional[bool] = None,
+    ):
+        """
+        Initialize an empty index.
+
+        Args:
+            store: Order ledger holding the issued codes (None only tracks this run)
+            capacity: Smallest number of codes to size for
+                (defaults to settings.CODE_INDEX_CAPACITY)
+            error_rate: Bloom filter false positive rate
+                (defaults to settings.CODE_INDEX_ERROR_RATE)
+            jsonl: JSONL ledger to load the codes from when there is no SQLite store
+            max_recent: Recently added codes kept exactly
+                (defaults to settings.CODE_INDEX_RECENT)
+            shared: Whether other processes add codes to the SQLite store
+                (defaults to settings.CODE_INDEX_SHARED)
+        """
+        self.store = store
+        self.jsonl = jsonl
+        self.capacity = capacity or settings.CODE_INDEX_CAPACITY
+        self.error_rate = error_rate or settings.CODE_INDEX_ERROR_RATE
+        self.max_recent = max_recent or settings.CODE_INDEX_RECENT
+        self.shared = settings.CODE_INDEX_SHARED if shared is None else shared
+        self._lock = threading.Lock()
+        self._filter = BloomFilter(self.capacity, self.error_rate)
+        # Least recently added first
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+
+    def load(self) -> None:
+        """Build the filter from every code in the ledger."""
+        source = self.store if self.store is not None else self.jsonl
+        if source is None:
+            return
+        started = time.perf_counter()
+        # Leave room to grow so the false positive rate holds as codes are added
+        capacity = max(self.capacity, 2 * source.count_issued())
+        bloom = BloomFilter(capacity, self.error_rate)
+        for code in source.iter_issued_codes():
+            bloom.add(code)
+        with self._lock:
+            self._filter = bloom
+        logger.info(
+            f"Code index loaded {bloom.count} codes in {time.perf_counter() - started:.2f}s "
+            f"({bloom.nbytes / (1024 * 1024):.1f} MB)"
+        )
+
+    def add(self, code: str) -> None:
+        """
+        Record a newly issued code.
+
+        Args:
+            code: Formatted activation code
+        """
+        with self._lock:
+            self._add(code)
+
+    def contains(self, code: str) -> bool:
+        """
+        Check whether a code was issued before.
+
+        Args:
+            code: Formatted activation code
+
+        Returns:
+            True if the code was issued before
+        """
+        with self._lock:
+            return self._contains(code)
+
+    def check_and_add(self, code: str) -> bool:
+        """
+        Check whether a code was issued before and, if not, record it, as one step.
+
+        Two operators entering the same new code at once cannot both see it as new.
+
+        Args:
+            code: Formatted activation code
+
+        Returns:
+            True if the code was issued before (it is not recorded again)
+        """
+        with self._lock:
+            if self._contains(code):
+                return True
+            self._add(code)
+            return False
+
+    def discard(self, code: str) -> None:
+        """
+        Forget a code recorded by ``check_and_add`` whose card was not issued after all.
+
+        With a SQLite ledger the code then counts as new again; without one it
+        stays a possible match in the Bloom filter.
+
+        Args:
+            code: Formatted activation code
+        """
+        with self._lock:
+            self._recent.pop(code, None)
+
+    def _add(self, code: str) -> None:
+        """Record a code; the caller holds the lock."""
+        if code in self._recent:
+            self._recent.move_to_end(code)
+            return
+        self._filter.add(code)
+        self._recent[code] = None
+        if len(self._recent) > self.max_recent:
+            # The oldest code has long reached the ledger, which confirms it from now on
+            self._recent.popitem(last=False)
+        if self._filter.count == self._filter.capacity + 1:
+            logger.warning("Code index is over capacity; duplicate checks will hit the ledger more")
+
+    def _contains(self, code: str) -> bool:
+        """Check a code; the caller holds the lock."""
+        if code not in self._filter:
+            # Another replica may have issued the code since the filter was loaded
+            return self.shared and self.store is not None and self.store.has_issued(code)
+        if code in self._recent:
+            return True
+        if self.store is None:
+            # Nothing to confirm against, so a possible match counts
+            return True
+        return self.store.has_issued(code)
+
+
+def create_code_index(ledger: Optional[OrderLedger]) -> Optional[CodeIndex]:
+    """
+    Create and load the code index, if duplicate checks are enabled.
+
+    Args:
+        ledger: Order ledger with the issued codes (None only tracks this run)
+
+    Returns:
+        Loaded index, or None when settings.DUPLICATE_CODE_CHECK is off
+    """
+    if not settings.DUPLICATE_CODE_CHECK:
+        return None
+    if ledger is None:
+        index = CodeIndex()
+    else:
+        index = CodeIndex(ledger.sqlite, jsonl=ledger.jsonl)
+    index.load()
+    return index
@@ -0,0 +1,518 @@
+"""Outbound delivery of cards to Telegram with rate limiting, retries and dead letters."""
+
+import asyncio
+import logging
+import random
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from telegram import Bot, InputMediaPhoto, Message
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from app.config import settings
+from app.utils.metrics import (
+    DEAD_LETTERS_TOTAL,
+    DELIVERY_RETRIES_TOTAL,
+    UPLOADS_IN_FLIGHT,
+    stage_timer,
+)
+
+logger = logging.getLogger(__name__)
+
+# A photo is either encoded image bytes or the file_id of an earlier upload
+Photo = Union[bytes, str]
+
+T = TypeVar("T")
+
+
+class Delivery(NamedTuple):
+    """A photo to send to a chat, or a file when it has a filename."""
+
+    chat_id: int
+    photo: Photo
+    caption: Optional[str] = None
+    filename: Optional[str] = None
+
+
+class DeadLetter(NamedTuple):
+    """A delivery that failed for good, as stored for replay."""
+
+    id: int
+    delivery: Delivery
+    error: str
+    attempts: int
+    failed_at: float
+
+
+class DeliveryError(Exception):
+    """Raised when a delivery failed and was moved to the dead-letter store."""
+
+    def __init__(self, delivery: Delivery, cause: Exception, attempts: int):
+        """
+        Initialize the error.
+
+        Args:
+            delivery: The failed delivery
+            cause: Last error returned by Telegram
+            attempts: Number of attempts made
+        """
+        super().__init__(f"Delivery to chat {delivery.chat_id} failed after {attempts} attempts")
+        self.delivery = delivery
+        self.cause = cause
+        self.attempts = attempts
+
+
+class TokenBucket:
+    """Token-bucket rate limiter for coroutines."""
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Initialize a full bucket.
+
+        Args:
+            rate: Tokens added per second
+            capacity: Maximum tokens, i.e. the largest burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def full(self) -> bool:
+        """Whether the bucket has refilled completely."""
+        return self._refill() >= self.capacity
+
+    async def acquire(self) -> None:
+        """Wait for a token and take it."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while self._refill() < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+            self._tokens -= 1
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Take tokens if they are available, without waiting."""
+        if self._refill() < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+    def refund(self, tokens: float = 1) -> None:
+        """Give back tokens that were taken for work that never started."""
+        self._tokens = min(self.capacity, self._refill() + tokens)
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """Seconds until the given number of tokens is available."""
+        return max(0.0, (tokens - self._refill()) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back tokens for a while, e.g. after Telegram asked to slow down."""
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+    def _refill(self) -> float:
+        """Add the tokens earned since the last update."""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return self._tokens
+
+
+class DeadLetterStore:
+    """Failed deliveries kept in SQLite so they can be replayed."""
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Open (and create if needed) the database.
+
+        Args:
+            path: Database file path
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False, timeout=5.0)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letters ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, "
+                "photo BLOB NOT NULL, caption TEXT, error TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL, failed_at REAL NOT NULL, filename TEXT)"
+            )
+            table = self._connection.execute("PRAGMA table_info(dead_letters)").fetchall()
+            columns = {row[1] for row in table}
+            if "filename" not in columns:
+                # Stores created before files could be dead-lettered
+                self._connection.execute("ALTER TABLE dead_letters ADD COLUMN filename TEXT")
+
+    def add(self, delivery: Delivery, error: str, attempts: int) -> int:
+        """
+        Store a failed delivery.
+
+        Args:
+            delivery: The failed delivery
+            error: Description of the last error
+            attempts: Number of attempts made
+
+        Returns:
+            ID of the dead letter
+        """
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO dead_letters "
+                "(chat_id, photo, caption, error, attempts, failed_at, filename) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    delivery.chat_id,
+                    delivery.photo,
+                    delivery.caption,
+                    error,
+                    attempts,
+                    time.time(),
+                    delivery.filename,
+                ),
+            )
+        return cursor.lastrowid
+
+    def pending(self, limit: int = 100) -> List[DeadLetter]:
+        """
+        Get the oldest dead letters.
+
+        Args:
+            limit: Maximum number of dead letters
+
+        Returns:
+            Dead letters, oldest first
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, chat_id, photo, caption, error, attempts, failed_at, filename "
+                "FROM dead_letters ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            DeadLetter(row[0], Delivery(row[1], row[2], row[3], row[7]), row[4], row[5], row[6])
+            for row in rows
+        ]
+
+    def count(self) -> int:
+        """Number of stored dead letters."""
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+    def remove(self, letter_id: int) -> None:
+        """
+        Delete a dead letter, e.g. after it was replayed.
+
+        Args:
+            letter_id: ID of the dead letter
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM dead_letters WHERE id = ?", (letter_id,))
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._connection.close()
+
+
+class DeliveryQueue:
+    """
+    Sends photos to Telegram within its flood limits.
+
+    Every delivery waits for a token from its chat's bucket and from the
+    global bucket, then for one of ``concurrency`` upload slots; waiting
+    deliveries are served in arrival order. Flood-control errors are retried
+    after the ``retry_after`` Telegram asks for, and network errors with
+    exponential backoff. Deliveries that still fail, or that Telegram
+    rejects outright, are moved to the dead-letter store for replay.
+    """
+
+    def __init__(
+        self,
+        dead_letters: Optional[DeadLetterStore] = None,
+        concurrency: Optional[int] = None,
+        global_rate: Optional[float] = None,
+        chat_rate: Optional[float] = None,
+        chat_burst: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+    ):
+        """
+        Initialize the delivery queue.
+
+        Args:
+            dead_letters: Store for failed deliveries (None only logs them)
+            concurrency: Uploads in flight at once (defaults to settings.UPLOAD_CONCURRENCY)
+            global_rate: Messages per second overall (defaults to settings.DELIVERY_GLOBAL_RATE)
+            chat_rate: Messages per second to one chat (defaults to settings.DELIVERY_CHAT_RATE)
+            chat_burst: Messages one chat may get at once (defaults to settings.DELIVERY_CHAT_BURST)
+            max_attempts: Attempts per delivery (defaults to settings.DELIVERY_MAX_ATTEMPTS)
+        """
+        self.dead_letters = dead_letters
+        self.concurrency = concurrency or settings.UPLOAD_CONCURRENCY
+        self.chat_rate = chat_rate or settings.DELIVERY_CHAT_RATE
+        self.chat_burst = chat_burst or settings.DELIVERY_CHAT_BURST
+        self.max_attempts = max_attempts or settings.DELIVERY_MAX_ATTEMPTS
+        global_rate = global_rate or settings.DELIVERY_GLOBAL_RATE
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+
+        UPLOADS_IN_FLIGHT.set_function(lambda: self._in_flight)
+
+    async def send_photo(self, bot: Bot, delivery: Delivery, dead_letter: bool = True) -> Message:
+        """
+        Send a photo, retrying until it is delivered or the attempts run out.
+
+        Args:
+            bot: Bot to send with
+            delivery: Chat and photo to send
+            dead_letter: Whether to store the delivery if it fails
+
+        Returns:
+            The sent message
+
+        Raises:
+            DeliveryError: If the photo could not be delivered
+        """
+        return await self._send([delivery], lambda: self._attempt(bot, delivery), dead_letter)
+
+    async def send_document(
+        self, bot: Bot, delivery: Delivery, dead_letter: bool = True
+    ) -> Message:
+        """
+        Send a file, retrying like ``send_photo``.
+
+        Args:
+            bot: Bot to send with
+            delivery: Chat and file contents to send, with the file's name
+            dead_letter: Whether to store the delivery if it fails
+
+        Returns:
+            The sent message
+
+        Raises:
+            ValueError: If the delivery has no filename
+            DeliveryError: If the file could not be delivered
+        """
+        if delivery.filename is None:
+            raise ValueError("A document delivery needs a filename")
+        return await self._send(
+            [delivery], lambda: self._attempt_document(bot, delivery), dead_letter
+        )
+
+    async def send_media_group(self, bot: Bot, deliveries: List[Delivery]) -> Tuple[Message, ...]:
+        """
+        Send photos to one chat as an album, retrying like ``send_photo``.
+
+        If the album cannot be delivered, each photo becomes a dead letter of
+        its own and is replayed as a single photo.
+
+        Args:
+            bot: Bot to send with
+            deliveries: Photos for one chat, at most 10
+
+        Returns:
+            The sent messages
+
+        Raises:
+            DeliveryError: If the album could not be delivered
+        """
+        return await self._send(deliveries, lambda: self._attempt_album(bot, deliveries))
+
+    async def _send(
+        self,
+        deliveries: List[Delivery],
+        attempt_once: Callable[[], Awaitable[T]],
+        dead_letter: bool = True,
+    ) -> T:
+        """
+        Make delivery attempts until one succeeds or the attempts run out.
+
+        Args:
+            deliveries: What the attempts deliver, dead-lettered if they all fail
+            attempt_once: Makes one attempt
+            dead_letter: Whether to store the deliveries if they fail
+
+        Returns:
+            Result of the successful attempt
+
+        Raises:
+            DeliveryError: If the deliveries could not be delivered
+        """
+        delivery = deliveries[0]
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await attempt_once()
+            except (BadRequest, Forbidden) as e:
+                # Telegram rejected the request itself; sending it again will not help
+                error: Exception = e
+                break
+            except RetryAfter as e:
+                error = e
+                delay = float(e.retry_after)
+                # Flood control may apply to the whole bot, so hold back every chat
+                self._global.pause(delay)
+                reason = "flood_control"
+            except NetworkError as e:
+                error = e
+                delay = min(
+                    settings.DELIVERY_RETRY_MAX_DELAY,
+                    settings.DELIVERY_RETRY_BASE_DELAY * 2 ** (attempt - 1),
+                )
+                delay *= random.uniform(0.5, 1.0)
+                reason = "network"
+
+            if attempt >= self.max_attempts:
+                break
+            DELIVERY_RETRIES_TOTAL.inc(reason=reason)
+            logger.warning(
+                f"Delivery to chat {delivery.chat_id} failed ({error}), "
+                f"retrying in {delay:.1f}s (attempt {attempt}/{self.max_attempts})"
+            )
+            await asyncio.sleep(delay)
+
+        if dead_letter:
+            for failed in deliveries:
+                await self._dead_letter(failed, error, attempt)
+        raise DeliveryError(delivery, error, attempt) from error
+
+    async def replay(self, bot: Bot, limit: int = 100) -> int:
+        """
+        Send stored dead letters again, removing the ones that get through.
+
+        Args:
+            bot: Bot to send with
+            limit: Maximum number of dead letters to replay
+
+        Returns:
+            Number of deliveries replayed successfully
+        """
+        if self.dead_letters is None:
+            return 0
+        loop = asyncio.get_running_loop()
+        letters = await loop.run_in_executor(None, self.dead_letters.pending, limit)
+        replayed = 0
+        for letter in letters:
+            try:
+                if letter.delivery.filename is not None:
+                    await self.send_document(bot, letter.delivery, dead_letter=False)
+                else:
+                    await self.send_photo(bot, letter.delivery, dead_letter=False)
+            except DeliveryError as e:
+                logger.warning(f"Dead letter {letter.id} still undeliverable: {e.cause}")
+                continue
+            await loop.run_in_executor(None, self.dead_letters.remove, letter.id)
+            replayed += 1
+        logger.info(f"Replayed {replayed}/{len(letters)} dead letters")
+        return replayed
+
+    def close(self) -> None:
+        """Close the dead-letter store."""
+        if self.dead_letters is not None:
+            self.dead_letters.close()
+
+    async def _attempt(self, bot: Bot, delivery: Delivery) -> Message:
+        """Send a photo once, within the rate limits and upload slots."""
+        await self._chat_bucket(delivery.chat_id).acquire()
+        async with self._upload_slot(1):
+            with stage_timer("telegram_upload"):
+                return await bot.send_photo(
+                    chat_id=delivery.chat_id, photo=delivery.photo, caption=delivery.caption
+                )
+
+    async def _attempt_document(self, bot: Bot, delivery: Delivery) -> Message:
+        """Send a file once, within the rate limits and upload slots."""
+        await self._chat_bucket(delivery.chat_id).acquire()
+        async with self._upload_slot(1):
+            with stage_timer("telegram_upload"):
+                return await bot.send_document(
+                    chat_id=delivery.chat_id,
+                    document=delivery.photo,
+                    filename=delivery.filename,
+                    caption=delivery.caption,
+                )
+
+    async def _attempt_album(self, bot: Bot, deliveries: List[Delivery]) -> Tuple[Message, ...]:
+        """Send an album once; it takes one chat token and a global token per photo."""
+        chat_id = deliveries[0].chat_id
+        await self._chat_bucket(chat_id).acquire()
+        async with self._upload_slot(len(deliveries)):
+            with stage_timer("telegram_upload"):
+                return await bot.send_media_group(
+                    chat_id=chat_id,
+                    media=[InputMediaPhoto(delivery.photo) for delivery in deliveries],
+                )
+
+    @asynccontextmanager
+    async def _upload_slot(self, messages: int) -> AsyncIterator[None]:
+        """Hold an upload slot and global tokens for a number of messages."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        async with self._slots:
+            for _ in range(messages):
+                await self._global.acquire()
+            self._in_flight += 1
+            try:
+                yield
+            finally:
+                self._in_flight -= 1
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        """Get a chat's bucket, dropping idle ones once there are many."""
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= 1024:
+                self._chats = {key: value for key, value in self._chats.items() if not value.full}
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _dead_letter(self, delivery: Delivery, error: Exception, attempts: int) -> None:
+        """Keep a failed delivery for replay."""
+        DEAD_LETTERS_TOTAL.inc()
+        logger.error(
+            f"Delivery to chat {delivery.chat_id} failed after {attempts} attempts: {error}"
+        )
+        if self.dead_letters is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            letter_id = await loop.run_in_executor(
+                None, self.dead_letters.add, delivery, str(error), attempts
+            )
+            logger.info(f"Delivery saved as dead letter {letter_id}")
+        except sqlite3.Error as e:
+            logger.error(f"Could not save dead letter: {e}")
+
+
+def create_delivery_queue() -> DeliveryQueue:
+    """
+    Create the delivery queue, with dead letters stored at settings.DEAD_LETTER_DB_PATH.
+
+    Returns:
+        The delivery queue
+    """
+    return DeliveryQueue(DeadLetterStore(settings.DEAD_LETTER_DB_PATH))
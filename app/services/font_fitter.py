@@ -0,0 +1,115 @@
+"""Font size fitting for text that must fit inside a fixed box."""
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from .resource_cache import ResourceCache, resource_cache
+
+# Signatures whose fitted size is remembered; the least recently used is dropped past this
+MAX_HINTS = 256
+
+
+class FontFitter:
+    """
+    Finds the largest font size at which a text fits inside a box.
+
+    The search is a binary search over font sizes. The size chosen for a text is
+    remembered by its character-class signature (e.g. ``AAAA-9A9A-AAAA``) and
+    tried first for the next text with the same signature, so formatted
+    activation codes usually resolve with two measurements.
+    """
+
+    def __init__(
+        self,
+        min_size: int,
+        max_size: int,
+        resources: Optional[ResourceCache] = None,
+        font_path: Optional[Path] = None,
+        max_hints: int = MAX_HINTS,
+    ):
+        """
+        Initialize the font fitter.
+
+        Args:
+            min_size: Smallest font size to try
+            max_size: Largest font size to try
+            resources: Font cache (defaults to the shared cache)
+            font_path: Font to measure with (defaults to the cache's font path)
+            max_hints: Signatures whose fitted size is remembered
+        """
+        self.min_size = min_size
+        self.max_size = max_size
+        self.resources = resources or resource_cache
+        self.font_path = font_path
+        self.max_hints = max_hints
+        self._hints: "OrderedDict[str, int]" = OrderedDict()
+
+    def fit(self, text: str, box_width: float, box_height: float) -> int:
+        """
+        Get the largest font size at which the text fits in the box.
+
+        Args:
+            text: Text to fit
+            box_width: Maximum text width
+            box_height: Maximum text height
+
+        Returns:
+            Font size, or ``min_size - 1`` if the text does not fit even at ``min_size``
+        """
+        signature = self.signature(text)
+        hint = self._hints.get(signature)
+        if hint is not None:
+            self._hints.move_to_end(signature)
+            if self._is_boundary(hint, text, box_width, box_height):
+                return hint
+
+        size = self._search(text, box_width, box_height)
+        self._hints[signature] = size
+        if len(self._hints) > self.max_hints:
+            self._hints.popitem(last=False)
+        return size
+
+    @staticmethod
+    def signature(text: str) -> str:
+        """
+        Get the character-class signature of a text.
+
+        Args:
+            text: Input text
+
+        Returns:
+            Text with digits replaced by ``9`` and letters by ``A``
+        """
+        return "".join("9" if c.isdigit() else "A" if c.isalpha() else c for c in text)
+
+    def _search(self, text: str, box_width: float, box_height: float) -> int:
+        """Binary search for the largest fitting font size."""
+        if self._fits(self.max_size, text, box_width, box_height):
+            return self.max_size
+        if not self._fits(self.min_size, text, box_width, box_height):
+            return self.min_size - 1
+
+        # Invariant: text fits at ``low`` and does not fit at ``high``
+        low, high = self.min_size, self.max_size
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self._fits(middle, text, box_width, box_height):
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def _is_boundary(self, size: int, text: str, box_width: float, box_height: float) -> bool:
+        """Check whether ``size`` is the largest fitting font size."""
+        if size < self.min_size:
+            return not self._fits(self.min_size, text, box_width, box_height)
+        if not self._fits(size, text, box_width, box_height):
+            return False
+        return size == self.max_size or not self._fits(size + 1, text, box_width, box_height)
+
+    def _fits(self, size: int, text: str, box_width: float, box_height: float) -> bool:
+        """Check whether the text fits in the box at the given font size."""
+        font = self.resources.get_font(size, self.font_path)
+        bbox = self.resources.measure_draw().textbbox((0, 0), text, font=font)
+        return bbox[2] - bbox[0] <= box_width and bbox[3] - bbox[1] <= box_height
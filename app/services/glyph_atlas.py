@@ -0,0 +1,249 @@
+"""Cache of rasterized glyphs that card text is assembled from."""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+from app.config import settings
+
+from .resource_cache import ResourceCache, resource_cache
+
+logger = logging.getLogger(__name__)
+
+# Pen positions are kept in FreeType's 26.6 fixed point: 64 steps per pixel
+SUBPIXELS = 64
+
+# Blank pixels around a glyph's bounding box when it is rasterized
+GLYPH_PADDING = 2
+
+# Identifies a font face at one size (Pillow allows fractional sizes)
+FontKey = Tuple[str, float, int]
+
+
+class _Glyph(NamedTuple):
+    """A glyph's coverage mask and its offset from the pen position."""
+
+    mask: Optional[Image.Image]
+    offset: Tuple[int, int]
+
+
+def _font_key(font: ImageFont.FreeTypeFont) -> FontKey:
+    """Identify a font by file, size and face index."""
+    return (str(font.path), font.size, font.index)
+
+
+def _rasterize(font: ImageFont.FreeTypeFont, char: str, x: int, y: int) -> _Glyph:
+    """
+    Rasterize a glyph at a subpixel position with Pillow's own text drawing.
+
+    The glyph is drawn in full coverage on a blank canvas with room around
+    its bounding box, then cropped to its ink.
+
+    Args:
+        font: Font to draw with
+        char: Character to draw
+        x: Horizontal subpixel position of the pen, in 26.6 units
+        y: Vertical subpixel position of the pen, in 26.6 units
+    """
+    # FreeType bounding boxes are whole pixels, typed as floats
+    left, top, right, bottom = (int(edge) for edge in font.getbbox(char))
+    # A subpixel start moves the ink by up to a pixel, and antialiasing by one more. The
+    # origin is kept at non-negative coordinates, where Pillow splits off the fraction
+    origin = (max(0, -left) + GLYPH_PADDING, max(0, -top) + GLYPH_PADDING)
+    canvas = Image.new("L", (origin[0] + right + GLYPH_PADDING, origin[1] + bottom + GLYPH_PADDING))
+    ImageDraw.Draw(canvas).text(
+        (origin[0] + x / SUBPIXELS, origin[1] + y / SUBPIXELS), char, font=font, fill=255
+    )
+    ink = canvas.getbbox()
+    if ink is None:
+        return _Glyph(None, (0, 0))
+    return _Glyph(canvas.crop(ink), (ink[0] - origin[0], ink[1] - origin[1]))
+
+
+class GlyphAtlas:
+    """
+    Rasterized glyph masks shared between cards.
+
+    Pillow's basic text layout rasterizes every glyph of a string each time
+    the string is drawn. The atlas rasterizes each (font, size, glyph,
+    subpixel position) once and builds a string's mask from the cached
+    masks, using the font's advances and kerning pairs to place them. Where
+    glyphs overlap their coverage is combined the way FreeType layers ink, so
+    the text matches ``ImageDraw.text`` to within one level of rounding on
+    overlapping edges.
+
+    Text is drawn as given, so Arabic must already be reshaped into visual
+    order. Fonts using the Raqm layout, which shapes text itself, and text
+    with several lines are drawn by Pillow directly. Masks are kept in an LRU
+    bounded by their total size and dropped when the resource cache reloads
+    the fonts.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, resources: Optional[ResourceCache] = None):
+        """
+        Initialize the atlas.
+
+        Args:
+            max_bytes: Memory budget for glyph masks (defaults to settings.GLYPH_ATLAS_MAX_MB)
+            resources: Resource cache whose reloads invalidate the atlas
+                (defaults to the shared cache)
+        """
+        self.max_bytes = max_bytes or settings.GLYPH_ATLAS_MAX_MB * 1024 * 1024
+        self.resources = resources or resource_cache
+        self._lock = threading.Lock()
+        self._glyphs: "OrderedDict[Tuple, _Glyph]" = OrderedDict()
+        self._bytes = 0
+        # Advances and kerning in 26.6 units, small enough to keep without a bound
+        self._advances: Dict[Tuple[FontKey, str], int] = {}
+        self._kerning: Dict[Tuple[FontKey, str], int] = {}
+        self._version = self.resources.version
+
+    @staticmethod
+    def supports(text: str, font: ImageFont.FreeTypeFont) -> bool:
+        """Check whether the atlas can draw a text with a font."""
+        return font.layout_engine == ImageFont.Layout.BASIC and "\n" not in text
+
+    def draw(
+        self,
+        image: Image.Image,
+        xy: Tuple[float, float],
+        text: str,
+        font: ImageFont.FreeTypeFont,
+        fill: Tuple[int, ...],
+    ) -> None:
+        """
+        Draw text like ``ImageDraw.Draw(image).text(xy, text, font=font, fill=fill)``.
+
+        Args:
+            image: Image to draw on
+            xy: Top-left text position, with fractional pixels
+            text: Text to draw
+            font: Font to draw with
+            fill: Text color
+        """
+        draw = ImageDraw.Draw(image)
+        if not self.supports(text, font) or xy[0] < 0 or xy[1] < 0:
+            draw.text(xy, text, font=font, fill=fill)
+            return
+
+        left, top = int(xy[0]), int(xy[1])
+        mask, offset = self.get_mask(text, font, (xy[0] - left, xy[1] - top))
+        if mask is not None:
+            draw.bitmap((left + offset[0], top + offset[1]), mask, fill=fill)
+
+    def get_mask(
+        self, text: str, font: ImageFont.FreeTypeFont, start: Tuple[float, float] = (0.0, 0.0)
+    ) -> Tuple[Optional[Image.Image], Tuple[int, int]]:
+        """
+        Build the coverage mask of a line of text from cached glyphs.
+
+        Args:
+            text: Text on one line
+            font: Font to draw with (basic layout)
+            start: Fractional pixel position of the text origin
+
+        Returns:
+            "L" mask and its offset from the text origin, or None for a blank text
+        """
+        self._check_version()
+        key = _font_key(font)
+        start_y = round(start[1] * SUBPIXELS)
+        pen = round(start[0] * SUBPIXELS)
+        placed = []
+        previous = None
+        for char in text:
+            if previous is not None:
+                pen += self._kerning_of(font, key, previous + char)
+            glyph = self._glyph(font, key, char, pen % SUBPIXELS, start_y)
+            if glyph.mask is not None:
+                placed.append((pen // SUBPIXELS + glyph.offset[0], glyph.offset[1], glyph.mask))
+            pen += self._advance_of(font, key, char)
+            previous = char
+        if not placed:
+            return None, (0, 0)
+
+        left = min(x for x, _, _ in placed)
+        top = min(y for _, y, _ in placed)
+        right = max(x + mask.width for x, _, mask in placed)
+        bottom = max(y + mask.height for _, y, mask in placed)
+        line = Image.new("L", (right - left, bottom - top))
+        covered = left
+        for x, y, mask in placed:
+            box = (x - left, y - top, x - left + mask.width, y - top + mask.height)
+            if x >= covered:
+                line.paste(mask, box)
+            else:
+                # Overlapping glyphs add up like layers of ink (FreeType's "screen")
+                line.paste(ImageChops.screen(line.crop(box), mask), box)
+            covered = max(covered, x + mask.width)
+        return line, (left, top)
+
+    def clear(self) -> None:
+        """Drop every cached glyph."""
+        with self._lock:
+            self._glyphs.clear()
+            self._bytes = 0
+            self._advances.clear()
+            self._kerning.clear()
+
+    @property
+    def size(self) -> int:
+        """Bytes taken by the cached glyph masks."""
+        return self._bytes
+
+    def _check_version(self) -> None:
+        """Drop the glyphs of fonts that the resource cache reloaded."""
+        if self._version != self.resources.version:
+            self.clear()
+            self._version = self.resources.version
+
+    def _glyph(
+        self, font: ImageFont.FreeTypeFont, key: FontKey, char: str, x: int, y: int
+    ) -> _Glyph:
+        """Get a glyph rasterized at a subpixel position, rasterizing it on a miss."""
+        glyph_key = (key, char, x, y)
+        with self._lock:
+            glyph = self._glyphs.get(glyph_key)
+            if glyph is not None:
+                self._glyphs.move_to_end(glyph_key)
+                return glyph
+
+        glyph = _rasterize(font, char, x, y)
+        size = glyph.mask.width * glyph.mask.height if glyph.mask is not None else 0
+        with self._lock:
+            if glyph_key not in self._glyphs:
+                self._glyphs[glyph_key] = glyph
+                self._bytes += size
+                while self._bytes > self.max_bytes and len(self._glyphs) > 1:
+                    _, evicted = self._glyphs.popitem(last=False)
+                    if evicted.mask is not None:
+                        self._bytes -= evicted.mask.width * evicted.mask.height
+        return glyph
+
+    def _advance_of(self, font: ImageFont.FreeTypeFont, key: FontKey, char: str) -> int:
+        """Get the advance of a glyph in 26.6 units."""
+        advance = self._advances.get((key, char))
+        if advance is None:
+            advance = round(font.getlength(char) * SUBPIXELS)
+            self._advances[(key, char)] = advance
+        return advance
+
+    def _kerning_of(self, font: ImageFont.FreeTypeFont, key: FontKey, pair: str) -> int:
+        """Get the kerning between two glyphs in 26.6 units."""
+        kerning = self._kerning.get((key, pair))
+        if kerning is None:
+            pair_length = round(font.getlength(pair) * SUBPIXELS)
+            kerning = (
+                pair_length
+                - self._advance_of(font, key, pair[0])
+                - self._advance_of(font, key, pair[1])
+            )
+            self._kerning[(key, pair)] = kerning
+        return kerning
+
+
+# Shared atlas used by the card generator
+glyph_atlas = GlyphAtlas()
@@ -0,0 +1,432 @@
+"""Declarative card layouts loaded from JSON or TOML files."""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Tuple, cast
+
+from PIL import ImageColor
+
+from app.config import settings
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+logger = logging.getLogger(__name__)
+
+# Supported field alignments and text shaping modes
+ALIGNMENTS = ("left", "center", "right", "fit")
+SHAPINGS = ("none", "arabic", "arabic_words")
+
+# Card attributes a layout can be matched on
+SELECTORS = ("price", "country")
+
+# Layout file extensions, in order of preference
+EXTENSIONS = (".json", ".toml")
+
+
+class LayoutError(ValueError):
+    """Raised when a layout file is missing or invalid."""
+
+
+class FieldLayout(NamedTuple):
+    """
+    How one card field is drawn.
+
+    ``left`` draws at (x, y). ``center`` and ``right`` align the text in the
+    span from x to x + width (the rest of the card when width is omitted).
+    ``fit`` picks the largest font size between ``min_font_size`` and
+    ``font_size`` at which the text fits the box and centers it there; the box
+    is centered on the card when x is omitted.
+    """
+
+    align: str
+    x: Optional[float]
+    y: float
+    width: Optional[float]
+    height: Optional[float]
+    font_size: int
+    min_font_size: int
+    color: Tuple[int, int, int, int]
+    shaping: str
+
+
+class Layout(NamedTuple):
+    """A compiled card layout: template, font, selection rules and fields."""
+
+    name: str
+    template_path: Path
+    font_path: Path
+    match: Dict[str, FrozenSet[str]]
+    priority: int
+    fields: Dict[str, FieldLayout]
+    fingerprint: str
+    # Resolution relative to the template's own size
+    scale: float = 1.0
+
+    @property
+    def key(self) -> str:
+        """Name that tells scaled copies of the same layout apart."""
+        return self.name if self.scale == 1.0 else f"{self.name}@{self.scale:g}"
+
+    def accepts(self, price: str, country: str) -> bool:
+        """Check whether the layout's match rules allow a price and country."""
+        values = {"price": price, "country": country}
+        return all(values[key] in allowed for key, allowed in self.match.items())
+
+
+class LayoutEngine:
+    """
+    Loads, compiles and selects card layouts.
+
+    Every ``*.json`` or ``*.toml`` file in the layouts directory is one layout,
+    named after the file. A layout may restrict itself to some prices or
+    countries with a ``match`` table; a card gets the most specific matching
+    layout, and the default layout otherwise. Layouts are compiled once and
+    the choice for each price/country pair is memoized, so adding designs
+    adds no work per card. The files are checked for changes at most every
+    ``reload_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[Path] = None,
+        default: Optional[str] = None,
+        reload_interval: Optional[float] = None,
+    ):
+        """
+        Initialize the layout engine.
+
+        Args:
+            directory: Directory of layout files (defaults to settings.LAYOUTS_DIR)
+            default: Name of the fallback layout (defaults to settings.DEFAULT_LAYOUT)
+            reload_interval: Seconds between change checks by ``refresh_if_due``
+                (defaults to settings.FILE_RELOAD_INTERVAL)
+        """
+        self.directory = directory or settings.LAYOUTS_DIR
+        self.default = default or settings.DEFAULT_LAYOUT
+        self.reload_interval = (
+            settings.FILE_RELOAD_INTERVAL if reload_interval is None else reload_interval
+        )
+        self._lock = threading.Lock()
+        self._layouts: Dict[str, Layout] = {}
+        self._selected: Dict[Tuple[str, str], Layout] = {}
+        self._scaled: Dict[Tuple[str, float], Layout] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._checked = time.monotonic()
+        self._loaded = False
+        # Bumped on every reload so dependent caches can spot stale entries
+        self.version = 0
+
+    @property
+    def layouts(self) -> Dict[str, Layout]:
+        """All compiled layouts by name."""
+        self._ensure_loaded()
+        return self._layouts
+
+    def get(self, name: str) -> Layout:
+        """
+        Get a layout by name.
+
+        Args:
+            name: Layout name (file name without extension)
+
+        Returns:
+            Compiled layout
+
+        Raises:
+            LayoutError: If there is no such layout
+        """
+        layout = self.layouts.get(name)
+        if layout is None:
+            raise LayoutError(f"Layout not found: {name} in {self.directory}")
+        return layout
+
+    def select(self, card_data: Dict[str, str], preset: Optional[str] = None) -> Layout:
+        """
+        Pick the layout for a card, scaled to an output preset.
+
+        Args:
+            card_data: Card data dictionary with ``price`` and ``country`` entries
+            preset: Output preset name (defaults to settings.OUTPUT_PRESET)
+
+        Returns:
+            The most specific matching layout, or the default layout
+        """
+        return self.scaled(self._select(card_data), preset_scale(preset))
+
+    def scaled(self, layout: Layout, scale: float) -> Layout:
+        """
+        Get a layout scaled to a resolution, compiling it on first use.
+
+        Args:
+            layout: Layout at its template's own size
+            scale: Resolution relative to the template's own size
+
+        Returns:
+            Scaled layout
+        """
+        if scale == 1.0:
+            return layout
+        key = (layout.name, scale)
+        scaled = self._scaled.get(key)
+        if scaled is None:
+            scaled = scale_layout(layout, scale)
+            self._scaled[key] = scaled
+        return scaled
+
+    def _select(self, card_data: Dict[str, str]) -> Layout:
+        """Pick the unscaled layout for a card."""
+        self._ensure_loaded()
+        key = (card_data.get("price", ""), card_data.get("country", ""))
+        layout = self._selected.get(key)
+        if layout is None:
+            candidates = [layout for layout in self._layouts.values() if layout.accepts(*key)]
+            candidates = [layout for layout in candidates if layout.match]
+            if candidates:
+                layout = max(candidates, key=lambda item: (len(item.match), item.priority))
+            else:
+                layout = self.get(self.default)
+            self._selected[key] = layout
+        return layout
+
+    def load(self) -> None:
+        """
+        Compile every layout file in the directory.
+
+        Raises:
+            LayoutError: If a file is invalid or the default layout is missing
+        """
+        with self._lock:
+            layouts: Dict[str, Layout] = {}
+            mtimes: Dict[str, float] = {str(self.directory): self.directory.stat().st_mtime}
+            for path in self._layout_files():
+                layouts[path.stem] = compile_layout(path.stem, read_spec(path))
+                mtimes[str(path)] = path.stat().st_mtime
+            if self.default not in layouts:
+                raise LayoutError(f"Default layout not found: {self.default} in {self.directory}")
+
+            self._layouts = layouts
+            self._selected = {}
+            self._scaled = {}
+            self._mtimes = mtimes
+            self._checked = time.monotonic()
+            self._loaded = True
+            self.version += 1
+            logger.info(f"Loaded {len(layouts)} card layouts: {', '.join(sorted(layouts))}")
+
+    def refresh_if_changed(self) -> bool:
+        """
+        Reload the layouts if a layout file was added, changed or removed.
+
+        Returns:
+            True if the layouts were reloaded
+        """
+        for path, mtime in list(self._mtimes.items()):
+            try:
+                changed = Path(path).stat().st_mtime != mtime
+            except FileNotFoundError:
+                changed = True
+            if changed:
+                logger.info(f"Layouts changed on disk, reloading: {path}")
+                self.load()
+                return True
+        return False
+
+    def refresh_if_due(self) -> bool:
+        """
+        Check for changed layout files, at most once per ``reload_interval``.
+
+        Returns:
+            True if the layouts were reloaded
+        """
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return False
+        self._checked = now
+        return self.refresh_if_changed()
+
+    def _ensure_loaded(self) -> None:
+        """Load the layouts on first use."""
+        if not self._loaded:
+            self.load()
+
+    def _layout_files(self) -> List[Path]:
+        """List layout files, preferring JSON when a name has both."""
+        files: Dict[str, Path] = {}
+        for extension in reversed(EXTENSIONS):
+            for path in sorted(self.directory.glob(f"*{extension}")):
+                files[path.stem] = path
+        return list(files.values())
+
+
+def preset_scale(preset: Optional[str] = None) -> float:
+    """
+    Get the scale of an output preset.
+
+    Args:
+        preset: Preset name (defaults to settings.OUTPUT_PRESET)
+
+    Returns:
+        Resolution relative to the template's own size
+
+    Raises:
+        LayoutError: If there is no such preset
+    """
+    name = preset or settings.OUTPUT_PRESET
+    if name not in settings.OUTPUT_PRESETS:
+        raise LayoutError(f"Unknown output preset: {name}")
+    return settings.OUTPUT_PRESETS[name]
+
+
+def scale_layout(layout: Layout, scale: float) -> Layout:
+    """
+    Scale a layout's positions, boxes and font sizes to another resolution.
+
+    Args:
+        layout: Layout at its template's own size
+        scale: Resolution relative to the template's own size
+
+    Returns:
+        Scaled layout drawn on a template resized by the same factor
+    """
+
+    def length(value: Optional[float]) -> Optional[float]:
+        return None if value is None else value * scale
+
+    fields = {
+        name: field._replace(
+            x=length(field.x),
+            y=field.y * scale,
+            width=length(field.width),
+            height=length(field.height),
+            font_size=max(1, round(field.font_size * scale)),
+            min_font_size=max(1, round(field.min_font_size * scale)),
+        )
+        for name, field in layout.fields.items()
+    }
+    fingerprint = hashlib.sha256(f"{layout.fingerprint}@{scale!r}".encode()).hexdigest()
+    return layout._replace(fields=fields, fingerprint=fingerprint, scale=layout.scale * scale)
+
+
+def read_spec(path: Path) -> Dict[str, Any]:
+    """
+    Read a layout file.
+
+    Args:
+        path: JSON or TOML layout file
+
+    Returns:
+        Parsed layout specification
+
+    Raises:
+        LayoutError: If the file cannot be parsed
+    """
+    try:
+        if path.suffix == ".toml":
+            if tomllib is None:
+                raise LayoutError(f"{path.name}: TOML layouts need Python 3.11+ or tomli")
+            return tomllib.loads(path.read_text(encoding="utf-8"))
+        return json.loads(path.read_text(encoding="utf-8"))
+    except LayoutError:
+        raise
+    except Exception as e:
+        raise LayoutError(f"{path.name}: {e}") from e
+
+
+def compile_layout(name: str, spec: Dict[str, Any]) -> Layout:
+    """
+    Validate a layout specification and resolve its paths, fonts and colors.
+
+    Args:
+        name: Layout name
+        spec: Parsed layout specification
+
+    Returns:
+        Compiled layout
+
+    Raises:
+        LayoutError: If the specification is invalid
+    """
+    try:
+        template_path = settings.TEMPLATES_DIR / spec.get("template", settings.TEMPLATE_IMAGE)
+        font_path = settings.FONTS_DIR / spec.get("font", settings.FONT_NAME)
+        for path in (template_path, font_path):
+            if not path.exists():
+                raise LayoutError(f"file not found: {path}")
+
+        match = {}
+        for key, values in spec.get("match", {}).items():
+            if key not in SELECTORS:
+                raise LayoutError(f"cannot match on {key!r}, expected one of {SELECTORS}")
+            match[key] = frozenset([values] if isinstance(values, str) else values)
+
+        fields = {
+            field_name: _compile_field(field_name, field_spec)
+            for field_name, field_spec in spec["fields"].items()
+        }
+    except LayoutError as e:
+        raise LayoutError(f"Layout {name}: {e}") from e
+    except (KeyError, TypeError, ValueError) as e:
+        raise LayoutError(f"Layout {name}: invalid specification ({e!r})") from e
+
+    canonical = json.dumps(spec, sort_keys=True, ensure_ascii=False)
+    return Layout(
+        name=name,
+        template_path=template_path,
+        font_path=font_path,
+        match=match,
+        priority=int(spec.get("priority", 0)),
+        fields=fields,
+        fingerprint=hashlib.sha256(canonical.encode()).hexdigest(),
+    )
+
+
+def _compile_field(field_name: str, spec: Dict[str, Any]) -> FieldLayout:
+    """Compile one field of a layout specification."""
+    align = spec.get("align", "left")
+    shaping = spec.get("shaping", "none")
+    if align not in ALIGNMENTS:
+        raise LayoutError(f"{field_name}: align must be one of {ALIGNMENTS}")
+    if shaping not in SHAPINGS:
+        raise LayoutError(f"{field_name}: shaping must be one of {SHAPINGS}")
+
+    width: Optional[float]
+    height: Optional[float]
+    if align == "fit":
+        font_size = int(spec["max_font_size"])
+        min_font_size = int(spec["min_font_size"])
+        width, height = float(spec["width"]), float(spec["height"])
+    else:
+        font_size = min_font_size = int(spec["font_size"])
+        width = float(spec["width"]) if "width" in spec else None
+        height = None
+    if align == "left" and "x" not in spec:
+        raise LayoutError(f"{field_name}: left-aligned fields need an x position")
+
+    return FieldLayout(
+        align=align,
+        x=float(spec["x"]) if "x" in spec else None,
+        y=float(spec["y"]),
+        width=width,
+        height=height,
+        font_size=font_size,
+        min_font_size=min_font_size,
+        # Colors converted to RGBA are always 4-tuples
+        color=cast(
+            Tuple[int, int, int, int], ImageColor.getcolor(spec.get("color", "#FFFFFF"), "RGBA")
+        ),
+        shaping=shaping,
+    )
+
+
+# Shared engine used by the card generator
+layout_engine = LayoutEngine()
@@ -0,0 +1,400 @@
+"""Ledger of issued cards, written in batches off the event loop."""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+from app.config import settings
+from app.models import CardData
+
+logger = logging.getLogger(__name__)
+
+# Delivery statuses of a ledger entry
+DELIVERED = "delivered"
+DEAD_LETTER = "dead_letter"
+FAILED = "failed"
+
+# Records kept per store while it cannot be written to
+MAX_BACKLOG = 100_000
+
+
+class OrderRecord(NamedTuple):
+    """One issued card: who asked for it, what it says and how it went out."""
+
+    order_id: str
+    created_at: float
+    user_id: int
+    price: str
+    country: str
+    activation_code: str
+    customer_name: str
+    issue_date: str
+    issue_time: str
+    render_seconds: Optional[float]
+    status: str
+
+    @classmethod
+    def create(
+        cls,
+        user_id: int,
+        card: CardData,
+        status: str,
+        render_seconds: Optional[float] = None,
+    ) -> "OrderRecord":
+        """
+        Build a record for a card.
+
+        Args:
+            user_id: Telegram user ID of the operator
+            card: CardData of the issued card
+            status: DELIVERED, DEAD_LETTER or FAILED
+            render_seconds: Time to render the card (None when it came from a cache)
+
+        Returns:
+            New record with a unique order ID
+        """
+        return cls(
+            order_id=uuid.uuid4().hex,
+            created_at=time.time(),
+            user_id=user_id,
+            price=card.price,
+            country=card.country,
+            activation_code=card.activation_code,
+            customer_name=card.customer_name,
+            issue_date=card.issue_date,
+            issue_time=card.issue_time,
+            render_seconds=render_seconds,
+            status=status,
+        )
+
+
+_PLACEHOLDERS = ", ".join("?" * len(OrderRecord._fields))
+
+
+class LedgerStore(ABC):
+    """Destination of ledger records."""
+
+    @abstractmethod
+    def write_many(self, records: Sequence[OrderRecord]) -> None:
+        """
+        Append a batch of records.
+
+        Args:
+            records: Records to write
+        """
+
+    def close(self) -> None:
+        """Release the store's file or connection."""
+
+
+class SQLiteLedgerStore(LedgerStore):
+    """
+    Ledger in a SQLite database in WAL mode.
+
+    Activation codes and customer names are indexed so duplicate codes and
+    a customer's orders can be looked up without a table scan.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Open (and create if needed) the database.
+
+        Args:
+            path: Database file path
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False, timeout=5.0)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS orders ("
+                "order_id TEXT PRIMARY KEY, created_at REAL NOT NULL, user_id INTEGER NOT NULL, "
+                "price TEXT NOT NULL, country TEXT NOT NULL, activation_code TEXT NOT NULL, "
+                "customer_name TEXT NOT NULL, issue_date TEXT NOT NULL, "
+                "issue_time TEXT NOT NULL, render_seconds REAL, status TEXT NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS orders_activation_code ON orders (activation_code)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS orders_customer_name ON orders (customer_name)"
+            )
+
+    def write_many(self, records: Sequence[OrderRecord]) -> None:
+        """Insert a batch of records in one transaction."""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO orders VALUES ({_PLACEHOLDERS})", records
+            )
+
+    def find(
+        self,
+        activation_code: Optional[str] = None,
+        customer_name: Optional[str] = None,
+        limit: int = 20,
+    ) -> List[OrderRecord]:
+        """
+        Look up orders by activation code or customer name.
+
+        Args:
+            activation_code: Formatted activation code to match
+            customer_name: Customer name to match exactly
+            limit: Maximum number of orders
+
+        Returns:
+            Matching orders, newest first
+        """
+        conditions, values = [], []
+        if activation_code is not None:
+            conditions.append("activation_code = ?")
+            values.append(activation_code)
+        if customer_name is not None:
+            conditions.append("customer_name = ?")
+            values.append(customer_name)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT * FROM orders {where} ORDER BY created_at DESC LIMIT ?",
+                (*values, limit),
+            ).fetchall()
+        return [OrderRecord(*row) for row in rows]
+
+    def count_issued(self) -> int:
+        """Number of orders whose card was delivered or is awaiting replay."""
+        with self._lock:
+            query = "SELECT COUNT(*) FROM orders WHERE status != ?"
+            return self._connection.execute(query, (FAILED,)).fetchone()[0]
+
+    def iter_issued_codes(self, batch_size: int = 10_000) -> Iterator[str]:
+        """
+        Stream the activation codes of every order that was not a failure.
+
+        Args:
+            batch_size: Rows fetched per round trip
+
+        Yields:
+            Activation codes (repeated codes appear once per order)
+        """
+        # Each batch is read under the lock and yielded without it, so writes go on
+        # while the caller consumes the codes
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT rowid, activation_code FROM orders "
+                    "WHERE status != ? AND rowid > ? ORDER BY rowid LIMIT ?",
+                    (FAILED, last_rowid, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            for _, code in rows:
+                yield code
+
+    def has_issued(self, activation_code: str) -> bool:
+        """
+        Check whether an activation code was issued, through the activation code index.
+
+        Args:
+            activation_code: Formatted activation code
+
+        Returns:
+            True if an order that was not a failure has the code
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM orders WHERE activation_code = ? AND status != ? LIMIT 1",
+                (activation_code, FAILED),
+            ).fetchone()
+        return row is not None
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._connection.close()
+
+
+class JsonlLedgerStore(LedgerStore):
+    """Append-only ledger with one JSON object per line."""
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Open the file for appending.
+
+        Args:
+            path: JSONL file path
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write_many(self, records: Sequence[OrderRecord]) -> None:
+        """Append a batch of records and flush them to the file."""
+        lines = [json.dumps(record._asdict(), ensure_ascii=False) + "\n" for record in records]
+        self._file.writelines(lines)
+        self._file.flush()
+
+    def count_issued(self) -> int:
+        """Number of orders whose card was delivered or is awaiting replay."""
+        return sum(1 for _ in self.iter_issued_codes())
+
+    def iter_issued_codes(self) -> Iterator[str]:
+        """
+        Stream the activation codes of every order that was not a failure, reading the file.
+
+        Yields:
+            Activation codes (repeated codes appear once per order)
+        """
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    order = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash mid-write
+                    continue
+                if order.get("status") != FAILED:
+                    yield order["activation_code"]
+
+    def close(self) -> None:
+        """Close the file."""
+        self._file.close()
+
+
+class OrderLedger:
+    """
+    Records issued cards through a background batching writer.
+
+    ``record`` only appends to an in-memory buffer, so handlers never wait
+    on disk I/O. A writer thread hands the buffer to every store once it
+    holds ``batch_size`` records or ``flush_interval`` seconds have passed;
+    a batch that fails to write is kept and retried with the next one.
+    """
+
+    def __init__(
+        self,
+        stores: Sequence[LedgerStore],
+        flush_interval: Optional[float] = None,
+        batch_size: Optional[int] = None,
+    ):
+        """
+        Initialize the ledger and start its writer.
+
+        Args:
+            stores: Stores every record is written to
+            flush_interval: Longest seconds a record waits before it is written
+                (defaults to settings.LEDGER_FLUSH_INTERVAL)
+            batch_size: Records that trigger an early write (defaults to settings.LEDGER_BATCH_SIZE)
+        """
+        self.stores = list(stores)
+        self.flush_interval = flush_interval or settings.LEDGER_FLUSH_INTERVAL
+        self.batch_size = batch_size or settings.LEDGER_BATCH_SIZE
+        self._pending: List[OrderRecord] = []
+        # Records each store failed to write, retried before the next batch
+        self._backlog: List[List[OrderRecord]] = [[] for _ in self.stores]
+        self._condition = threading.Condition()
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name="order-ledger", daemon=True)
+        self._writer.start()
+
+    @property
+    def sqlite(self) -> Optional[SQLiteLedgerStore]:
+        """The SQLite store used for lookups, if one is configured."""
+        for store in self.stores:
+            if isinstance(store, SQLiteLedgerStore):
+                return store
+        return None
+
+    @property
+    def jsonl(self) -> Optional[JsonlLedgerStore]:
+        """The JSONL store, if one is configured."""
+        for store in self.stores:
+            if isinstance(store, JsonlLedgerStore):
+                return store
+        return None
+
+    def record(self, record: OrderRecord) -> None:
+        """
+        Queue a record for writing without blocking.
+
+        Args:
+            record: Order to record
+        """
+        with self._condition:
+            self._pending.append(record)
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def find(self, **criteria: Any) -> List[OrderRecord]:
+        """
+        Look up orders in the SQLite store (see ``SQLiteLedgerStore.find``).
+
+        Records still waiting in the buffer are not included.
+
+        Returns:
+            Matching orders, newest first (empty without a SQLite store)
+        """
+        store = self.sqlite
+        return store.find(**criteria) if store is not None else []
+
+    def close(self) -> None:
+        """Write everything still buffered, stop the writer and close the stores."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._writer.join()
+        for store in self.stores:
+            store.close()
+
+    def _run(self) -> None:
+        """Write batches until the ledger is closed."""
+        while True:
+            with self._condition:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                batch, self._pending = self._pending, []
+                closed = self._closed
+            if batch or any(self._backlog):
+                self._write(batch)
+            if closed:
+                return
+
+    def _write(self, batch: List[OrderRecord]) -> None:
+        """Write a batch to every store; a store that fails gets it again next round."""
+        for index, store in enumerate(self.stores):
+            records = self._backlog[index] + batch
+            try:
+                store.write_many(records)
+                self._backlog[index] = []
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Error writing {len(records)} orders to the ledger: {e}")
+                if len(records) > MAX_BACKLOG:
+                    dropped = len(records) - MAX_BACKLOG
+                    logger.error(f"Ledger backlog full, dropping the {dropped} oldest orders")
+                    records = records[-MAX_BACKLOG:]
+                self._backlog[index] = records
+
+
+def create_order_ledger() -> Optional[OrderLedger]:
+    """
+    Create the ledger with the stores listed in settings.LEDGER_BACKEND.
+
+    Returns:
+        The ledger, or None when the ledger is disabled
+    """
+    stores: List[LedgerStore] = []
+    for backend in settings.LEDGER_BACKEND:
+        if backend == "sqlite":
+            stores.append(SQLiteLedgerStore(settings.LEDGER_DB_PATH))
+        elif backend == "jsonl":
+            stores.append(JsonlLedgerStore(settings.LEDGER_JSONL_PATH))
+    return OrderLedger(stores) if stores else None
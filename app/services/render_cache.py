@@ -0,0 +1,312 @@
+"""Content-addressed cache of encoded cards and their uploaded Telegram photos."""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.config import settings
+
+from .layout_engine import LayoutEngine, layout_engine
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry(NamedTuple):
+    """A cached value and when it was stored."""
+
+    value: bytes
+    stored_at: float
+
+
+class RenderCache:
+    """
+    Encoded cards keyed by a hash of their content.
+
+    The key covers the card fields the layout draws, output preset and
+    format, the layout and the template and font files, so a card is only
+    reused while it would render exactly the same. A resent order keeps the
+    issue date and time of its first card (see ``CardConversationHandler``),
+    so it hashes to the same key even with layouts that draw them. Entries
+    live in an LRU bounded by total size and age, with an optional on-disk
+    tier that survives restarts. The Telegram ``file_id`` of an uploaded
+    card is kept alongside, so resending a card reuses the photo already on
+    Telegram's servers.
+    """
+
+    IMAGE_SUFFIX = ".img"
+    FILE_ID_SUFFIX = ".id"
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        directory: Optional[Path] = None,
+        disk_max_bytes: Optional[int] = None,
+        max_file_ids: Optional[int] = None,
+        layouts: Optional[LayoutEngine] = None,
+    ):
+        """
+        Initialize the render cache.
+
+        Args:
+            max_bytes: Memory budget for encoded cards (defaults to settings.RENDER_CACHE_MAX_MB)
+            ttl: Seconds an entry stays valid (defaults to settings.RENDER_CACHE_TTL)
+            directory: On-disk tier (None keeps entries in memory only)
+            disk_max_bytes: Disk budget (defaults to settings.RENDER_CACHE_DISK_MAX_MB)
+            max_file_ids: File IDs kept in memory (defaults to settings.RENDER_CACHE_FILE_IDS)
+            layouts: Card layouts (defaults to the shared layout engine)
+        """
+        megabyte = 1024 * 1024
+        self.max_bytes = max_bytes or settings.RENDER_CACHE_MAX_MB * megabyte
+        self.ttl = ttl or settings.RENDER_CACHE_TTL
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes or settings.RENDER_CACHE_DISK_MAX_MB * megabyte
+        self.max_file_ids = max_file_ids or settings.RENDER_CACHE_FILE_IDS
+        self.layouts = layouts or layout_engine
+        self._lock = threading.Lock()
+        self._images: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._file_ids: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._disk_bytes: Optional[int] = None
+
+    def key(
+        self,
+        card_data: Dict[str, str],
+        preset: Optional[str] = None,
+        output_format: Optional[str] = None,
+    ) -> str:
+        """
+        Compute the content hash of a card.
+
+        Args:
+            card_data: Card data dictionary
+            preset: Output size preset (defaults to settings.OUTPUT_PRESET)
+            output_format: Output format (defaults to settings.OUTPUT_FORMAT)
+
+        Returns:
+            Hex digest identifying the encoded card
+        """
+        self.layouts.refresh_if_due()
+        layout = self.layouts.select(card_data, preset)
+        files = []
+        for path in (layout.template_path, layout.font_path):
+            stat = path.stat()
+            files.append((str(path), stat.st_size, stat.st_mtime_ns))
+        # Fields the layout does not draw, such as the issue time, cannot change the card
+        drawn = {name: value for name, value in card_data.items() if name in layout.fields}
+        parts = {
+            "card": drawn,
+            "preset": preset or settings.OUTPUT_PRESET,
+            "format": (output_format or settings.OUTPUT_FORMAT).upper(),
+            "layout": layout.fingerprint,
+            "files": files,
+        }
+        canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Get a cached card.
+
+        Args:
+            key: Content hash from ``key``
+
+        Returns:
+            Encoded card, or None if it is not cached or has expired
+        """
+        return self._get(self._images, key, self.IMAGE_SUFFIX)
+
+    def put(self, key: str, image: bytes) -> None:
+        """
+        Cache an encoded card, evicting the least recently used ones over budget.
+
+        Args:
+            key: Content hash from ``key``
+            image: Encoded card
+        """
+        if len(image) > self.max_bytes:
+            return
+        with self._lock:
+            self._store(self._images, key, image, time.time())
+        self._write(key, self.IMAGE_SUFFIX, image)
+
+    def get_file_id(self, key: str) -> Optional[str]:
+        """
+        Get the Telegram file ID of a card that was already uploaded.
+
+        Args:
+            key: Content hash from ``key``
+
+        Returns:
+            File ID, or None if the card was not uploaded
+        """
+        value = self._get(self._file_ids, key, self.FILE_ID_SUFFIX)
+        return value.decode() if value is not None else None
+
+    def set_file_id(self, key: str, file_id: str) -> None:
+        """
+        Remember the Telegram file ID of an uploaded card.
+
+        Args:
+            key: Content hash from ``key``
+            file_id: File ID of the uploaded photo
+        """
+        with self._lock:
+            self._store(self._file_ids, key, file_id.encode(), time.time())
+        self._write(key, self.FILE_ID_SUFFIX, file_id.encode())
+
+    def forget_file_id(self, key: str) -> None:
+        """
+        Drop a file ID that Telegram no longer accepts.
+
+        Args:
+            key: Content hash from ``key``
+        """
+        with self._lock:
+            self._file_ids.pop(key, None)
+        if self.directory is not None:
+            self._remove(self.directory / f"{key}{self.FILE_ID_SUFFIX}")
+
+    def clear(self) -> None:
+        """Drop every cached card and file ID from memory."""
+        with self._lock:
+            self._images.clear()
+            self._file_ids.clear()
+            self._bytes = 0
+
+    def _get(self, entries: "OrderedDict[str, _Entry]", key: str, suffix: str) -> Optional[bytes]:
+        """Look a key up in memory, then on disk."""
+        now = time.time()
+        with self._lock:
+            entry = entries.get(key)
+            if entry is not None:
+                if now - entry.stored_at <= self.ttl:
+                    entries.move_to_end(key)
+                    return entry.value
+                self._discard(entries, key)
+
+        stored = self._read(key, suffix, now)
+        if stored is None:
+            return None
+        with self._lock:
+            self._store(entries, key, *stored)
+        return stored[0]
+
+    def _store(
+        self, entries: "OrderedDict[str, _Entry]", key: str, value: bytes, stored_at: float
+    ) -> None:
+        """Insert or replace an entry and evict over budget; the caller holds the lock."""
+        self._discard(entries, key)
+        entries[key] = _Entry(value, stored_at)
+        if entries is self._images:
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                _, entry = self._images.popitem(last=False)
+                self._bytes -= len(entry.value)
+        else:
+            while len(entries) > self.max_file_ids:
+                entries.popitem(last=False)
+
+    def _discard(self, entries: "OrderedDict[str, _Entry]", key: str) -> None:
+        """Remove an entry if present; the caller holds the lock."""
+        entry = entries.pop(key, None)
+        if entry is not None and entries is self._images:
+            self._bytes -= len(entry.value)
+
+    def _read(self, key: str, suffix: str, now: float) -> Optional[Tuple[bytes, float]]:
+        """Read an unexpired entry and its write time from the disk tier."""
+        if self.directory is None:
+            return None
+        path = self.directory / f"{key}{suffix}"
+        try:
+            stored_at = path.stat().st_mtime
+            if now - stored_at > self.ttl:
+                self._remove(path)
+                return None
+            return path.read_bytes(), stored_at
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Could not read cached card {path.name}: {e}")
+            return None
+
+    def _write(self, key: str, suffix: str, value: bytes) -> None:
+        """Write an entry to the disk tier and keep the tier within its budget."""
+        if self.directory is None:
+            return
+        path = self.directory / f"{key}{suffix}"
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Write under a temporary name so readers never see a partial file
+            temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            temporary.write_bytes(value)
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.warning(f"Could not save cached card to {self.directory}: {e}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(stat.st_size for stat, _ in self._disk_files())
+            else:
+                self._disk_bytes += len(value)
+            if self._disk_bytes > self.disk_max_bytes:
+                self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        """Delete expired and then the oldest disk entries down to 90% of the budget."""
+        now = time.time()
+        files = self._disk_files()
+        total = sum(stat.st_size for stat, _ in files)
+        for stat, path in files:
+            if total <= self.disk_max_bytes * 0.9 and now - stat.st_mtime <= self.ttl:
+                continue
+            if self._remove(path):
+                total -= stat.st_size
+        self._disk_bytes = total
+        logger.info(f"Render cache pruned to {total / (1024 * 1024):.1f} MB on disk")
+
+    def _disk_files(self) -> List[Tuple[os.stat_result, Path]]:
+        """List the files of the disk tier with their stats, oldest first."""
+        files = []
+        for path in self.directory.iterdir():
+            if path.suffix not in (self.IMAGE_SUFFIX, self.FILE_ID_SUFFIX):
+                continue
+            try:
+                files.append((path.stat(), path))
+            except FileNotFoundError:
+                # Deleted by another process sharing the directory
+                continue
+        files.sort(key=lambda pair: pair[0].st_mtime)
+        return files
+
+    @staticmethod
+    def _remove(path: Path) -> bool:
+        """Delete a disk entry, ignoring one that is already gone."""
+        try:
+            path.unlink()
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"Could not delete cached card {path.name}: {e}")
+            return False
+
+
+def create_render_cache() -> Optional[RenderCache]:
+    """
+    Create the render cache selected by the settings.
+
+    Returns:
+        The cache, or None when settings.RENDER_CACHE is off
+    """
+    if not settings.RENDER_CACHE:
+        return None
+    directory = settings.RENDER_CACHE_DIR if settings.RENDER_CACHE_DISK else None
+    return RenderCache(directory=directory)
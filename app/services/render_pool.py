@@ -0,0 +1,294 @@
+"""Worker pool that keeps card rendering off the asyncio event loop."""
+
+import asyncio
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.utils.metrics import (
+    RENDER_MEMORY_RESERVED,
+    RENDER_PEAK_BYTES,
+    RENDER_QUEUE_DEPTH,
+    RENDER_SECONDS,
+    RENDERS_IN_FLIGHT,
+    RENDERS_REJECTED_TOTAL,
+    collect_stages,
+    observe_stage,
+)
+
+from .buffer_pool import track_memory
+from .card_generator import CardGeneratorService
+
+logger = logging.getLogger(__name__)
+
+# Generator owned by the current worker (one per process)
+_worker_generator: Optional[CardGeneratorService] = None
+
+
+def _init_worker() -> None:
+    """Create and warm up the worker's card generator."""
+    global _worker_generator
+    if _worker_generator is None:
+        _worker_generator = CardGeneratorService()
+        _worker_generator.warm_up()
+
+
+def _warm_worker() -> int:
+    """
+    Task submitted at startup to force every worker to warm up.
+
+    Returns:
+        Peak image memory of rendering a blank card, a first estimate per render
+    """
+    _init_worker()
+    with track_memory() as memory:
+        _worker_generator.generate_card_bytes({})
+    return memory.peak
+
+
+def _render(
+    card_data: Dict[str, str], preset: Optional[str] = None
+) -> Tuple[bytes, float, List[Tuple[str, float]], int]:
+    """
+    Render and encode a card inside a worker.
+
+    Returns:
+        Encoded image, render duration in seconds, per-stage timings and peak image memory
+    """
+    _init_worker()
+    started = time.perf_counter()
+    with collect_stages() as stages, track_memory() as memory:
+        image = _worker_generator.generate_card_bytes(card_data, preset=preset)
+    return image, time.perf_counter() - started, stages, memory.peak
+
+
+class RenderQueueFullError(Exception):
+    """Raised when the render pool cannot accept more work."""
+
+    def __init__(self, estimated_wait: float):
+        """
+        Initialize the error.
+
+        Args:
+            estimated_wait: Estimated seconds until a slot frees up
+        """
+        super().__init__(f"Render queue is full (estimated wait {estimated_wait:.1f}s)")
+        self.estimated_wait = estimated_wait
+
+
+class RenderPool:
+    """
+    Runs card rendering on a bounded thread or process pool.
+
+    Besides the queue bound, renders reserve the image memory they are
+    expected to take (the largest peak seen so far) against a memory cap.
+    A render that would go over the cap waits for running renders to hand
+    their memory back, and is turned away like a full queue if that takes
+    too long. One render is always let through, however large.
+    """
+
+    def __init__(
+        self,
+        pool_type: Optional[str] = None,
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        memory_limit: Optional[int] = None,
+    ):
+        """
+        Initialize the render pool.
+
+        Args:
+            pool_type: "thread" or "process" (defaults to settings.RENDER_POOL_TYPE)
+            workers: Number of workers (defaults to settings.RENDER_WORKERS)
+            queue_size: Renders allowed to wait for a worker (defaults to settings.RENDER_QUEUE_SIZE)
+            memory_limit: Bytes of image memory renders in flight may reserve, 0 for no cap
+                (defaults to settings.RENDER_MEMORY_MAX_MB)
+        """
+        self.pool_type = pool_type or settings.RENDER_POOL_TYPE
+        self.workers = workers or settings.RENDER_WORKERS
+        self.queue_size = settings.RENDER_QUEUE_SIZE if queue_size is None else queue_size
+        if memory_limit is None:
+            memory_limit = settings.RENDER_MEMORY_MAX_MB * 1024 * 1024
+        self.memory_limit = memory_limit
+        self._executor: Optional[Executor] = None
+        self._warmups: List[Future] = []
+        self._in_flight = 0
+        self._average_duration = 1.0
+        self._render_bytes = 0
+        self._reserved = 0
+        self._memory_freed: Optional[asyncio.Condition] = None
+
+        RENDERS_IN_FLIGHT.set_function(lambda: self._in_flight)
+        RENDER_QUEUE_DEPTH.set_function(lambda: self.queue_depth)
+        RENDER_MEMORY_RESERVED.set_function(lambda: self._reserved)
+
+    @property
+    def in_flight(self) -> int:
+        """Number of renders queued or running."""
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of renders waiting for a free worker."""
+        return max(0, self._in_flight - self.workers)
+
+    @property
+    def render_bytes(self) -> int:
+        """Largest image memory one render has taken, reserved for each new render."""
+        return self._render_bytes
+
+    def start(self, wait: bool = True) -> None:
+        """
+        Start the workers and warm them up with the template and fonts.
+
+        Args:
+            wait: Block until every worker is warm (otherwise see ``when_warm``)
+        """
+        if self._executor is not None:
+            return
+
+        if self.pool_type == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="render",
+                initializer=_init_worker,
+            )
+
+        self._warmups = [self._executor.submit(_warm_worker) for _ in range(self.workers)]
+        for future in self._warmups:
+            future.add_done_callback(self._record_warm_up)
+        logger.info(f"Render pool started: {self.workers} {self.pool_type} worker(s)")
+        if wait:
+            for future in self._warmups:
+                future.result()
+
+    def when_warm(self, callback: Callable[[], None]) -> None:
+        """
+        Call a function once every worker started by ``start`` has warmed up.
+
+        The callback runs on a pool thread, or right away if the workers are
+        already warm. It is not called if a worker fails to warm up.
+
+        Args:
+            callback: Function to call
+        """
+        remaining = [len(self._warmups)]
+        lock = threading.Lock()
+
+        def done(future: Future) -> None:
+            """Count down finished warm-ups and call back after the last one."""
+            error = future.exception()
+            if error is not None:
+                logger.error(f"Render worker failed to warm up: {error}")
+                return
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                callback()
+
+        for future in self._warmups:
+            future.add_done_callback(done)
+
+    def _record_warm_up(self, future: Future) -> None:
+        """Take a warmed-up worker's blank card as the first memory estimate."""
+        if future.exception() is None:
+            self._render_bytes = max(self._render_bytes, future.result())
+
+    def shutdown(self) -> None:
+        """Stop the workers, waiting for running renders to finish."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def estimated_wait(self) -> float:
+        """Estimate the seconds a new render would wait for a worker."""
+        waves = math.ceil((self._in_flight + 1) / self.workers)
+        return waves * self._average_duration
+
+    async def render(self, card_data: Dict[str, str], preset: Optional[str] = None) -> bytes:
+        """
+        Render a card on the pool without blocking the event loop.
+
+        Args:
+            card_data: Dictionary containing card information
+            preset: Output size preset (defaults to settings.OUTPUT_PRESET)
+
+        Returns:
+            Encoded card image
+
+        Raises:
+            RenderQueueFullError: If the pool and its queue are full, or no memory
+                frees up within settings.RENDER_MEMORY_WAIT
+        """
+        if self._in_flight >= self.workers + self.queue_size:
+            RENDERS_REJECTED_TOTAL.inc()
+            raise RenderQueueFullError(self.estimated_wait())
+
+        # Renders queue behind the warm-ups of a pool started here, so never wait for them
+        self.start(wait=False)
+        loop = asyncio.get_running_loop()
+        self._in_flight += 1
+        reserved = 0
+        try:
+            reserved = await self._reserve_memory()
+            image, duration, stages, peak = await loop.run_in_executor(
+                self._executor, _render, card_data, preset
+            )
+        finally:
+            self._in_flight -= 1
+            if reserved:
+                await self._release_memory(reserved)
+
+        RENDER_SECONDS.observe(duration)
+        RENDER_PEAK_BYTES.observe(peak)
+        self._render_bytes = max(self._render_bytes, peak)
+        if self.pool_type == "process":
+            # Worker processes have their own registry, so record their stages here
+            for stage, seconds in stages:
+                observe_stage(stage, seconds)
+
+        self._average_duration = 0.8 * self._average_duration + 0.2 * duration
+        return image
+
+    async def _reserve_memory(self) -> int:
+        """
+        Wait until a render fits under the memory cap and reserve its memory.
+
+        Returns:
+            Bytes reserved, to be handed back with ``_release_memory``
+
+        Raises:
+            RenderQueueFullError: If no memory frees up within settings.RENDER_MEMORY_WAIT
+        """
+        nbytes = self._render_bytes
+        if not self.memory_limit or not nbytes:
+            return 0
+
+        if self._memory_freed is None:
+            self._memory_freed = asyncio.Condition()
+        async with self._memory_freed:
+            try:
+                await asyncio.wait_for(
+                    self._memory_freed.wait_for(
+                        lambda: not self._reserved or self._reserved + nbytes <= self.memory_limit
+                    ),
+                    settings.RENDER_MEMORY_WAIT,
+                )
+            except asyncio.TimeoutError:
+                RENDERS_REJECTED_TOTAL.inc()
+                raise RenderQueueFullError(self.estimated_wait()) from None
+            self._reserved += nbytes
+        return nbytes
+
+    async def _release_memory(self, nbytes: int) -> None:
+        """Hand back memory reserved by a finished render and wake waiting renders."""
+        async with self._memory_freed:
+            self._reserved -= nbytes
+            self._memory_freed.notify_all()
@@ -0,0 +1,459 @@
+"""Render service: card rendering in separate worker processes, reached over HTTP."""
+
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from app.config import settings
+from app.utils.metrics import (
+    RENDER_PEAK_BYTES,
+    RENDER_SECONDS,
+    RENDERS_REJECTED_TOTAL,
+    observe_stage,
+)
+
+from .render_pool import RenderPool, RenderQueueFullError, _init_worker, _render
+
+logger = logging.getLogger(__name__)
+
+# Host name sent to services listening on a Unix socket
+UNIX_BASE_URL = "http://render-service"
+
+# Header carrying the shared secret with every render request
+SECRET_HEADER = "X-Render-Secret"
+
+# Seconds between readiness probes while waiting for the service, and before replacing a worker
+RETRY_INTERVAL = 1.0
+
+
+class RenderServiceError(Exception):
+    """Raised when the render service cannot be reached or fails to render a card."""
+
+
+def service_address(url: str) -> Tuple[str, Optional[str]]:
+    """
+    Split a render service URL into an HTTP base URL and a Unix socket path.
+
+    Args:
+        url: ``http://host:port`` or ``unix:///path/to/socket``
+
+    Returns:
+        Base URL for requests, and the socket path (None over TCP)
+
+    Raises:
+        ValueError: If the URL is neither http nor unix
+    """
+    parts = urlsplit(url)
+    if parts.scheme == "unix" and parts.path:
+        return UNIX_BASE_URL, parts.path
+    if parts.scheme == "http" and parts.hostname:
+        return f"http://{parts.netloc}", None
+    raise ValueError(f"Render service URL must be http://host:port or unix:///path: {url}")
+
+
+def is_local_address(url: str) -> bool:
+    """
+    Check whether a render service URL can only be reached from this host.
+
+    Args:
+        url: ``http://host:port`` or ``unix:///path/to/socket``
+
+    Returns:
+        True for Unix sockets and loopback addresses
+    """
+    _, path = service_address(url)
+    if path is not None:
+        return True
+    host = urlsplit(url).hostname or ""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class _RenderHTTPServer(HTTPServer):
+    """HTTP server on an already listening socket, with the limits its requests are held to."""
+
+    def __init__(self, sock: socket.socket, secret: str, max_body: int):
+        super().__init__(sock.getsockname(), _RenderRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.secret = secret
+        self.max_body = max_body
+
+
+class _RenderRequestHandler(BaseHTTPRequestHandler):
+    """Renders cards posted to /render and answers health checks on /healthz and /readyz."""
+
+    server: _RenderHTTPServer
+
+    def do_GET(self) -> None:  # noqa: N802 - http.server naming
+        """Report the worker as ready; workers only accept connections once warm."""
+        if self.path.split("?")[0] not in ("/healthz", "/readyz"):
+            self.send_error(404)
+            return
+        body = json.dumps({"ready": True, "pid": os.getpid()}).encode()
+        self._reply(200, body, "application/json")
+
+    def do_POST(self) -> None:  # noqa: N802 - http.server naming
+        """Render the card in a ``{"card": {...}, "preset": ...}`` body and return the image."""
+        if self.path != "/render":
+            self.send_error(404)
+            return
+        secret = self.server.secret
+        if secret and not hmac.compare_digest(
+            self.headers.get(SECRET_HEADER, "").encode(), secret.encode()
+        ):
+            self._reply(401, b"Missing or wrong render secret", "text/plain; charset=utf-8")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+            if length < 0:
+                raise ValueError("negative Content-Length")
+            if length > self.server.max_body:
+                body = f"Render request over {self.server.max_body} bytes".encode()
+                self._reply(413, body, "text/plain; charset=utf-8")
+                return
+            request = json.loads(self.rfile.read(length))
+            card, preset = request["card"], request.get("preset")
+            if not isinstance(card, dict):
+                raise ValueError("card must be an object")
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, f"Bad render request: {e}".encode(), "text/plain; charset=utf-8")
+            return
+
+        try:
+            image, duration, stages, peak = _render(card, preset)
+        except Exception as e:
+            logger.error(f"Error rendering card: {e}")
+            self._reply(500, f"Render failed: {e}".encode(), "text/plain; charset=utf-8")
+            return
+
+        # Timings and memory travel back in headers for the bot's metrics
+        headers = {
+            "X-Render-Seconds": repr(duration),
+            "X-Render-Peak-Bytes": str(peak),
+            "X-Render-Stages": json.dumps(stages),
+        }
+        self._reply(200, image, "application/octet-stream", headers)
+
+    def _reply(
+        self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None
+    ) -> None:
+        """Send a complete response."""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        """Keep requests out of the application log."""
+
+
+class RenderServer:
+    """
+    Pre-forked render workers sharing one listening socket.
+
+    The parent process warms up a card generator (template, fonts and the
+    variant cache) and then forks the workers, so they share the warmed
+    memory copy-on-write instead of each decoding it. Each worker serves one
+    render at a time from the shared socket, and the kernel hands new
+    connections to whichever worker is free. Workers that die are replaced;
+    on SIGTERM the workers finish the render in progress and exit.
+    """
+
+    def __init__(
+        self,
+        listen: Optional[str] = None,
+        workers: Optional[int] = None,
+        secret: Optional[str] = None,
+    ):
+        """
+        Initialize the server.
+
+        Args:
+            listen: ``http://host:port`` or ``unix:///path`` to listen on
+                (defaults to settings.RENDER_SERVICE_LISTEN)
+            workers: Number of worker processes (defaults to settings.RENDER_WORKERS)
+            secret: Secret every render request must carry
+                (defaults to settings.RENDER_SERVICE_SECRET)
+
+        Raises:
+            ValueError: If the server would listen beyond this host without a secret
+        """
+        self.listen = listen or settings.RENDER_SERVICE_LISTEN
+        self.workers = workers or settings.RENDER_WORKERS
+        self.secret = secret or settings.RENDER_SERVICE_SECRET
+        if not self.secret and not is_local_address(self.listen):
+            raise ValueError(
+                f"Set RENDER_SERVICE_SECRET to listen on {self.listen}, "
+                "or listen on a loopback address or Unix socket"
+            )
+        self._children: Set[int] = set()
+        self._stopping = False
+
+    def serve_forever(self) -> None:
+        """Bind, warm up, fork the workers and keep them running until SIGTERM or SIGINT."""
+        sock, path = self._bind()
+        _init_worker()
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for _ in range(self.workers):
+            self._spawn(sock)
+        logger.info(f"Render service listening on {self.listen} with {self.workers} worker(s)")
+
+        try:
+            while self._children:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                self._children.discard(pid)
+                if not self._stopping:
+                    logger.error(f"Render worker {pid} exited ({status}), starting another")
+                    time.sleep(RETRY_INTERVAL)
+                    self._spawn(sock)
+        finally:
+            sock.close()
+            if path is not None:
+                Path(path).unlink(missing_ok=True)
+        logger.info("Render service stopped")
+
+    def _bind(self) -> Tuple[socket.socket, Optional[str]]:
+        """Open the listening socket, and return it with its Unix socket path if any."""
+        parts = urlsplit(self.listen)
+        _, path = service_address(self.listen)
+        if path is not None:
+            Path(path).unlink(missing_ok=True)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(path)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((parts.hostname, parts.port or 80))
+        sock.listen(128)
+        return sock, path
+
+    def _spawn(self, sock: socket.socket) -> None:
+        """Fork a worker serving renders from the shared socket."""
+        pid = os.fork()
+        if pid:
+            self._children.add(pid)
+            return
+
+        status = 0
+        try:
+            self._serve_worker(
+                _RenderHTTPServer(sock, self.secret, settings.RENDER_SERVICE_MAX_BODY)
+            )
+        except Exception as e:
+            logger.error(f"Render worker failed: {e}", exc_info=True)
+            status = 1
+        finally:
+            os._exit(status)
+
+    @staticmethod
+    def _serve_worker(server: HTTPServer) -> None:
+        """Serve renders in a worker process until it is told to stop."""
+        # Ctrl-C reaches the whole process group; the parent forwards it as SIGTERM
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+        thread = threading.Thread(target=server.serve_forever, name="render", daemon=True)
+        thread.start()
+        stop.wait()
+        # Lets the render in progress finish
+        server.shutdown()
+
+    def _stop(self, signum: int, frame: object) -> None:
+        """Stop the workers."""
+        self._stopping = True
+        for pid in self._children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+class RenderServiceClient(RenderPool):
+    """
+    Sends card renders to a render service instead of rendering in the bot.
+
+    It keeps the render pool's interface and queue bound, so the handlers
+    are unchanged: renders beyond ``workers + queue_size`` in flight are
+    turned away with ``RenderQueueFullError``. The bot process then holds no
+    templates or canvases; the service's workers do the rendering.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        timeout: Optional[float] = None,
+        secret: Optional[str] = None,
+    ):
+        """
+        Initialize the client.
+
+        Args:
+            url: Render service URL (defaults to settings.RENDER_SERVICE_URL)
+            workers: Render workers behind the URL (defaults to settings.RENDER_WORKERS)
+            queue_size: Renders allowed to wait for a worker
+                (defaults to settings.RENDER_QUEUE_SIZE)
+            timeout: Seconds to wait for a render (defaults to settings.RENDER_SERVICE_TIMEOUT)
+            secret: Secret sent with every render (defaults to settings.RENDER_SERVICE_SECRET)
+        """
+        super().__init__("service", workers, queue_size, memory_limit=0)
+        self.url = url or settings.RENDER_SERVICE_URL
+        self.timeout = timeout or settings.RENDER_SERVICE_TIMEOUT
+        self.secret = secret or settings.RENDER_SERVICE_SECRET
+        self._base_url, self._uds = service_address(self.url)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._waiter: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._ready_lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    def start(self, wait: bool = True) -> None:
+        """
+        Start waiting for the render service to become ready.
+
+        Args:
+            wait: Block until the service is ready (otherwise see ``when_warm``)
+        """
+        if self._waiter is None:
+            self._waiter = threading.Thread(
+                target=self._wait_until_ready, name="render-service", daemon=True
+            )
+            self._waiter.start()
+            logger.info(f"Rendering cards on the render service at {self.url}")
+        if wait:
+            self._ready.wait()
+
+    def when_warm(self, callback: Callable[[], None]) -> None:
+        """
+        Call a function once the render service answers its readiness check.
+
+        The callback runs on a background thread, or right away if the
+        service is already ready.
+
+        Args:
+            callback: Function to call
+        """
+        with self._ready_lock:
+            if not self._ready.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def shutdown(self) -> None:
+        """Forget the HTTP client; the service closes every connection after its response."""
+        self._client = None
+
+    async def render(self, card_data: Dict[str, str], preset: Optional[str] = None) -> bytes:
+        """
+        Render a card on the render service.
+
+        Args:
+            card_data: Dictionary containing card information
+            preset: Output size preset (defaults to settings.OUTPUT_PRESET)
+
+        Returns:
+            Encoded card image
+
+        Raises:
+            RenderQueueFullError: If too many renders are already in flight
+            RenderServiceError: If the service is unreachable or fails to render
+        """
+        if self._in_flight >= self.workers + self.queue_size:
+            RENDERS_REJECTED_TOTAL.inc()
+            raise RenderQueueFullError(self.estimated_wait())
+
+        self.start(wait=False)
+        self._in_flight += 1
+        try:
+            response = await self._http().post(
+                "/render", json={"card": card_data, "preset": preset}
+            )
+        except httpx.HTTPError as e:
+            raise RenderServiceError(f"Render service unreachable: {e}") from e
+        finally:
+            self._in_flight -= 1
+
+        if response.status_code != 200:
+            raise RenderServiceError(
+                f"Render service answered {response.status_code}: {response.text}"
+            )
+
+        duration = float(response.headers["X-Render-Seconds"])
+        RENDER_SECONDS.observe(duration)
+        RENDER_PEAK_BYTES.observe(int(response.headers["X-Render-Peak-Bytes"]))
+        for stage, seconds in json.loads(response.headers["X-Render-Stages"]):
+            observe_stage(stage, seconds)
+
+        self._average_duration = 0.8 * self._average_duration + 0.2 * duration
+        return response.content
+
+    def _http(self) -> httpx.AsyncClient:
+        """Get the HTTP client, creating it on the event loop's first render."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self._base_url,
+                headers={SECRET_HEADER: self.secret} if self.secret else None,
+                transport=httpx.AsyncHTTPTransport(uds=self._uds),
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.workers + self.queue_size),
+            )
+        return self._client
+
+    def _wait_until_ready(self) -> None:
+        """Poll the service's readiness check, then call back everyone waiting for it."""
+        transport = httpx.HTTPTransport(uds=self._uds)
+        with httpx.Client(base_url=self._base_url, transport=transport, timeout=5) as client:
+            while True:
+                try:
+                    if client.get("/readyz").status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                time.sleep(RETRY_INTERVAL)
+
+        logger.info(f"Render service at {self.url} is ready")
+        with self._ready_lock:
+            self._ready.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def create_render_pool() -> RenderPool:
+    """
+    Create where the bot renders its cards.
+
+    Returns:
+        A client of the render service at settings.RENDER_SERVICE_URL if one is set,
+        otherwise a local render pool
+    """
+    if settings.RENDER_SERVICE_URL:
+        return RenderServiceClient()
+    return RenderPool()
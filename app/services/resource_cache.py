@@ -0,0 +1,187 @@
+"""In-memory cache for decoded template images and loaded fonts."""
+
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceCache:
+    """Keeps the decoded card template and FreeType fonts in memory between renders."""
+
+    def __init__(
+        self,
+        template_path: Optional[Path] = None,
+        font_path: Optional[Path] = None,
+        reload_interval: Optional[float] = None,
+    ):
+        """
+        Initialize the resource cache.
+
+        Args:
+            template_path: Path to the card template (defaults to settings.TEMPLATE_PATH)
+            font_path: Path to the default font (defaults to settings.FONT_PATH)
+            reload_interval: Seconds between change checks by ``refresh_if_due``
+                (defaults to settings.FILE_RELOAD_INTERVAL)
+        """
+        self.template_path = template_path or settings.TEMPLATE_PATH
+        self.font_path = font_path or settings.FONT_PATH
+        self.reload_interval = (
+            settings.FILE_RELOAD_INTERVAL if reload_interval is None else reload_interval
+        )
+        self._checked = time.monotonic()
+        self._lock = threading.RLock()
+        self._templates: Dict[Tuple[str, float], Image.Image] = {}
+        self._fonts: Dict[Tuple[str, int], ImageFont.FreeTypeFont] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._local = threading.local()
+        # Bumped on every invalidation so dependent caches can spot stale entries
+        self.version = 0
+
+    def get_template(self, path: Optional[Path] = None, scale: float = 1.0) -> Image.Image:
+        """
+        Get a decoded RGBA template image.
+
+        The returned image is shared and must not be drawn on; use ``new_canvas``
+        to get a private copy for rendering.
+
+        Args:
+            path: Template path (defaults to the cache's template path)
+            scale: Size relative to the template file, resampled once and cached
+
+        Returns:
+            Cached RGBA template image
+        """
+        key = (str(path or self.template_path), scale)
+        template = self._templates.get(key)
+        if template is None:
+            with self._lock:
+                template = self._templates.get(key)
+                if template is None:
+                    template = self._load_template(*key)
+                    self._templates[key] = template
+        return template
+
+    def new_canvas(self, path: Optional[Path] = None, scale: float = 1.0) -> Image.Image:
+        """Get a private copy of a cached template to draw on."""
+        return self.get_template(path, scale).copy()
+
+    def get_font(self, size: int, path: Optional[Path] = None) -> ImageFont.FreeTypeFont:
+        """
+        Get a FreeType font object for the given path and size.
+
+        Args:
+            size: Font size in pixels
+            path: Font file path (defaults to the cache's font path)
+
+        Returns:
+            Cached font object
+        """
+        font_path = str(path or self.font_path)
+        key = (font_path, size)
+        font = self._fonts.get(key)
+        if font is None:
+            with self._lock:
+                font = self._fonts.get(key)
+                if font is None:
+                    font = ImageFont.truetype(font_path, size)
+                    self._fonts[key] = font
+                    self._remember_mtime(Path(font_path))
+        return font
+
+    def measure_draw(self) -> ImageDraw.ImageDraw:
+        """Get a per-thread scratch draw object for measuring text."""
+        draw = getattr(self._local, "draw", None)
+        if draw is None:
+            draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+            self._local.draw = draw
+        return draw
+
+    def warm_up(
+        self,
+        font_sizes: Iterable[int] = (),
+        template_path: Optional[Path] = None,
+        font_path: Optional[Path] = None,
+        scale: float = 1.0,
+    ) -> None:
+        """
+        Load a template and the given font sizes ahead of the first render.
+
+        Args:
+            font_sizes: Font sizes to preload
+            template_path: Template to preload (defaults to the cache's template path)
+            font_path: Font to preload the sizes of (defaults to the cache's font path)
+            scale: Template scale to preload
+        """
+        self.get_template(template_path, scale)
+        for size in font_sizes:
+            self.get_font(size, font_path)
+        logger.info(f"Resource cache warmed up ({len(self._fonts)} fonts)")
+
+    def invalidate(self) -> None:
+        """Drop every cached template and font so they are reloaded on next use."""
+        with self._lock:
+            self._templates.clear()
+            self._fonts.clear()
+            self._mtimes.clear()
+            self.version += 1
+
+    def refresh_if_changed(self) -> bool:
+        """
+        Invalidate the cache if any cached file changed on disk.
+
+        Returns:
+            True if the cache was invalidated
+        """
+        for path, mtime in list(self._mtimes.items()):
+            try:
+                changed = Path(path).stat().st_mtime != mtime
+            except FileNotFoundError:
+                changed = True
+            if changed:
+                logger.info(f"Resource changed on disk, reloading: {path}")
+                self.invalidate()
+                return True
+        return False
+
+    def refresh_if_due(self) -> bool:
+        """
+        Check the cached files for changes, at most once per ``reload_interval``.
+
+        Returns:
+            True if the cache was invalidated
+        """
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return False
+        self._checked = now
+        return self.refresh_if_changed()
+
+    def _load_template(self, path: str, scale: float) -> Image.Image:
+        """Decode a template, or resample the full-size one, for a scale."""
+        if scale != 1.0:
+            full = self.get_template(Path(path))
+            size = (max(1, round(full.width * scale)), max(1, round(full.height * scale)))
+            logger.info(f"Template scaled to {size[0]}x{size[1]}: {path}")
+            return full.resize(size, Image.Resampling.LANCZOS)
+
+        with Image.open(path) as image:
+            template = image.convert("RGBA")
+        self._remember_mtime(Path(path))
+        logger.info(f"Template loaded into cache: {path}")
+        return template
+
+    def _remember_mtime(self, path: Path) -> None:
+        """Record the modification time of a loaded file."""
+        self._mtimes[str(path)] = path.stat().st_mtime
+
+
+# Shared cache used by the card generator
+resource_cache = ResourceCache()
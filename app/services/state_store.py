@@ -0,0 +1,497 @@
+"""Persistent conversation state shared by bot processes."""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from telegram import Update
+from telegram.ext import Application, BasePersistence, ConversationHandler, PersistenceInput
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Namespace of the per-user data (price, country and code of an order in progress)
+USER_DATA = "user_data"
+
+# Namespace of the per-chat data
+CHAT_DATA = "chat_data"
+
+# Pending writes: (namespace, key) -> JSON value, or None to delete the key
+Writes = Dict[Tuple[str, str], Optional[str]]
+
+
+class StateStore(ABC):
+    """Key-value store of JSON strings grouped by namespace."""
+
+    @abstractmethod
+    def load(self, namespace: str) -> Dict[str, str]:
+        """
+        Read every key of a namespace.
+
+        Args:
+            namespace: Namespace to read
+
+        Returns:
+            Mapping of keys to JSON values
+        """
+
+    @abstractmethod
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        """
+        Read one key.
+
+        Args:
+            namespace: Namespace of the key
+            key: Key to read
+
+        Returns:
+            The JSON value, or None if the key is not stored
+        """
+
+    @abstractmethod
+    def write_many(self, writes: Writes) -> None:
+        """
+        Apply a batch of writes atomically.
+
+        Args:
+            writes: Values to store, with None marking keys to delete
+        """
+
+    def close(self) -> None:
+        """Release the store's connection."""
+
+
+class SQLiteStateStore(StateStore):
+    """
+    State store in a SQLite database in WAL mode.
+
+    Several processes on the same host can share one database file; each
+    batch of writes is a single transaction.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Open (and create if needed) the database.
+
+        Args:
+            path: Database file path
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False, timeout=5.0)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+            )
+
+    def load(self, namespace: str) -> Dict[str, str]:
+        """Read every key of a namespace."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT key, value FROM state WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        return dict(rows)
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        """Read one key."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def write_many(self, writes: Writes) -> None:
+        """Apply a batch of writes in one transaction."""
+        upserts = [(ns, key, value) for (ns, key), value in writes.items() if value is not None]
+        deletes = [(ns, key) for (ns, key), value in writes.items() if value is None]
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO state VALUES (?, ?, ?)", upserts)
+            self._connection.executemany(
+                "DELETE FROM state WHERE namespace = ? AND key = ?", deletes
+            )
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._connection.close()
+
+
+class RedisStateStore(StateStore):
+    """
+    State store in Redis, one hash per namespace.
+
+    Any client with the redis-py interface works, so a local stand-in such as
+    ``fakeredis.FakeRedis()`` can be passed instead of a server connection.
+    """
+
+    def __init__(self, client: Any = None, url: str = "", prefix: str = ""):
+        """
+        Connect to Redis.
+
+        Args:
+            client: Redis-compatible client (created from ``url`` when omitted)
+            url: Redis URL (defaults to settings.STATE_REDIS_URL)
+            prefix: Prefix of the hash names (defaults to settings.STATE_KEY_PREFIX)
+        """
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError("STATE_BACKEND=redis requires the redis package") from e
+            client = redis.Redis.from_url(url or settings.STATE_REDIS_URL)
+        self.client = client
+        self.prefix = prefix or settings.STATE_KEY_PREFIX
+
+    def load(self, namespace: str) -> Dict[str, str]:
+        """Read every field of the namespace's hash."""
+        values = self.client.hgetall(self.prefix + namespace)
+        return {_text(key): _text(value) for key, value in values.items()}
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        """Read one field of the namespace's hash."""
+        value = self.client.hget(self.prefix + namespace, key)
+        return None if value is None else _text(value)
+
+    def write_many(self, writes: Writes) -> None:
+        """Apply a batch of writes in one MULTI/EXEC transaction."""
+        pipeline = self.client.pipeline(transaction=True)
+        for (namespace, key), value in writes.items():
+            if value is None:
+                pipeline.hdel(self.prefix + namespace, key)
+            else:
+                pipeline.hset(self.prefix + namespace, key, value)
+        pipeline.execute()
+
+    def close(self) -> None:
+        """Close the client's connections."""
+        self.client.close()
+
+
+def _text(value: Union[str, bytes]) -> str:
+    """Decode a Redis reply that may be bytes."""
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class StatePersistence(BasePersistence):
+    """
+    Persistence for ``user_data``, ``chat_data`` and conversation states backed by a StateStore.
+
+    Changed entries are written to the store in batches in a background
+    thread, so the event loop never waits on disk or network I/O. User and
+    chat data are read back from the store before each update is handled,
+    and conversation states through ``refresh_conversations``, so processes
+    sharing a store share the state of every conversation. Entries with
+    writes still queued in this process are not read back, as they are newer
+    than the stored ones. Bot data and callback data are not used by the bot
+    and are not stored.
+    """
+
+    def __init__(self, store: StateStore, update_interval: Optional[float] = None):
+        """
+        Initialize the persistence.
+
+        Args:
+            store: Backing store
+            update_interval: Seconds between batches (defaults to settings.STATE_FLUSH_INTERVAL)
+        """
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval or settings.STATE_FLUSH_INTERVAL,
+        )
+        self.store = store
+        self._pending: Writes = {}
+        # Batch being written by the writer
+        self._writing: Writes = {}
+        self._writer: Optional["asyncio.Task[None]"] = None
+        # Open hold_writes blocks
+        self._holds = 0
+        # Last value this process read from or wrote to the store, per key
+        self._known: Writes = {}
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        """Load the stored user data."""
+        stored = await self._load(USER_DATA)
+        return {int(user_id): json.loads(value) for user_id, value in stored.items()}
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        """Load the stored chat data."""
+        stored = await self._load(CHAT_DATA)
+        return {int(chat_id): json.loads(value) for chat_id, value in stored.items()}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        """Bot data is not stored."""
+        return {}
+
+    async def get_callback_data(self) -> None:
+        """Callback data is not stored."""
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[Union[int, str], ...], object]:
+        """Load the stored states of a conversation handler."""
+        stored = await self._load(f"conversations:{name}")
+        return {tuple(json.loads(key)): json.loads(state) for key, state in stored.items()}
+
+    async def update_conversation(
+        self, name: str, key: Tuple[Union[int, str], ...], new_state: Optional[object]
+    ) -> None:
+        """Queue a conversation state change (None ends the conversation)."""
+        value = None if new_state is None else json.dumps(new_state)
+        self._queue(f"conversations:{name}", json.dumps(list(key)), value)
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        """Queue a user's data for writing."""
+        self._queue(USER_DATA, str(user_id), json.dumps(data, ensure_ascii=False))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        """Queue the deletion of a user's data."""
+        self._queue(USER_DATA, str(user_id), None)
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        """Queue a chat's data for writing (empty data is not stored)."""
+        value = json.dumps(data, ensure_ascii=False) if data else None
+        self._queue(CHAT_DATA, str(chat_id), value)
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        """Bot data is not stored."""
+
+    async def update_callback_data(self, data: Any) -> None:
+        """Callback data is not stored."""
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        """Queue the deletion of a chat's data."""
+        self._queue(CHAT_DATA, str(chat_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        """Replace a user's data with the stored data, which another process may have changed."""
+        await self._refresh(USER_DATA, str(user_id), user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        """Replace a chat's data with the stored data, which another process may have changed."""
+        await self._refresh(CHAT_DATA, str(chat_id), chat_data)
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        """Bot data is not stored."""
+
+    async def refresh_conversations(
+        self, update: Update, handlers: List[ConversationHandler]
+    ) -> None:
+        """
+        Reload the stored states of an update's conversations before the handlers check it.
+
+        Args:
+            update: Incoming update
+            handlers: Persistent conversation handlers of the application
+        """
+        for handler in handlers:
+            key = _conversation_key(handler, update)
+            if key is None:
+                continue
+            namespace = f"conversations:{handler.name}"
+            field = json.dumps(list(key))
+            stored = await self._get(namespace, field)
+            if self._has_local_write(namespace, field):
+                continue
+            # Filled the way the handler loads the states from persistence at startup, so the
+            # refresh is not handed back as a change (None is the same as no conversation)
+            state = None if stored is None else json.loads(stored)
+            _conversation_states(handler).update_no_track({key: state})
+
+    @contextmanager
+    def hold_writes(self) -> Iterator[None]:
+        """
+        Keep the writes queued inside the block for one batch, started when it ends.
+
+        The application hands changes over concurrently, so without this a
+        running writer could store a conversation's new state and its user
+        data in separate transactions, and another process could read one
+        without the other.
+        """
+        self._holds += 1
+        try:
+            yield
+        finally:
+            self._holds -= 1
+            if not self._holds and self._pending and self._writer is None:
+                self._writer = asyncio.create_task(self._write_pending())
+
+    async def flush(self) -> None:
+        """Write everything still queued and close the store."""
+        if self._writer is not None:
+            await self._writer
+        if self._pending:
+            await self._write_pending()
+        await asyncio.get_running_loop().run_in_executor(None, self.store.close)
+
+    async def _load(self, namespace: str) -> Dict[str, str]:
+        """Read a namespace from the store without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        stored = await loop.run_in_executor(None, self.store.load, namespace)
+        for key, value in stored.items():
+            self._known[(namespace, key)] = value
+        return stored
+
+    async def _get(self, namespace: str, key: str) -> Optional[str]:
+        """Read one key from the store without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        stored = await loop.run_in_executor(None, self.store.get, namespace, key)
+        if not self._has_local_write(namespace, key):
+            self._known[(namespace, key)] = stored
+        return stored
+
+    async def _refresh(self, namespace: str, key: str, data: Dict[Any, Any]) -> None:
+        """Replace data in place with its stored value, unless this process has newer writes."""
+        stored = await self._get(namespace, key)
+        if self._has_local_write(namespace, key):
+            return
+        data.clear()
+        if stored is not None:
+            data.update(json.loads(stored))
+
+    def _has_local_write(self, namespace: str, key: str) -> bool:
+        """Whether a write of the key is queued or being written."""
+        return (namespace, key) in self._pending or (namespace, key) in self._writing
+
+    def _queue(self, namespace: str, key: str, value: Optional[str]) -> None:
+        """
+        Queue a write, starting the writer if it is idle.
+
+        The application hands an update's user and chat data over again once
+        the update's task is done, by which time another process may have
+        stored newer data; a value this process already read or wrote is
+        therefore skipped rather than written back over it.
+        """
+        if (namespace, key) not in self._pending and self._known.get((namespace, key), "") == value:
+            return
+        self._pending[(namespace, key)] = value
+        if self._writer is None and not self._holds:
+            # Runs after the rest of this round of updates has been queued
+            self._writer = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self) -> None:
+        """Write queued changes in batches until none are left."""
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending and not self._holds:
+                batch, self._pending = self._pending, {}
+                self._writing = batch
+                try:
+                    await loop.run_in_executor(None, self.store.write_many, batch)
+                    self._known.update(batch)
+                except Exception as e:
+                    logger.error(f"Error writing conversation state: {e}")
+                    # Keep the failed batch for the next round, unless newer values arrived
+                    for key, value in batch.items():
+                        self._pending.setdefault(key, value)
+                    break
+                finally:
+                    self._writing = {}
+        finally:
+            self._writer = None
+
+
+def _conversation_key(
+    handler: ConversationHandler, update: Update
+) -> Optional[Tuple[Union[int, str], ...]]:
+    """
+    Build the key a conversation handler files an update's conversation under.
+
+    Returns:
+        The key, or None if the update has no conversation in the handler
+    """
+    if handler.per_message:
+        # Per-message conversations are keyed by callback queries, which the bot does not use
+        return None
+    key: List[Union[int, str]] = []
+    if handler.per_chat:
+        if update.effective_chat is None:
+            return None
+        key.append(update.effective_chat.id)
+    if handler.per_user:
+        if update.effective_user is None:
+            return None
+        key.append(update.effective_user.id)
+    return tuple(key)
+
+
+def _conversation_states(handler: ConversationHandler) -> Any:
+    """
+    Get the dictionary a conversation handler keeps its states in.
+
+    python-telegram-bot has no public way to change a handler's states after
+    startup, so this reaches the dictionary its persistence loading fills.
+    The library is pinned to the version this was written against.
+
+    Raises:
+        RuntimeError: If the installed python-telegram-bot keeps the states differently
+    """
+    states = getattr(handler, "_conversations", None)
+    if not callable(getattr(states, "update_no_track", None)):
+        raise RuntimeError(
+            "This python-telegram-bot version keeps conversation states differently; "
+            "install the version pinned in requirements.txt"
+        )
+    return states
+
+
+class SharedStateApplication(Application):
+    """
+    Application whose conversations follow a state store shared with other processes.
+
+    The application on its own loads conversation states once at startup and
+    hands changes to the persistence every ``update_interval`` seconds. This
+    one reloads the states of an update's conversations before handling it
+    and hands its changes over as soon as it is handled, so consecutive
+    messages of a conversation can go to different processes.
+    """
+
+    async def process_update(self, update: object) -> None:
+        """Handle an update against the stored conversation states."""
+        if not isinstance(self.persistence, StatePersistence):
+            await super().process_update(update)
+            return
+        if isinstance(update, Update):
+            handlers = [
+                handler
+                for group in self.handlers.values()
+                for handler in group
+                if isinstance(handler, ConversationHandler) and handler.persistent
+            ]
+            await self.persistence.refresh_conversations(update, handlers)
+        try:
+            await super().process_update(update)
+        finally:
+            await self.update_persistence()
+
+    async def update_persistence(self) -> None:
+        """Hand the changes over to the persistence, to be written in one batch."""
+        if not isinstance(self.persistence, StatePersistence):
+            await super().update_persistence()
+            return
+        with self.persistence.hold_writes():
+            await super().update_persistence()
+
+
+def create_persistence() -> Optional[StatePersistence]:
+    """
+    Create the conversation state persistence selected by settings.STATE_BACKEND.
+
+    Returns:
+        The persistence, or None when state is kept in memory only
+    """
+    if settings.STATE_BACKEND == "sqlite":
+        return StatePersistence(SQLiteStateStore(settings.STATE_DB_PATH))
+    if settings.STATE_BACKEND == "redis":
+        return StatePersistence(RedisStateStore())
+    return None
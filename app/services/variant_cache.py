@@ -0,0 +1,189 @@
+"""Pre-rendered category patches for every card price and country."""
+
+import hashlib
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+from app.models import CardData, CardPrice, Country
+
+from .layout_engine import Layout
+from .resource_cache import ResourceCache
+
+logger = logging.getLogger(__name__)
+
+# Card field holding the price and country
+CATEGORY_FIELD = "الفئة"
+
+# Bump when the way patches are rendered changes, so files on disk are rebuilt
+PATCH_FORMAT = 1
+
+
+class Patch(NamedTuple):
+    """Template pixels with the category drawn in, and where they go on the card."""
+
+    image: Image.Image
+    origin: Tuple[int, int]
+
+
+# Renders a category onto a transparent tile: (category, card size) -> (tile, origin)
+TileRenderer = Callable[[str, Tuple[int, int]], Optional[Tuple[Image.Image, Tuple[int, int]]]]
+
+
+class VariantCache:
+    """
+    Category patches for every ``CardPrice`` × ``Country`` combination of a layout.
+
+    Each patch is the area of the template under the category text with the
+    text already composited in, so a card starts from a template copy with
+    its patch pasted on and the category is never reshaped or drawn per card.
+    Patches only cover the text, so all variants together take a few MB.
+
+    The cache is rebuilt when the resource cache reloads the template or font,
+    and patches saved to disk are only reused if their fingerprint (enum
+    values, template, font and layout) still matches.
+    """
+
+    MANIFEST = "variants.json"
+
+    def __init__(
+        self,
+        render_tile: TileRenderer,
+        resources: ResourceCache,
+        layout: Layout,
+        directory: Optional[Path] = None,
+    ):
+        """
+        Initialize the variant cache.
+
+        Args:
+            render_tile: Draws a category onto a tile positioned on the card
+            resources: Template and font cache
+            layout: Layout the patches are rendered with
+            directory: Where patches are saved between runs (None keeps them in memory only)
+        """
+        self.render_tile = render_tile
+        self.resources = resources
+        self.layout = layout
+        self.directory = directory / layout.key if directory is not None else None
+        self._patches: Dict[str, Patch] = {}
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def categories(self) -> List[Tuple[str, str]]:
+        """
+        List every category the layout can put on a card.
+
+        Returns:
+            (file stem, category text) pairs, one per price and country
+        """
+        return [
+            (
+                f"{price.name}_{country.name}",
+                CardData(price.value, country.value, "", "", "", "").category,
+            )
+            for price in CardPrice
+            for country in Country
+            if self.layout.accepts(price.value, country.value)
+        ]
+
+    def get(self, category: str) -> Optional[Patch]:
+        """
+        Get the patch for a category, rebuilding the cache if resources changed.
+
+        Args:
+            category: Category text (e.g. "10$ USA")
+
+        Returns:
+            The patch, or None for a category without a variant
+        """
+        if self._version != self.resources.version:
+            self.build()
+        return self._patches.get(category)
+
+    def build(self) -> None:
+        """Load the patches from disk or render them for the current resources."""
+        with self._lock:
+            version = self.resources.version
+            if self._version == version:
+                return
+
+            template = self.resources.get_template(self.layout.template_path, self.layout.scale)
+            fingerprint = self.fingerprint()
+            patches = self._load(fingerprint)
+            if patches is None:
+                patches = self._render(template)
+                self._save(fingerprint, patches)
+
+            self._patches = patches
+            self._version = version
+            logger.info(f"Variant cache ready ({len(patches)} categories)")
+
+    def fingerprint(self) -> str:
+        """
+        Identify everything that affects how the patches look.
+
+        Returns:
+            Hex digest of the categories, template, font and layout
+        """
+        files = [self.layout.template_path, self.layout.font_path]
+        parts = {
+            "format": PATCH_FORMAT,
+            "categories": self.categories(),
+            "files": [(str(path), path.stat().st_size, path.stat().st_mtime_ns) for path in files],
+            "layout": self.layout.fingerprint,
+        }
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode()).hexdigest()
+
+    def _render(self, template: Image.Image) -> Dict[str, Patch]:
+        """Composite each category onto its area of the template."""
+        patches: Dict[str, Patch] = {}
+        for _, category in self.categories():
+            rendered = self.render_tile(category, template.size)
+            if rendered is None:
+                continue
+            tile, (left, top) = rendered
+            patch = template.crop((left, top, left + tile.width, top + tile.height))
+            patch.alpha_composite(tile)
+            patches[category] = Patch(patch, (left, top))
+        return patches
+
+    def _load(self, fingerprint: str) -> Optional[Dict[str, Patch]]:
+        """Load patches saved for this fingerprint, if there are any."""
+        if self.directory is None:
+            return None
+        try:
+            manifest = json.loads((self.directory / self.MANIFEST).read_text())
+            if manifest["fingerprint"] != fingerprint:
+                return None
+            patches = {}
+            for category, entry in manifest["patches"].items():
+                with Image.open(self.directory / entry["file"]) as image:
+                    patches[category] = Patch(image.convert("RGBA"), tuple(entry["origin"]))
+            return patches
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring saved card variants: {e}")
+            return None
+
+    def _save(self, fingerprint: str, patches: Dict[str, Patch]) -> None:
+        """Save patches to the cache directory, if one is configured."""
+        if self.directory is None:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            entries = {}
+            for stem, category in self.categories():
+                if category in patches:
+                    patch = patches[category]
+                    patch.image.save(self.directory / f"{stem}.png", compress_level=1)
+                    entries[category] = {"file": f"{stem}.png", "origin": list(patch.origin)}
+            manifest = {"fingerprint": fingerprint, "patches": entries}
+            (self.directory / self.MANIFEST).write_text(json.dumps(manifest, ensure_ascii=False))
+        except OSError as e:
+            logger.warning(f"Could not save card variants to {self.directory}: {e}")
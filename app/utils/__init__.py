@@ -1,6 +1,31 @@
 """Utility functions and constants."""
 
-from .constants import POSITIONS, ConversationStates
-from .text_processor import ArabicTextProcessor
+from typing import TYPE_CHECKING, Any
 
-__all__ = ["POSITIONS", "ConversationStates", "ArabicTextProcessor"]
+from .constants import (
+    COUNTRY_KEYBOARD,
+    MESSAGES,
+    PRICE_KEYBOARD,
+    ConversationStates,
+)
+
+if TYPE_CHECKING:
+    from .text_processor import ArabicTextProcessor
+
+
+def __getattr__(name: str) -> Any:
+    """Import the text processor (and arabic_reshaper and bidi) on first use."""
+    if name == "ArabicTextProcessor":
+        from .text_processor import ArabicTextProcessor
+
+        return ArabicTextProcessor
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = [
+    "COUNTRY_KEYBOARD",
+    "MESSAGES",
+    "PRICE_KEYBOARD",
+    "ConversationStates",
+    "ArabicTextProcessor",
+]
@@ -0,0 +1,43 @@
+"""Local time and the issue date and time printed on cards."""
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from app.config import settings
+
+DATE_FORMAT = "%Y-%m-%d"
+TIME_FORMAT = "%I:%M %p"
+
+# Minute and formatted (date, time) of the last stamp, replaced as one tuple
+_last_stamp: Tuple[Optional[datetime], Tuple[str, str]] = (None, ("", ""))
+
+
+def local_timezone() -> timezone:
+    """Get the fixed-offset timezone of settings.TIMEZONE_OFFSET_HOURS."""
+    return timezone(timedelta(hours=settings.TIMEZONE_OFFSET_HOURS))
+
+
+def local_now() -> datetime:
+    """Get the current timezone-aware local time."""
+    return datetime.now(local_timezone())
+
+
+def issue_stamp(now: Optional[datetime] = None) -> Tuple[str, str]:
+    """
+    Format the issue date and time of a card.
+
+    Cards issued in the same minute share one formatting.
+
+    Args:
+        now: Local time (defaults to ``local_now()``)
+
+    Returns:
+        Date as ``%Y-%m-%d`` and time as ``%I:%M %p``
+    """
+    global _last_stamp
+    minute = (now or local_now()).replace(second=0, microsecond=0)
+    last_minute, stamp = _last_stamp
+    if minute != last_minute:
+        stamp = (minute.strftime(DATE_FORMAT), minute.strftime(TIME_FORMAT))
+        _last_stamp = (minute, stamp)
+    return stamp
@@ -1,7 +1,6 @@
 """Constants used throughout the application."""
 
 from enum import IntEnum
-from typing import Dict, Tuple
 
 
 class ConversationStates(IntEnum):
@@ -11,16 +10,7 @@ class ConversationStates(IntEnum):
     COUNTRY = 1
     CODE = 2
     NAME = 3
-
-
-# Position coordinates for text on the card image (scaled by 3.125)
-POSITIONS: Dict[str, Tuple[float, float]] = {
-    "الفئة": (300 * 3.125, 492 * 3.125),
-    "رمز التفعيل": (150.5 * 3.125, 630 * 3.125),
-    "اسم العميل": (300 * 3.125, 780 * 3.125),
-    "تاريخ الاصدار": (30 * 3.125, 35 * 3.125),
-    "وقت الاصدار": (30 * 3.125, 55 * 3.125),
-}
+    BULK_INPUT = 4
 
 
 # Keyboard layouts for user interaction
@@ -34,6 +24,24 @@ MESSAGES = {
     "select_price": "📦 اختر قيمة البطاقة:",
     "select_country": "🌍 اختر الدولة:",
     "enter_code": "🔐 أدخل رمز التفعيل:",
+    "duplicate_code": "⚠️ هذا الرمز صدر من قبل. أرسله مرة أخرى للتأكيد أو أدخل رمزاً آخر.",
     "enter_name": "👤 ما اسم العميل؟",
     "cancelled": "❌ تم إلغاء العملية.",
+    "bulk_instructions": (
+        "📄 أرسل ملف CSV أو قائمة نصية، كل سطر بالشكل:\nالسعر, الدولة, رمز التفعيل, اسم العميل"
+    ),
+    "bulk_invalid": "⚠️ تعذر قراءة بعض الأسطر:\n{errors}\nصحح الملف وأرسله مرة أخرى.",
+    "bulk_empty": "⚠️ لم يتم العثور على أي بطاقات. أرسل الملف مرة أخرى.",
+    "bulk_too_many": "⚠️ الحد الأقصى {limit} بطاقة في الدفعة الواحدة.",
+    "bulk_busy": "⏳ يتم تنفيذ دفعة أخرى حالياً، حاول لاحقاً.",
+    "bulk_progress": "⚙️ جاري إنشاء البطاقات: {done}/{total}",
+    "bulk_done": "✅ تم إنشاء {total} بطاقة.",
+    "bulk_quota": "⏳ تجاوزت الحد المسموح من البطاقات، أعد إرسال الملف بعد {seconds} ثانية تقريباً.",
+    "bulk_failed": "❌ حدث خطأ أثناء إنشاء الدفعة. حاول مرة أخرى.",
+    "busy": "⏳ البوت مشغول حالياً، أعد إرسال اسم العميل بعد {seconds} ثانية تقريباً.",
+    "delivery_failed": "⚠️ تعذر إرسال البطاقة، تم حفظها ويمكن إعادة إرسالها بالأمر /replay.",
+    "lookup_usage": "🔎 أرسل /lookup متبوعاً برمز التفعيل أو اسم العميل.",
+    "lookup_none": "🔎 لا توجد طلبات مطابقة.",
+    "lookup_disabled": "⚠️ سجل الطلبات غير مفعّل.",
+    "replay_done": "📤 تمت إعادة إرسال {replayed} بطاقة، المتبقي: {remaining}.",
 }
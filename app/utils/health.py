@@ -0,0 +1,137 @@
+"""Liveness, readiness and startup timings of the bot."""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Set
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds between event loop heartbeats
+HEARTBEAT_INTERVAL = 5.0
+
+
+class HealthMonitor:
+    """
+    Tracks whether the bot is alive and ready to take traffic.
+
+    Startup is split into named phases whose durations are kept for the
+    readiness report. The bot is ready once every expected component (e.g.
+    the warmed-up render pool and the initialized Telegram application) has
+    reported in, and stops being ready when it starts shutting down. It is
+    alive while the event loop keeps beating, so a stuck loop fails the
+    liveness check even though the HTTP thread still answers.
+    """
+
+    def __init__(self, loop_timeout: Optional[float] = None):
+        """
+        Initialize the monitor; the startup clock starts now.
+
+        Args:
+            loop_timeout: Seconds without a heartbeat before the bot counts as stuck
+                (defaults to settings.HEALTH_LOOP_TIMEOUT)
+        """
+        self.loop_timeout = loop_timeout or settings.HEALTH_LOOP_TIMEOUT
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._phases: Dict[str, float] = {}
+        self._expected: Set[str] = set()
+        self._up: Set[str] = set()
+        self._ready_after: Optional[float] = None
+        self._heartbeat: Optional[float] = None
+        self._stopping = False
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as a startup phase."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.perf_counter() - started)
+
+    def record_phase(self, name: str, seconds: float) -> None:
+        """
+        Record the duration of a startup phase.
+
+        Args:
+            name: Phase name
+            seconds: Duration in seconds
+        """
+        with self._lock:
+            self._phases[name] = seconds
+        logger.info(f"Startup phase {name} took {seconds:.3f}s")
+
+    def expect(self, *components: str) -> None:
+        """
+        Declare components that must be up before the bot is ready.
+
+        Args:
+            components: Component names
+        """
+        with self._lock:
+            self._expected.update(components)
+
+    def mark_up(self, component: str) -> None:
+        """
+        Report that a component is up.
+
+        Args:
+            component: Component name
+        """
+        with self._lock:
+            self._up.add(component)
+            if self._ready_after is not None or not self._expected <= self._up:
+                return
+            self._ready_after = time.monotonic() - self._started
+        logger.info(f"Ready to serve after {self._ready_after:.2f}s")
+
+    def mark_stopping(self) -> None:
+        """Stop reporting ready, so no new traffic is sent during shutdown."""
+        with self._lock:
+            self._stopping = True
+            self._heartbeat = None
+
+    def beat(self) -> None:
+        """Record that the event loop is running."""
+        if not self._stopping:
+            self._heartbeat = time.monotonic()
+
+    @property
+    def live(self) -> bool:
+        """Whether the event loop beat recently (or has not started yet)."""
+        heartbeat = self._heartbeat
+        return heartbeat is None or time.monotonic() - heartbeat <= self.loop_timeout
+
+    @property
+    def ready(self) -> bool:
+        """Whether every expected component is up and the bot is not shutting down."""
+        with self._lock:
+            return bool(self._expected) and self._expected <= self._up and not self._stopping
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Describe the bot's health.
+
+        Returns:
+            JSON-serializable status with the startup phase timings
+        """
+        ready, live = self.ready, self.live
+        with self._lock:
+            return {
+                "ready": ready,
+                "live": live,
+                "uptime_seconds": round(time.monotonic() - self._started, 3),
+                "ready_after_seconds": (
+                    round(self._ready_after, 3) if self._ready_after is not None else None
+                ),
+                "waiting_for": sorted(self._expected - self._up),
+                "phases": {name: round(seconds, 3) for name, seconds in self._phases.items()},
+            }
+
+
+# Shared monitor served on /healthz and /readyz
+health = HealthMonitor()
@@ -0,0 +1,336 @@
+"""Lightweight Prometheus-style metrics and stage timers."""
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from app.config import settings
+
+from .health import health
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets in seconds, from sub-millisecond text work to slow uploads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Histogram buckets in bytes, from thumbnails to print-size cards
+MEMORY_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 2, 4, 8, 16, 32, 64, 128))
+
+LabelValues = Tuple[str, ...]
+MetricT = TypeVar("MetricT", bound="_Metric")
+
+
+class _Metric:
+    """Base class for a metric family with optional labels."""
+
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """
+        Initialize the metric.
+
+        Args:
+            name: Metric name
+            documentation: Help text
+            labelnames: Names of the labels each sample carries
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        """Get label values in declaration order."""
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, values: LabelValues, extra: str = "") -> str:
+        """Format label values as ``{name="value",...}``."""
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        """Render the metric in Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        """Render the metric's samples."""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """Initialize the counter."""
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the counter."""
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        """Render one sample per label set."""
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be read from a callback."""
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        """Initialize the gauge."""
+        super().__init__(name, documentation)
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        """Set the gauge."""
+        self._value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the gauge from a callback each time it is rendered."""
+        self._function = function
+
+    def _samples(self) -> List[str]:
+        """Render the current value."""
+        value = self._function() if self._function else self._value
+        return [f"{self.name} {value}"]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        """Initialize the histogram."""
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record an observation."""
+        key = self._label_values(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def _samples(self) -> List[str]:
+        """Render one sample per label set."""
+        with self._lock:
+            items = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = self._format_labels(key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together on the metrics endpoint."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: MetricT) -> MetricT:
+        """Add a metric to the registry."""
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Render every metric in Prometheus text format."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.register(
+    Histogram("card_stage_seconds", "Time spent in each card generation stage.", ["stage"])
+)
+RENDER_SECONDS = registry.register(
+    Histogram("card_render_seconds", "Time to render and encode one card in a worker.")
+)
+CARDS_TOTAL = registry.register(Counter("cards_generated_total", "Cards delivered to users."))
+CARD_ERRORS_TOTAL = registry.register(
+    Counter("card_errors_total", "Cards that failed to render or send.")
+)
+RENDERS_REJECTED_TOTAL = registry.register(
+    Counter("renders_rejected_total", "Renders turned away because the queue was full.")
+)
+RENDERS_IN_FLIGHT = registry.register(Gauge("renders_in_flight", "Renders queued or running."))
+RENDER_QUEUE_DEPTH = registry.register(
+    Gauge("render_queue_depth", "Renders waiting for a free worker.")
+)
+RENDER_PEAK_BYTES = registry.register(
+    Histogram(
+        "card_render_peak_bytes",
+        "Most image memory held at once while rendering and encoding one card.",
+        buckets=MEMORY_BUCKETS,
+    )
+)
+RENDER_MEMORY_RESERVED = registry.register(
+    Gauge("render_memory_reserved_bytes", "Image memory reserved by renders in flight.")
+)
+RENDER_CACHE_HITS_TOTAL = registry.register(
+    Counter("render_cache_hits_total", "Cards served from the render cache.", ["source"])
+)
+RENDER_CACHE_MISSES_TOTAL = registry.register(
+    Counter("render_cache_misses_total", "Cards that had to be rendered.")
+)
+DELIVERY_RETRIES_TOTAL = registry.register(
+    Counter("delivery_retries_total", "Card deliveries retried, by reason.", ["reason"])
+)
+DEAD_LETTERS_TOTAL = registry.register(
+    Counter("dead_letters_total", "Card deliveries that failed and were kept for replay.")
+)
+UPLOADS_IN_FLIGHT = registry.register(Gauge("uploads_in_flight", "Photos being sent to Telegram."))
+
+# Per-thread stage timings collected for the render in progress
+_collector = threading.local()
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """
+    Record the duration of a card generation stage.
+
+    Args:
+        stage: Stage name (e.g. "encoding")
+        seconds: Duration in seconds
+    """
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    stages = getattr(_collector, "stages", None)
+    if stages is not None:
+        stages.append((stage, seconds))
+    if settings.METRICS_LOG_JSON:
+        logger.info(json.dumps({"event": "stage", "stage": stage, "seconds": round(seconds, 6)}))
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Time the enclosed block as a card generation stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def collect_stages() -> Iterator[List[Tuple[str, float]]]:
+    """
+    Collect the stage timings recorded by this thread inside the block.
+
+    Used by process-pool workers to send their timings back to the parent,
+    whose registry is the one served on the metrics endpoint.
+    """
+    stages: List[Tuple[str, float]] = []
+    _collector.stages = stages
+    try:
+        yield stages
+    finally:
+        _collector.stages = None
+
+
+class _MetricsServer(ThreadingHTTPServer):
+    """HTTP server that knows which endpoints it serves."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], endpoints: Sequence[str]):
+        super().__init__(address, _MetricsRequestHandler)
+        self.endpoints = frozenset(endpoints)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves the registry on /metrics and the health checks on /healthz and /readyz."""
+
+    server: _MetricsServer
+
+    def do_GET(self) -> None:  # noqa: N802 - http.server naming
+        """Return the metrics in Prometheus text format, or a health report as JSON."""
+        path = self.path.split("?")[0]
+        if path not in self.server.endpoints:
+            self.send_error(404)
+            return
+        if path == "/metrics":
+            self._reply(200, registry.render().encode(), "text/plain; version=0.0.4; charset=utf-8")
+            return
+        # Liveness only fails for a stuck event loop; readiness also waits for warm-up
+        ok = health.live if path == "/healthz" else health.ready and health.live
+        body = json.dumps(health.report()).encode()
+        self._reply(200 if ok else 503, body, "application/json")
+
+    def _reply(self, status: int, body: bytes, content_type: str) -> None:
+        """Send a complete response."""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        """Keep scrapes and probes out of the application log."""
+
+
+def start_metrics_server(
+    host: str, port: int, endpoints: Sequence[str] = ("/metrics",)
+) -> ThreadingHTTPServer:
+    """
+    Serve the metrics registry and health checks over HTTP in a background thread.
+
+    Args:
+        host: Address to listen on
+        port: Port to listen on
+        endpoints: Paths to serve, out of /metrics, /healthz and /readyz
+
+    Returns:
+        The running server
+    """
+    server = _MetricsServer((host, port), endpoints)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    listed = ", ".join(sorted(server.endpoints))
+    logger.info(f"Serving {listed} on http://{host}:{port}")
+    return server
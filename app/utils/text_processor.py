@@ -1,14 +1,40 @@
 """Text processing utilities for Arabic text."""
 
+from functools import lru_cache
+from typing import Dict, Optional
+
 import arabic_reshaper
 from bidi.algorithm import get_display
 
+from app.config import settings
+
 
 class ArabicTextProcessor:
-    """Handles Arabic text reshaping and bidirectional text processing."""
+    """
+    Handles Arabic text reshaping and bidirectional text processing.
+
+    Reshaped output is memoized in bounded LRU caches at two levels: whole
+    strings (one cache per method) and single words, which
+    ``reshape_text_with_spaces`` reuses for repeated names and the "يا" prefix.
+    """
+
+    # Reshaper configured once and shared by every processor
+    reshaper = arabic_reshaper.ArabicReshaper()
 
-    @staticmethod
-    def reshape_text(text: str) -> str:
+    def __init__(self, cache_size: Optional[int] = None):
+        """
+        Initialize the text processor.
+
+        Args:
+            cache_size: Entries per cache (defaults to settings.TEXT_CACHE_SIZE)
+        """
+        if cache_size is None:
+            cache_size = settings.TEXT_CACHE_SIZE
+        self._reshape_text = lru_cache(maxsize=cache_size)(self._reshape)
+        self._reshape_word = lru_cache(maxsize=cache_size)(self._reshape)
+        self._reshape_spaced = lru_cache(maxsize=cache_size)(self._reshape_words)
+
+    def reshape_text(self, text: str) -> str:
         """
         Reshape Arabic text for proper display.
 
@@ -18,11 +44,9 @@ class ArabicTextProcessor:
         Returns:
             Reshaped text ready for display
         """
-        reshaped = arabic_reshaper.reshape(text)
-        return get_display(reshaped)
+        return self._reshape_text(text)
 
-    @staticmethod
-    def reshape_text_with_spaces(text: str) -> str:
+    def reshape_text_with_spaces(self, text: str) -> str:
         """
         Reshape Arabic text while preserving word boundaries.
         Better for text containing mixed content or special characters.
@@ -33,12 +57,43 @@ class ArabicTextProcessor:
         Returns:
             Reshaped text with proper word spacing
         """
-        words = text.split()
-        reshaped_words = []
+        return self._reshape_spaced(text)
+
+    def cache_info(self) -> Dict[str, Dict[str, int]]:
+        """
+        Get hit/miss counters for the reshaping caches.
+
+        Returns:
+            Counters for the "text", "spaced" and "word" caches
+        """
+        caches = {
+            "text": self._reshape_text,
+            "spaced": self._reshape_spaced,
+            "word": self._reshape_word,
+        }
+        info = {}
+        for name, cache in caches.items():
+            stats = cache.cache_info()
+            info[name] = {
+                "hits": stats.hits,
+                "misses": stats.misses,
+                "size": stats.currsize,
+                "max_size": stats.maxsize,
+            }
+        return info
+
+    def clear_cache(self) -> None:
+        """Empty the reshaping caches and reset their counters."""
+        self._reshape_text.cache_clear()
+        self._reshape_spaced.cache_clear()
+        self._reshape_word.cache_clear()
 
-        for word in words:
-            reshaped = arabic_reshaper.reshape(word)
-            displayed = get_display(reshaped)
-            reshaped_words.append(displayed)
+    @classmethod
+    def _reshape(cls, text: str) -> str:
+        """Reshape and reorder text without caching."""
+        return get_display(cls.reshaper.reshape(text))
 
+    def _reshape_words(self, text: str) -> str:
+        """Reshape each word separately, using the word cache, and reverse their order."""
+        reshaped_words = [self._reshape_word(word) for word in text.split()]
         return " ".join(reshaped_words[::-1])
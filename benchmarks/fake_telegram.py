@@ -0,0 +1,242 @@
+"""
+Local stand-in for the Telegram Bot API that drives the bot in webhook mode.
+
+It answers the Bot API calls the bot makes and plays full card conversations
+against the bot's webhook, reporting how long each card takes to arrive:
+
+    # terminal 1: the fake API waits for the bot to register its webhook
+    python -m benchmarks.fake_telegram --user-id 42 --secret secret --chats 20
+
+    # terminal 2
+    BOT_MODE=webhook WEBHOOK_URL=http://127.0.0.1:8443 WEBHOOK_LISTEN=127.0.0.1 \\
+    WEBHOOK_SECRET_TOKEN=secret TELEGRAM_API_BASE_URL=http://127.0.0.1:8081/bot \\
+    BOT_TOKEN=123:fake AUTHORIZED_USER_ID=42 CONCURRENT_UPDATES=8 python main.py
+"""
+
+import argparse
+import itertools
+import json
+import queue
+import re
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+# Bot API methods that deliver something to a chat
+SEND_METHODS = {"sendMessage", "sendPhoto", "sendDocument", "sendMediaGroup"}
+
+
+class FakeTelegram:
+    """Records what the bot sends and hands replies to the waiting conversations."""
+
+    def __init__(self):
+        """Initialize the fake API state."""
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._replies: Dict[int, "queue.Queue[str]"] = {}
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.webhook_set = threading.Event()
+
+    def replies_for(self, chat_id: int) -> "queue.Queue[str]":
+        """Get the queue of Bot API methods the bot called for a chat."""
+        with self._lock:
+            return self._replies.setdefault(chat_id, queue.Queue())
+
+    def handle(self, method: str, params: Dict[str, str]) -> object:
+        """
+        Answer a Bot API call.
+
+        Args:
+            method: Bot API method name
+            params: Request parameters
+
+        Returns:
+            The ``result`` field of the response
+        """
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "setWebhook":
+            self.webhook_set.set()
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        if method in SEND_METHODS or method == "editMessageText":
+            chat_id = int(params.get("chat_id", 0))
+            if method in SEND_METHODS:
+                self.replies_for(chat_id).put(method)
+            message = self.message(chat_id, params.get("text", ""))
+            return [message] if method == "sendMediaGroup" else message
+        return True
+
+    def message(self, chat_id: int, text: str, user_id: Optional[int] = None) -> Dict:
+        """Build a Message object."""
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        }
+        if user_id is not None:
+            message["from"] = {"id": user_id, "is_bot": False, "first_name": "Operator"}
+            if text.startswith("/"):
+                command = text.split()[0]
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return message
+
+    def update(self, chat_id: int, user_id: int, text: str) -> Dict:
+        """Build an Update carrying a text message."""
+        return {
+            "update_id": next(self._update_ids),
+            "message": self.message(chat_id, text, user_id),
+        }
+
+
+def parse_params(content_type: str, body: bytes) -> Dict[str, str]:
+    """Extract request parameters from a form, multipart or JSON body."""
+    if content_type.startswith("application/json"):
+        return {key: str(value) for key, value in json.loads(body or b"{}").items()}
+    if content_type.startswith("multipart/form-data"):
+        # Only the small text fields are needed, so skip the file parts
+        fields = re.findall(rb'name="([^"]+)"\r\n\r\n([^\r]*)\r\n', body)
+        return {name.decode(): value.decode("utf-8", "replace") for name, value in fields}
+    return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+
+def make_handler(api: FakeTelegram):
+    """Create the HTTP handler class bound to a fake API."""
+
+    class Handler(BaseHTTPRequestHandler):
+        """Serves /bot<token>/<method> requests."""
+
+        def do_POST(self) -> None:  # noqa: N802 - http.server naming
+            """Answer a Bot API call."""
+            method = self.path.rstrip("/").rsplit("/", 1)[-1]
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            params = parse_params(self.headers.get("Content-Type", ""), body)
+            payload = json.dumps({"ok": True, "result": api.handle(method, params)}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format: str, *args) -> None:
+            """Keep request logs quiet."""
+
+    return Handler
+
+
+def post_update(webhook: str, secret: str, update: Dict) -> None:
+    """Deliver an update to the bot's webhook the way Telegram does."""
+    request = urllib.request.Request(
+        webhook,
+        data=json.dumps(update).encode(),
+        headers={
+            "Content-Type": "application/json",
+            "X-Telegram-Bot-Api-Secret-Token": secret,
+        },
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        response.read()
+
+
+def conversation(chat_id: int) -> List[str]:
+    """
+    Messages that make up one card conversation.
+
+    Each chat enters its own activation code, so the duplicate code check lets every card through.
+    """
+    return ["/start", "10$", "USA", f"ABCD-EFGH-{chat_id % 10000:04d}", "محمد"]
+
+
+def run_conversation(
+    api: FakeTelegram, webhook: str, secret: str, chat_id: int, user_id: int, timeout: float
+) -> Tuple[bool, float]:
+    """
+    Play one card conversation and wait for the card.
+
+    Returns:
+        Whether a photo arrived, and seconds from the last message to the photo
+    """
+    replies = api.replies_for(chat_id)
+    sent_at = time.perf_counter()
+    for text in conversation(chat_id):
+        sent_at = time.perf_counter()
+        post_update(webhook, secret, api.update(chat_id, user_id, text))
+        try:
+            method = replies.get(timeout=timeout)
+        except queue.Empty:
+            return False, 0.0
+    return method == "sendPhoto", time.perf_counter() - sent_at
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Start the fake API, drive concurrent conversations and report latency."""
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API and webhook driver.")
+    parser.add_argument("--api-port", type=int, default=8081, help="port of the fake Bot API")
+    parser.add_argument("--webhook", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", required=True, help="WEBHOOK_SECRET_TOKEN of the bot")
+    parser.add_argument("--user-id", type=int, required=True, help="authorized user ID")
+    parser.add_argument("--chats", type=int, default=10, help="concurrent conversations")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait per reply")
+    parser.add_argument(
+        "--startup-timeout", type=float, default=120.0, help="seconds to wait for setWebhook"
+    )
+    parser.add_argument("--serve-only", action="store_true", help="only run the fake API")
+    args = parser.parse_args(argv)
+
+    api = FakeTelegram()
+    server = ThreadingHTTPServer(("127.0.0.1", args.api_port), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Fake Bot API on http://127.0.0.1:{args.api_port}/bot")
+
+    if args.serve_only:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            return 0
+
+    print("Waiting for the bot to register its webhook...")
+    if not api.webhook_set.wait(args.startup_timeout):
+        print("The bot never called setWebhook")
+        server.shutdown()
+        return 1
+    # setWebhook is called just before the webhook server starts accepting updates
+    time.sleep(1)
+
+    results: List[Tuple[bool, float]] = []
+    lock = threading.Lock()
+
+    def worker(chat_id: int) -> None:
+        result = run_conversation(
+            api, args.webhook, args.secret, chat_id, args.user_id, args.timeout
+        )
+        with lock:
+            results.append(result)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(1000 + index,)) for index in range(args.chats)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    print(f"Cards received: {len(latencies)}/{args.chats} in {elapsed:.2f}s")
+    if latencies:
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"Name-to-photo latency: p50 {statistics.median(latencies):.3f}s, p95 {p95:.3f}s")
+    print(f"Bot API calls: {api.calls}")
+    return 0 if len(latencies) == args.chats else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
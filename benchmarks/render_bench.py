@@ -0,0 +1,287 @@
+"""
+Rendering benchmark suite.
+
+Times the hot paths of card generation with realistic and worst-case inputs,
+writes the results to JSON and optionally compares them with a stored baseline:
+
+    python -m benchmarks.render_bench --output bench.json
+    python -m benchmarks.render_bench --compare bench_baseline.json --threshold 0.2
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+from PIL import ImageChops
+
+from app import __version__
+from app.config import settings
+from app.models import CardData, CardPrice, Country
+from app.services import CardGeneratorService
+from app.services.buffer_pool import track_memory
+from app.services.font_fitter import FontFitter
+from app.utils import ArabicTextProcessor
+
+# Customer names, from short and common to long and mixed-script
+NAMES = [
+    "محمد",
+    "عبد الرحمن بن خالد",
+    "عبد الله بن عبد العزيز بن محمد بن سعود آل سعود",
+    "Sara Al-Qahtani",
+    "نورة 123 Store",
+]
+
+# Activation codes, including malformed ones the formatter passes through
+CODES = [
+    "ABCD-EFGH-IJKL",
+    "WWWW-WWWW-WWWW",
+    "1111-1111-1111",
+    "AB12",
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789",
+    "----",
+]
+
+# Metrics compared against the baseline (lower is better)
+COMPARED_METRICS = ("p50_ms", "p95_ms")
+
+# Largest per-channel difference allowed between glyph atlas and Pillow text
+# (overlapping glyph edges can round one level apart)
+ATLAS_TOLERANCE = 1
+
+
+def card_inputs() -> List[Dict[str, str]]:
+    """Build card data for every price/country combination, cycling names and codes."""
+    cards = []
+    combos = itertools.product(CardPrice, Country)
+    for index, (price, country) in enumerate(combos):
+        card = CardData(
+            price=price.value,
+            country=country.value,
+            activation_code=CardData.format_activation_code(CODES[index % len(CODES)]),
+            customer_name=NAMES[index % len(NAMES)],
+            issue_date="2026-01-01",
+            issue_time="12:00 PM",
+        )
+        cards.append(card.to_dict())
+    return cards
+
+
+def measure(func: Callable[[], object], iterations: int, warmup: int = 1) -> Dict[str, float]:
+    """
+    Time repeated calls of a function.
+
+    Args:
+        func: Function to time
+        iterations: Number of timed calls
+        warmup: Untimed calls made first
+
+    Returns:
+        Latency statistics in milliseconds and calls per second
+    """
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+
+    samples.sort()
+    return {
+        "iterations": iterations,
+        "p50_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        "mean_ms": round(statistics.mean(samples), 4),
+        "per_sec": round(1000 / statistics.mean(samples), 2),
+    }
+
+
+def cycle(items: Sequence, func: Callable) -> Callable[[], object]:
+    """Make a no-argument function that calls ``func`` on the next item each time."""
+    iterator = itertools.cycle(items)
+    return lambda: func(next(iterator))
+
+
+def atlas_difference(generator: CardGeneratorService, cards: Sequence[Dict[str, str]]) -> int:
+    """
+    Compare cards drawn from the glyph atlas with cards drawn by Pillow directly.
+
+    Args:
+        generator: Generator drawing text from the glyph atlas
+        cards: Card data dictionaries
+
+    Returns:
+        Largest per-channel pixel difference over all cards
+    """
+    plain = CardGeneratorService(generator.resources, generator.layouts)
+    plain.glyphs = None
+    worst = 0
+    for card in cards:
+        difference = ImageChops.difference(generator.render_card(card), plain.render_card(card))
+        worst = max(worst, max(high for _, high in difference.getextrema()))
+    return worst
+
+
+def render_peak_mb(generator: CardGeneratorService, cards: Sequence[Dict[str, str]]) -> float:
+    """Most image memory one card took to render and encode, in MB."""
+    peak = 0
+    for card in cards:
+        with track_memory() as memory:
+            generator.generate_card_bytes(card)
+        peak = max(peak, memory.peak)
+    return round(peak / (1024 * 1024), 2)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run(iterations: int) -> Dict[str, object]:
+    """Run every benchmark and collect the results."""
+    generator = CardGeneratorService()
+    generator.warm_up()
+    processor = ArabicTextProcessor()
+    cards = card_inputs()
+    layout = generator.layouts.get(settings.DEFAULT_LAYOUT)
+    code_field = layout.fields["رمز التفعيل"]
+    code_fitter = generator.get_fitter(layout, "رمز التفعيل")
+    codes = [CardData.format_activation_code(code) for code in CODES]
+    names = [f"يا {name}" for name in NAMES]
+    rendered = generator.render_card(cards[0])
+    pillow_text = CardGeneratorService(generator.resources, generator.layouts)
+    pillow_text.glyphs = None
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_path = Path(temp_dir) / "card.png"
+
+        def fit_cold(code: str) -> int:
+            fitter = FontFitter(
+                code_field.min_font_size,
+                code_field.font_size,
+                generator.resources,
+                layout.font_path,
+            )
+            return fitter.fit(code, code_field.width, code_field.height)
+
+        benchmarks = {
+            "generate_card": cycle(cards, lambda card: generator.generate_card(card, output_path)),
+            "render_card": cycle(cards, generator.render_card),
+            "render_card_pillow_text": cycle(cards, pillow_text.render_card),
+            "encode_png": lambda: generator.encode(rendered, "PNG"),
+            "fit_code_cold": cycle(codes, fit_cold),
+            "fit_code_hinted": cycle(
+                codes, lambda code: code_fitter.fit(code, code_field.width, code_field.height)
+            ),
+            "reshape_text": cycle(names, processor.reshape_text),
+            "reshape_text_with_spaces": cycle(names, processor.reshape_text_with_spaces),
+        }
+
+        # Cheap text operations get more iterations for stable percentiles
+        cheap = {"fit_code_hinted", "reshape_text", "reshape_text_with_spaces"}
+        results = {
+            name: measure(func, iterations * 20 if name in cheap else iterations)
+            for name, func in benchmarks.items()
+        }
+
+    return {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cards_per_sec": results["generate_card"]["per_sec"],
+        "peak_rss_mb": peak_rss_mb(),
+        "render_peak_mb": render_peak_mb(generator, cards),
+        "glyph_atlas_max_diff": atlas_difference(generator, cards) if generator.glyphs else 0,
+        "benchmarks": results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Find benchmarks that got slower than the baseline by more than the threshold.
+
+    Args:
+        current: Results of this run
+        baseline: Stored baseline results
+        threshold: Allowed relative slowdown (0.2 means 20%)
+
+    Returns:
+        Descriptions of each regression
+    """
+    regressions = []
+    for name, result in current["benchmarks"].items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if not base:
+            continue
+        for metric in COMPARED_METRICS:
+            if base[metric] > 0 and result[metric] > base[metric] * (1 + threshold):
+                change = (result[metric] / base[metric] - 1) * 100
+                regressions.append(
+                    f"{name} {metric}: {base[metric]:.3f} -> {result[metric]:.3f} (+{change:.0f}%)"
+                )
+
+    base_rss = baseline.get("peak_rss_mb")
+    if base_rss and current["peak_rss_mb"] > base_rss * (1 + threshold):
+        regressions.append(f"peak_rss_mb: {base_rss} -> {current['peak_rss_mb']}")
+    return regressions
+
+
+def print_report(results: Dict) -> None:
+    """Print a human-readable summary."""
+    print(f"{'benchmark':<28}{'p50 ms':>10}{'p95 ms':>10}{'per sec':>10}")
+    for name, result in results["benchmarks"].items():
+        print(
+            f"{name:<28}{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}{result['per_sec']:>10.1f}"
+        )
+    print(f"cards/sec: {results['cards_per_sec']}  peak RSS: {results['peak_rss_mb']} MB")
+    print(f"image memory per render: {results['render_peak_mb']} MB")
+    print(f"glyph atlas max pixel difference: {results['glyph_atlas_max_diff']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the suite, save the results and check for regressions."""
+    parser = argparse.ArgumentParser(description="Card rendering benchmarks.")
+    parser.add_argument("--iterations", type=int, default=30, help="timed runs per benchmark")
+    parser.add_argument("--output", type=Path, help="write results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="baseline JSON file to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed slowdown vs baseline (default 0.2)"
+    )
+    args = parser.parse_args(argv)
+
+    results = run(args.iterations)
+    print_report(results)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+    if results["glyph_atlas_max_diff"] > ATLAS_TOLERANCE:
+        print(f"Glyph atlas text differs from Pillow by more than {ATLAS_TOLERANCE}")
+        return 1
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No regressions against baseline.")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,14 +4,19 @@ FGGSTORE Card Generator Bot
 Main entry point for the Telegram bot application.
 """
 
+import asyncio
 import logging
 import sys
-
-from telegram.ext import ApplicationBuilder
+import time
+from typing import TYPE_CHECKING
 
 from app import __version__
 from app.config import settings
-from app.handlers import CardConversationHandler
+from app.utils.health import HEARTBEAT_INTERVAL, health
+from app.utils.metrics import start_metrics_server
+
+if TYPE_CHECKING:
+    from telegram.ext import Application
 
 
 def setup_logging() -> None:
@@ -23,6 +28,39 @@ def setup_logging() -> None:
     )
 
 
+def start_http_servers() -> None:
+    """Serve the health checks and, if enabled, the metrics."""
+    health_endpoints = ("/healthz", "/readyz")
+    if settings.HEALTH_PORT and settings.HEALTH_PORT == settings.METRICS_PORT:
+        # One port for both: serve everything on the health address
+        endpoints = ("/metrics", *health_endpoints)
+        start_metrics_server(settings.HEALTH_HOST, settings.HEALTH_PORT, endpoints)
+        return
+    if settings.HEALTH_PORT:
+        start_metrics_server(settings.HEALTH_HOST, settings.HEALTH_PORT, health_endpoints)
+    if settings.METRICS_PORT:
+        start_metrics_server(settings.METRICS_HOST, settings.METRICS_PORT)
+
+
+def run_webhook(application: "Application") -> None:
+    """Serve updates over HTTPS webhooks instead of long polling."""
+    logger = logging.getLogger(__name__)
+    webhook_url = f"{settings.WEBHOOK_URL}/{settings.WEBHOOK_PATH}"
+    logger.info(
+        f"Bot is listening for webhooks on {settings.WEBHOOK_LISTEN}:{settings.WEBHOOK_PORT}"
+        f"/{settings.WEBHOOK_PATH}"
+    )
+    application.run_webhook(
+        listen=settings.WEBHOOK_LISTEN,
+        port=settings.WEBHOOK_PORT,
+        url_path=settings.WEBHOOK_PATH,
+        secret_token=settings.WEBHOOK_SECRET_TOKEN,
+        # Every replica registers the same public URL, so this is safe to repeat
+        webhook_url=webhook_url,
+        allowed_updates=["message"],
+    )
+
+
 def main() -> None:
     """Main function to run the bot."""
     # Setup logging
@@ -35,18 +73,111 @@ def main() -> None:
         settings.setup_directories()
 
         logger.info(f"Starting FGGSTORE Card Generator Bot v{__version__}")
-        logger.info(f"Authorized User ID: {settings.AUTHORIZED_USER_ID}")
+        # Answer probes right away; the bot is ready once both of these are up
+        health.expect("render_pool", "telegram")
+        start_http_servers()
+
+        # Telegram, Pillow and the Arabic text libraries are only loaded once the
+        # configuration is known to be good
+        with health.phase("imports"):
+            from telegram.ext import ApplicationBuilder, CommandHandler
+
+            from app.handlers import (
+                BulkConversationHandler,
+                CardConversationHandler,
+                PerChatUpdateProcessor,
+            )
+            from app.services import (
+                SharedStateApplication,
+                access_control,
+                create_code_index,
+                create_order_ledger,
+                create_persistence,
+                create_render_pool,
+            )
+
+        # Warm the render workers with the template and fonts (or wait for the render
+        # service) while the rest starts up
+        render_pool = create_render_pool()
+        warm_up_started = time.perf_counter()
+        render_pool.start(wait=False)
+
+        def render_pool_warm() -> None:
+            """Record the warm-up and count the render pool as up."""
+            health.record_phase("render_pool", time.perf_counter() - warm_up_started)
+            health.mark_up("render_pool")
+
+        render_pool.when_warm(render_pool_warm)
+
+        # Load the allowlist now so a bad users file stops the bot at startup
+        with health.phase("access_control"):
+            access_control.load()
+        logger.info(f"Authorized users: {len(access_control.users)}")
+
+        # Record every issued card in the order ledger
+        with health.phase("order_ledger"):
+            order_ledger = create_order_ledger()
+            code_index = create_code_index(order_ledger)
+
+        async def on_started(application: "Application") -> None:
+            """Count Telegram as up and keep the liveness heartbeat going."""
+            health.record_phase("telegram", time.perf_counter() - connect_started)
+            loop = asyncio.get_running_loop()
+
+            def beat() -> None:
+                """Beat now and again after the interval."""
+                health.beat()
+                loop.call_later(HEARTBEAT_INTERVAL, beat)
+
+            beat()
+            health.mark_up("telegram")
+
+        async def on_stopping(application: "Application") -> None:
+            """Stop taking traffic."""
+            health.mark_stopping()
 
         # Build the application
-        application = ApplicationBuilder().token(settings.BOT_TOKEN).build()
+        with health.phase("application"):
+            builder = (
+                ApplicationBuilder()
+                .token(settings.BOT_TOKEN)
+                .base_url(settings.TELEGRAM_API_BASE_URL)
+                .post_init(on_started)
+                .post_stop(on_stopping)
+            )
+            # Keep conversations in the shared state store so they survive restarts
+            persistence = create_persistence()
+            if persistence is not None:
+                # Read and write the state on every update, so replicas share conversations
+                builder = builder.persistence(persistence).application_class(SharedStateApplication)
+            if settings.CONCURRENT_UPDATES > 1:
+                builder = builder.concurrent_updates(
+                    PerChatUpdateProcessor(settings.CONCURRENT_UPDATES)
+                )
+            application = builder.build()
 
-        # Create and add conversation handler
-        conversation_handler = CardConversationHandler()
-        application.add_handler(conversation_handler.get_handler())
+            # Create and add conversation handler
+            conversation_handler = CardConversationHandler(order_ledger, code_index, render_pool)
+            application.add_handler(conversation_handler.get_handler())
+            bulk_handler = BulkConversationHandler(
+                order_ledger, code_index, render_pool, conversation_handler.delivery_queue
+            )
+            application.add_handler(bulk_handler.get_handler())
+            application.add_handler(CommandHandler("replay", conversation_handler.replay))
+            application.add_handler(CommandHandler("lookup", conversation_handler.lookup))
 
         # Start the bot
-        logger.info("Bot is running and polling for updates...")
-        application.run_polling(allowed_updates=["message"])
+        connect_started = time.perf_counter()
+        if settings.BOT_MODE == "webhook":
+            run_webhook(application)
+        else:
+            logger.info("Bot is running and polling for updates...")
+            application.run_polling(allowed_updates=["message"])
+        health.mark_stopping()
+        render_pool.shutdown()
+        conversation_handler.delivery_queue.close()
+        if order_ledger is not None:
+            order_ledger.close()
 
     except ValueError as e:
         logger.error(f"Configuration error: {e}")
@@ -0,0 +1,118 @@
+"""Bulk batches render on the shared render pool and go out through the delivery queue."""
+
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, List
+
+from telegram.error import BadRequest
+
+from app.handlers import bulk_handler
+from app.handlers.bulk_handler import BulkConversationHandler
+from app.models import CardData
+from app.services import DeliveryQueue, RenderQueueFullError
+
+NOW = datetime(2026, 1, 1, 12, 0)
+
+
+def make_cards(count: int) -> List[CardData]:
+    """Cards with distinct activation codes."""
+    return [
+        CardData("10$", "USA", f"CODE{index:04d}ABCD", "محمد", "2026-01-01", "12:00 PM")
+        for index in range(count)
+    ]
+
+
+class FakePool:
+    """Render pool that counts renders in flight and rejects the first one."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.in_flight = 0
+        self.peak = 0
+        self.rejected = False
+
+    async def render(self, card_data: Dict[str, str]) -> bytes:
+        if not self.rejected:
+            self.rejected = True
+            raise RenderQueueFullError(0)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0)
+        self.in_flight -= 1
+        return card_data["رمز التفعيل"].encode()
+
+
+class FakeMessage:
+    """Message that records replies and edits."""
+
+    def __init__(self, sent: List[str], edits_fail: bool = False):
+        self.sent = sent
+        self.edits_fail = edits_fail
+
+    async def reply_text(self, text: str) -> "FakeMessage":
+        self.sent.append(text)
+        return self
+
+    async def edit_text(self, text: str) -> None:
+        if self.edits_fail:
+            raise BadRequest("Message to edit not found")
+        self.sent.append(text)
+
+
+class FakeBot:
+    """Bot that records albums and documents."""
+
+    def __init__(self):
+        self.albums: List[int] = []
+        self.documents: List[str] = []
+
+    async def send_media_group(self, chat_id: int, media: list) -> tuple:
+        self.albums.append(len(media))
+        return ()
+
+    async def send_document(self, chat_id: int, document: bytes, filename: str, caption=None):
+        self.documents.append(filename)
+
+
+def run_batch(count: int, edits_fail: bool = False) -> SimpleNamespace:
+    """Run a batch of ``count`` cards and return what happened."""
+    pool = FakePool(workers=3)
+    bot = FakeBot()
+    sent: List[str] = []
+    queue = DeliveryQueue(concurrency=2, global_rate=1000, chat_rate=1000, chat_burst=1000)
+    handler = BulkConversationHandler(render_pool=pool, delivery_queue=queue)
+    update = SimpleNamespace(
+        effective_chat=SimpleNamespace(id=1),
+        effective_user=SimpleNamespace(id=1),
+        message=FakeMessage(sent, edits_fail),
+    )
+    context = SimpleNamespace(bot=bot)
+    asyncio.run(handler._run_batch(update, context, make_cards(count), NOW))
+    return SimpleNamespace(pool=pool, bot=bot, sent=sent, running=handler._running)
+
+
+def test_small_batch_is_sent_as_album() -> None:
+    """Up to ten cards go out as one album through the delivery queue."""
+    result = run_batch(5)
+    assert result.bot.albums == [5]
+    assert result.bot.documents == []
+    assert result.pool.peak <= result.pool.workers
+    assert result.running == set()
+
+
+def test_large_batch_is_sent_as_zip() -> None:
+    """Larger batches go out as one ZIP file, rendered a pool's worth of cards at a time."""
+    result = run_batch(12)
+    assert result.bot.albums == []
+    assert result.bot.documents == ["cards_20260101_1200.zip"]
+    assert result.pool.peak <= result.pool.workers
+    assert result.running == set()
+
+
+def test_failed_status_edits_do_not_stop_batch(monkeypatch) -> None:
+    """A status message that can no longer be edited leaves the batch to finish."""
+    monkeypatch.setattr(bulk_handler, "PROGRESS_INTERVAL_SECONDS", 0)
+    result = run_batch(12, edits_fail=True)
+    assert result.bot.documents == ["cards_20260101_1200.zip"]
+    assert result.running == set()
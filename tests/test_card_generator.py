@@ -0,0 +1,44 @@
+"""A warmed-up card generator keeps what it built, and renders without rereading its files."""
+
+from typing import List
+
+from app.services import CardGeneratorService, LayoutEngine, ResourceCache
+
+CARD = {
+    "الفئة": "10$ (السعودية)",
+    "رمز التفعيل": "ABCD-EFGH-IJKL",
+    "اسم العميل": "يا محمد",
+    "تاريخ الاصدار": "2026-01-01",
+    "وقت الاصدار": "12:00 PM",
+}
+
+
+def test_warm_up_survives_first_render() -> None:
+    """The variants and font fitters built by the warm-up are still used after the first card."""
+    generator = CardGeneratorService(layouts=LayoutEngine())
+    generator.warm_up()
+    variants = dict(generator._variants)
+    assert variants
+
+    generator.generate_card_bytes(CARD)
+
+    assert all(generator._variants[key] is cache for key, cache in variants.items())
+
+
+def test_files_are_checked_once_per_interval(monkeypatch) -> None:
+    """Rendering cards does not stat the layout and resource files again within the interval."""
+    checks: List[str] = []
+    monkeypatch.setattr(LayoutEngine, "refresh_if_changed", lambda self: checks.append("layouts"))
+    monkeypatch.setattr(
+        ResourceCache, "refresh_if_changed", lambda self: checks.append("resources")
+    )
+    generator = CardGeneratorService(
+        resources=ResourceCache(reload_interval=60), layouts=LayoutEngine(reload_interval=60)
+    )
+    generator.render_card(CARD)
+    generator.render_card(CARD)
+    assert checks == []
+
+    generator.layouts.reload_interval = generator.resources.reload_interval = 0
+    generator.render_card(CARD)
+    assert sorted(checks) == ["layouts", "resources"]
@@ -0,0 +1,104 @@
+"""Card conversations release only their own code claims and resend orders unchanged."""
+
+import asyncio
+from types import SimpleNamespace
+from typing import Dict, List
+
+import pytest
+
+from app.config import settings
+from app.handlers import CardConversationHandler, card_handler
+from app.models import CardData
+from app.services import (
+    CodeIndex,
+    OrderRecord,
+    RenderQueueFullError,
+    SQLiteLedgerStore,
+    UserQuotas,
+)
+from app.services.order_ledger import DELIVERED, FAILED
+from app.utils import ConversationStates
+
+CODE = "ABCD-EFGH-IJKL"
+
+
+class FakeMessage:
+    """Message that records replies."""
+
+    def __init__(self, text: str, sent: List[str]):
+        self.text = text
+        self.sent = sent
+
+    async def reply_text(self, text: str, **kwargs) -> None:
+        self.sent.append(text)
+
+
+@pytest.fixture
+def handler(monkeypatch, tmp_path):
+    """Card handler with an empty code index and ledger, and its files in a temporary directory."""
+    monkeypatch.setattr(settings, "DEAD_LETTER_DB_PATH", tmp_path / "dead_letters.db")
+    monkeypatch.setattr(settings, "RENDER_CACHE", False)
+    store = SQLiteLedgerStore(tmp_path / "orders.db")
+    index = CodeIndex(store, capacity=1000, error_rate=0.001)
+    card_handler = CardConversationHandler(code_index=index, render_pool=SimpleNamespace())
+    yield card_handler
+    card_handler.delivery_queue.close()
+    store.close()
+
+
+def send(handler: CardConversationHandler, method: str, text: str, user_data: Dict) -> int:
+    """Hand one message of a conversation to a handler method."""
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=1),
+        effective_chat=SimpleNamespace(id=1),
+        message=FakeMessage(text, []),
+    )
+    context = SimpleNamespace(user_data=user_data)
+    return asyncio.run(getattr(handler, method)(update, context))
+
+
+def test_cancelled_duplicate_keeps_first_claim(handler) -> None:
+    """Cancelling an order with a confirmed duplicate leaves the first order's claim."""
+    first: Dict = {}
+    second: Dict = {}
+    assert send(handler, "handle_code", CODE, first) == ConversationStates.NAME
+    assert send(handler, "handle_code", CODE, second) == ConversationStates.CODE
+    assert send(handler, "handle_code", CODE, second) == ConversationStates.NAME
+
+    send(handler, "cancel", "/cancel", second)
+    assert handler.code_index.contains(CODE)
+
+    send(handler, "cancel", "/cancel", first)
+    assert not handler.code_index.contains(CODE)
+
+
+def test_resent_order_keeps_original_stamp(handler) -> None:
+    """A resent order gets the issue date and time of its newest card that did not fail."""
+    orders = [
+        OrderRecord.create(
+            1, CardData("10$", "USA", CODE, "محمد", "2026-01-02", "09:30 AM"), FAILED
+        ),
+        OrderRecord.create(
+            1, CardData("10$", "USA", CODE, "محمد", "2026-01-01", "12:00 PM"), DELIVERED
+        ),
+    ]
+    handler.order_ledger = SimpleNamespace(find=lambda **criteria: orders)
+
+    assert handler._original_stamp("10$", "USA", CODE, "محمد") == ("2026-01-01", "12:00 PM")
+    assert handler._original_stamp("50$", "USA", CODE, "محمد") is None
+
+
+def test_card_turned_away_by_render_queue_keeps_quota(handler, monkeypatch) -> None:
+    """A card the full render queue turns away gives back the rate quota it took."""
+    quotas = UserQuotas(max_concurrent=1, per_minute=1)
+    monkeypatch.setattr(card_handler, "user_quotas", quotas)
+    monkeypatch.setattr(card_handler.access_control, "is_authorized", lambda *args, **kwargs: True)
+
+    async def render(card_data: Dict[str, str]) -> bytes:
+        raise RenderQueueFullError(0)
+
+    handler.render_pool = SimpleNamespace(render=render)
+    user_data = {"price": "10$", "country": "USA", "activation_code": CODE, "code_claimed": True}
+    for _ in range(2):
+        assert send(handler, "handle_name", "محمد", user_data) == ConversationStates.NAME
+    assert quotas._buckets[1].try_acquire(1)
@@ -0,0 +1,82 @@
+"""The code index claims codes atomically, stays bounded and loads from either ledger."""
+
+import threading
+from typing import List
+
+from app.models import CardData
+from app.services import CodeIndex, JsonlLedgerStore, SQLiteLedgerStore
+from app.services.order_ledger import DELIVERED, FAILED, OrderRecord
+
+
+def make_record(code: str, status: str = DELIVERED) -> OrderRecord:
+    """Record of a card with the given activation code."""
+    card = CardData("10$", "USA", code, "محمد", "2026-01-01", "12:00 PM")
+    return OrderRecord.create(1, card, status)
+
+
+def test_only_one_concurrent_claim_wins() -> None:
+    """Of many threads claiming the same new code, exactly one sees it as new."""
+    index = CodeIndex(capacity=1000, error_rate=0.001)
+    results: List[bool] = []
+    barrier = threading.Barrier(8)
+
+    def claim() -> None:
+        barrier.wait()
+        results.append(index.check_and_add("ABCD-EFGH-IJKL"))
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False] + [True] * 7
+
+
+def test_recent_codes_are_bounded_and_confirmed_by_ledger(tmp_path) -> None:
+    """Codes dropped from the recent set are still found in the SQLite ledger."""
+    store = SQLiteLedgerStore(tmp_path / "orders.db")
+    index = CodeIndex(store, capacity=1000, error_rate=0.001, max_recent=2)
+    for code in ["CODE1", "CODE2", "CODE3"]:
+        index.add(code)
+    store.write_many([make_record("CODE1")])
+
+    assert list(index._recent) == ["CODE2", "CODE3"]
+    assert index.contains("CODE1")
+    store.close()
+
+
+def test_discarded_claim_is_new_again(tmp_path) -> None:
+    """A claim released after a failed card no longer counts as issued."""
+    store = SQLiteLedgerStore(tmp_path / "orders.db")
+    index = CodeIndex(store, capacity=1000, error_rate=0.001)
+    assert not index.check_and_add("CODE1")
+    index.discard("CODE1")
+    assert not index.contains("CODE1")
+    store.close()
+
+
+def test_loads_from_jsonl_ledger(tmp_path) -> None:
+    """Without a SQLite ledger the index is seeded from the JSONL file, skipping failures."""
+    store = JsonlLedgerStore(tmp_path / "orders.jsonl")
+    store.write_many([make_record("CODE1"), make_record("CODE2", FAILED)])
+    with open(store.path, "a", encoding="utf-8") as file:
+        file.write('{"activation_code": "CUT')
+    index = CodeIndex(capacity=1000, error_rate=0.001, jsonl=store)
+    index.load()
+
+    assert index.contains("CODE1")
+    assert not index.contains("CODE2")
+    store.close()
+
+
+def test_shared_ledger_confirms_codes_the_filter_has_not_seen(tmp_path) -> None:
+    """A code another replica wrote to the shared ledger is found without a reload."""
+    store = SQLiteLedgerStore(tmp_path / "orders.db")
+    local = CodeIndex(store, capacity=1000, error_rate=0.001, shared=False)
+    shared = CodeIndex(store, capacity=1000, error_rate=0.001, shared=True)
+    store.write_many([make_record("CODE1")])
+
+    assert not local.contains("CODE1")
+    assert shared.contains("CODE1")
+    assert shared.check_and_add("CODE1")
+    store.close()
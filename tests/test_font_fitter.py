@@ -0,0 +1,78 @@
+"""The font fitter picks the same sizes as the original linear search."""
+
+import pytest
+
+from app.models import CardData
+from app.services.font_fitter import FontFitter
+from app.services.resource_cache import ResourceCache
+
+CODES = [
+    "ABCD-EFGH-IJKL",
+    "WWWW-WWWW-WWWW",
+    "1111-1111-1111",
+    "iiii-jjjj-llll",
+    "A1B2-C3D4-E5F6",
+    "AB12",
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789",
+    "----",
+]
+
+NAMES = [
+    "محمد",
+    "عبد الرحمن بن خالد",
+    "عبد الله بن عبد العزيز بن محمد بن سعود آل سعود",
+    "Sara Al-Qahtani",
+    "نورة 123 Store",
+]
+
+# Activation code box of the default layout, and narrower boxes that push the search to its ends
+BOXES = [(1000, 218.75), (400, 218.75), (120, 60), (10, 10)]
+MIN_SIZE, MAX_SIZE = 31, 187
+
+
+@pytest.fixture(scope="module")
+def resources() -> ResourceCache:
+    """Font cache shared by the fitters and the reference search."""
+    return ResourceCache()
+
+
+def linear_fit(resources: ResourceCache, text: str, box_width: float, box_height: float) -> int:
+    """The original search: step down from the largest size until the text fits."""
+    size = MAX_SIZE
+    while size >= MIN_SIZE:
+        font = resources.get_font(size)
+        bbox = resources.measure_draw().textbbox((0, 0), text, font=font)
+        if bbox[2] - bbox[0] <= box_width and bbox[3] - bbox[1] <= box_height:
+            break
+        size -= 1
+    return size
+
+
+def texts() -> list:
+    """Formatted codes, raw codes and names."""
+    return [CardData.format_activation_code(code) for code in CODES] + CODES + NAMES
+
+
+@pytest.mark.parametrize("box", BOXES)
+def test_matches_linear_search(resources: ResourceCache, box) -> None:
+    """A fresh fitter finds the same size as the linear search for every text."""
+    for text in texts():
+        fitter = FontFitter(MIN_SIZE, MAX_SIZE, resources)
+        assert fitter.fit(text, *box) == linear_fit(resources, text, *box), text
+
+
+@pytest.mark.parametrize("box", BOXES)
+def test_signature_hints_match_linear_search(resources: ResourceCache, box) -> None:
+    """Hints left by earlier texts with the same signature never change the result."""
+    fitter = FontFitter(MIN_SIZE, MAX_SIZE, resources)
+    # Twice over, so the second pass starts from every hint the first one left
+    for text in texts() * 2:
+        assert fitter.fit(text, *box) == linear_fit(resources, text, *box), text
+
+
+def test_hints_are_bounded(resources: ResourceCache) -> None:
+    """Past its limit the fitter forgets the least recently used signature."""
+    fitter = FontFitter(MIN_SIZE, MAX_SIZE, resources, max_hints=2)
+    for text in ["AB12", "ABCD-EFGH-IJKL", "AB12", "----"]:
+        fitter.fit(text, *BOXES[0])
+    assert list(fitter._hints) == ["AA99", "----"]
@@ -0,0 +1,16 @@
+"""Cards drawn from the glyph atlas match cards drawn by Pillow's own text drawing."""
+
+from app.services import CardGeneratorService, GlyphAtlas, LayoutEngine
+from benchmarks.render_bench import ATLAS_TOLERANCE, atlas_difference, card_inputs
+
+
+def test_atlas_cards_match_pillow_text() -> None:
+    """Every card variant differs from Pillow's text by at most ATLAS_TOLERANCE levels."""
+    generator = CardGeneratorService(layouts=LayoutEngine(), glyphs=GlyphAtlas())
+    assert atlas_difference(generator, card_inputs()) <= ATLAS_TOLERANCE
+
+
+def test_blank_text_has_no_mask() -> None:
+    """Text without ink builds no mask."""
+    atlas = GlyphAtlas()
+    assert atlas.get_mask("  ", atlas.resources.get_font(40)) == (None, (0, 0))
@@ -0,0 +1,38 @@
+"""The SQLite ledger streams issued codes without holding up writers."""
+
+import threading
+
+import pytest
+
+from app.models import CardData
+from app.services import SQLiteLedgerStore
+from app.services.order_ledger import DELIVERED, FAILED, LedgerStore, OrderRecord
+
+
+def make_record(code: str, status: str = DELIVERED) -> OrderRecord:
+    """Record of a card with the given activation code."""
+    card = CardData("10$", "USA", code, "محمد", "2026-01-01", "12:00 PM")
+    return OrderRecord.create(1, card, status)
+
+
+def test_iter_issued_codes_lets_writes_through(tmp_path) -> None:
+    """Writes from another thread finish while the codes are being consumed."""
+    store = SQLiteLedgerStore(tmp_path / "orders.db")
+    store.write_many([make_record(f"CODE{index}") for index in range(5)])
+    store.write_many([make_record("FAILED", FAILED)])
+
+    codes = store.iter_issued_codes(batch_size=2)
+    first = next(codes)
+    writer = threading.Thread(target=store.write_many, args=([make_record("LATE")],))
+    writer.start()
+    writer.join(timeout=5)
+    assert not writer.is_alive()
+
+    assert [first, *codes] == [f"CODE{index}" for index in range(5)] + ["LATE"]
+    store.close()
+
+
+def test_ledger_store_requires_write_many() -> None:
+    """A store without write_many cannot be created."""
+    with pytest.raises(TypeError):
+        LedgerStore()
@@ -0,0 +1,34 @@
+"""Render cache keys only change with what is drawn on the card."""
+
+import json
+
+from app.config import settings
+from app.services import LayoutEngine, RenderCache
+
+CARD = {
+    "price": "10$",
+    "country": "KSA",
+    "الفئة": "10$ (السعودية)",
+    "رمز التفعيل": "ABCD-EFGH-IJKL",
+    "اسم العميل": "يا محمد",
+    "تاريخ الاصدار": "2026-01-01",
+    "وقت الاصدار": "12:00 PM",
+}
+LATER = {**CARD, "وقت الاصدار": "12:01 PM"}
+
+
+def test_issue_time_is_keyed_when_drawn() -> None:
+    """With the default layout, a card issued a minute later is a different card."""
+    cache = RenderCache(layouts=LayoutEngine())
+    assert cache.key(CARD) != cache.key(LATER)
+
+
+def test_issue_time_is_not_keyed_when_not_drawn(tmp_path) -> None:
+    """With a layout that does not draw the issue time, a resend a minute later hits the cache."""
+    spec = json.loads((settings.LAYOUTS_DIR / "default.json").read_text(encoding="utf-8"))
+    del spec["fields"]["تاريخ الاصدار"]
+    del spec["fields"]["وقت الاصدار"]
+    (tmp_path / "default.json").write_text(json.dumps(spec), encoding="utf-8")
+    cache = RenderCache(layouts=LayoutEngine(directory=tmp_path, default="default"))
+    assert cache.key(CARD) == cache.key(LATER)
+    assert cache.key(CARD) != cache.key({**CARD, "اسم العميل": "يا نورة"})
@@ -0,0 +1,39 @@
+"""The render pool keeps the event loop free."""
+
+import asyncio
+import time
+
+from app.services import RenderPool
+
+CARD = {
+    "الفئة": "10$ (السعودية)",
+    "رمز التفعيل": "ABCD-EFGH-IJKL",
+    "اسم العميل": "يا محمد",
+    "تاريخ الاصدار": "2026-01-01",
+    "وقت الاصدار": "12:00 PM",
+}
+
+
+def test_first_render_does_not_block_event_loop() -> None:
+    """Rendering on a pool that was never started does not wait for the warm-up on the loop."""
+
+    async def scenario() -> float:
+        pool = RenderPool("thread", workers=1, queue_size=1, memory_limit=0)
+        ticks = []
+
+        async def tick() -> None:
+            while True:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        await asyncio.sleep(0)
+        try:
+            image = await pool.render(CARD)
+        finally:
+            ticker.cancel()
+            pool.shutdown()
+        assert image
+        return max(later - earlier for earlier, later in zip(ticks, ticks[1:]))
+
+    assert asyncio.run(scenario()) < 0.25
@@ -0,0 +1,43 @@
+"""The render service only serves requests it can trust and afford to read."""
+
+import socket
+import threading
+
+import httpx
+import pytest
+
+from app.config import settings
+from app.services import RenderServer
+from app.services.render_service import SECRET_HEADER, _RenderHTTPServer
+
+
+def test_refuses_public_address_without_secret(monkeypatch) -> None:
+    """Listening beyond this host needs a secret; loopback and Unix sockets do not."""
+    monkeypatch.setattr(settings, "RENDER_SERVICE_SECRET", "")
+    with pytest.raises(ValueError):
+        RenderServer("http://0.0.0.0:8090")
+    RenderServer("http://127.0.0.1:8090")
+    RenderServer("unix:///tmp/render.sock")
+    RenderServer("http://0.0.0.0:8090", secret="s3cret")
+
+
+def test_rejects_requests_without_secret_or_over_cap() -> None:
+    """Renders without the secret get 401, and bodies over the cap 413, before any rendering."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(8)
+    server = _RenderHTTPServer(sock, "s3cret", max_body=1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{sock.getsockname()[1]}") as client:
+            assert client.post("/render", content=b"{}").status_code == 401
+            headers = {SECRET_HEADER: "wrong"}
+            assert client.post("/render", content=b"{}", headers=headers).status_code == 401
+
+            headers = {SECRET_HEADER: "s3cret"}
+            big = b" " * 2048
+            assert client.post("/render", content=big, headers=headers).status_code == 413
+            assert client.post("/render", content=b"{}", headers=headers).status_code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,272 @@
+"""Processes sharing a state store share user data, chat data and conversations."""
+
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import (
+    ApplicationBuilder,
+    CommandHandler,
+    ContextTypes,
+    ConversationHandler,
+    MessageHandler,
+    filters,
+)
+
+from app.services import RedisStateStore, SharedStateApplication, StatePersistence
+from app.services.state_store import _conversation_states
+from benchmarks.fake_telegram import FakeTelegram, make_handler
+
+
+class FakeRedis:
+    """Stand-in for the part of the redis-py client the state store uses."""
+
+    def __init__(self):
+        self.hashes: Dict[str, Dict[str, str]] = {}
+
+    def hgetall(self, name: str) -> Dict[bytes, bytes]:
+        return {key.encode(): value.encode() for key, value in self.hashes.get(name, {}).items()}
+
+    def hget(self, name: str, key: str) -> Optional[bytes]:
+        value = self.hashes.get(name, {}).get(key)
+        return None if value is None else value.encode()
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+    def close(self) -> None:
+        pass
+
+
+class FakePipeline:
+    """Queues hash writes and applies them on execute."""
+
+    def __init__(self, client: FakeRedis):
+        self.client = client
+        self.commands: List[Tuple[str, str, Optional[str]]] = []
+
+    def hset(self, name: str, key: str, value: str) -> None:
+        self.commands.append((name, key, value))
+
+    def hdel(self, name: str, key: str) -> None:
+        self.commands.append((name, key, None))
+
+    def execute(self) -> None:
+        for name, key, value in self.commands:
+            fields = self.client.hashes.setdefault(name, {})
+            if value is None:
+                fields.pop(key, None)
+            else:
+                fields[key] = value
+
+
+def make_persistence(client: FakeRedis) -> StatePersistence:
+    """Persistence on the shared stand-in."""
+    return StatePersistence(RedisStateStore(client, prefix="test:"), update_interval=60)
+
+
+async def written(persistence: StatePersistence) -> None:
+    """Wait until the queued writes reach the store."""
+    while persistence._writer is not None:
+        await persistence._writer
+
+
+def test_refresh_user_data_reads_other_process() -> None:
+    """User data written by one process replaces the data another process holds."""
+
+    async def scenario() -> Dict:
+        client = FakeRedis()
+        first, second = make_persistence(client), make_persistence(client)
+        await first.update_user_data(1, {"price": "10$"})
+        await written(first)
+        user_data = {"price": "50$", "country": "USA"}
+        await second.refresh_user_data(1, user_data)
+        return user_data
+
+    assert asyncio.run(scenario()) == {"price": "10$"}
+
+
+def test_refresh_keeps_queued_writes() -> None:
+    """Data with a write still queued in this process is newer than the stored data."""
+
+    async def scenario() -> Dict:
+        client = FakeRedis()
+        first, second = make_persistence(client), make_persistence(client)
+        await first.update_user_data(1, {"price": "10$"})
+        await written(first)
+        await second.update_user_data(1, {"price": "50$"})
+        user_data = {"price": "50$"}
+        await second.refresh_user_data(1, user_data)
+        await written(second)
+        return user_data
+
+    assert asyncio.run(scenario()) == {"price": "50$"}
+
+
+def test_unchanged_data_is_not_written_back() -> None:
+    """Data handed over again unchanged does not overwrite what another process stored since."""
+
+    async def scenario() -> Dict:
+        client = FakeRedis()
+        first, second = make_persistence(client), make_persistence(client)
+        await first.update_user_data(1, {"price": "10$"})
+        await written(first)
+        user_data: Dict = {}
+        await second.refresh_user_data(1, user_data)
+        await first.update_user_data(1, {"price": "10$", "country": "USA"})
+        await written(first)
+        await second.update_user_data(1, user_data)
+        await written(second)
+        return client.hashes["test:user_data"]
+
+    assert asyncio.run(scenario()) == {"1": '{"price": "10$", "country": "USA"}'}
+
+
+def test_chat_data_is_shared_and_empty_data_dropped() -> None:
+    """Chat data round-trips between processes, and emptied data is deleted."""
+
+    async def scenario() -> Tuple[Dict, Dict]:
+        client = FakeRedis()
+        first, second = make_persistence(client), make_persistence(client)
+        await first.update_chat_data(7, {"batch": 3})
+        await written(first)
+        chat_data: Dict = {}
+        await second.refresh_chat_data(7, chat_data)
+        await first.update_chat_data(7, {})
+        await written(first)
+        return chat_data, client.hashes["test:chat_data"]
+
+    chat_data, stored = asyncio.run(scenario())
+    assert chat_data == {"batch": 3}
+    assert stored == {}
+
+
+def test_held_writes_go_out_in_one_batch() -> None:
+    """Writes queued while held are written together once the hold ends."""
+
+    async def scenario() -> Tuple[Dict, List[int]]:
+        client = FakeRedis()
+        persistence = make_persistence(client)
+        batches: List[int] = []
+        write_many = persistence.store.write_many
+        persistence.store.write_many = lambda writes: batches.append(len(writes)) or write_many(
+            writes
+        )
+        await persistence.update_user_data(1, {"price": "10$"})
+        # Let the writer start on the first write
+        await asyncio.sleep(0)
+        with persistence.hold_writes():
+            await persistence.update_conversation("flow", (1, 1), 2)
+            await asyncio.sleep(0)
+            await persistence.update_user_data(1, {"price": "10$", "country": "USA"})
+            await asyncio.sleep(0)
+        await written(persistence)
+        return client.hashes, batches
+
+    stored, batches = asyncio.run(scenario())
+    assert batches == [1, 2]
+    assert stored["test:conversations:flow"] == {"[1, 1]": "2"}
+
+
+def test_conversation_continues_on_another_process() -> None:
+    """Consecutive messages of one conversation may be handled by different applications."""
+    api = FakeTelegram()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/bot"
+    steps: List[Tuple[str, str, List[str]]] = []
+
+    def make_application(label: str, client: FakeRedis) -> SharedStateApplication:
+        async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+            context.user_data["texts"] = []
+            steps.append((label, "start", []))
+            return 1
+
+        async def step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+            context.user_data["texts"].append(update.message.text)
+            steps.append((label, update.message.text, list(context.user_data["texts"])))
+            return 2 if update.message.text == "first" else ConversationHandler.END
+
+        application = (
+            ApplicationBuilder()
+            .token("123:fake")
+            .base_url(base_url)
+            .persistence(make_persistence(client))
+            .application_class(SharedStateApplication)
+            .build()
+        )
+        text = filters.TEXT & ~filters.COMMAND
+        application.add_handler(
+            ConversationHandler(
+                entry_points=[CommandHandler("start", start)],
+                states={1: [MessageHandler(text, step)], 2: [MessageHandler(text, step)]},
+                fallbacks=[],
+                name="flow",
+                persistent=True,
+            )
+        )
+        return application
+
+    async def scenario() -> None:
+        client = FakeRedis()
+        first, second = make_application("A", client), make_application("B", client)
+        await first.initialize()
+        await second.initialize()
+        try:
+            for application, text in [(first, "/start"), (second, "first"), (first, "second")]:
+                update = Update.de_json(api.update(5, 42, text), application.bot)
+                await application.process_update(update)
+                await written(application.persistence)
+        finally:
+            await first.shutdown()
+            await second.shutdown()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        server.shutdown()
+    assert steps == [
+        ("A", "start", []),
+        ("B", "first", ["first"]),
+        ("A", "second", ["first", "second"]),
+    ]
+
+
+def test_conversation_states_are_reachable() -> None:
+    """The installed python-telegram-bot keeps conversation states where the refresh fills them."""
+    api = FakeTelegram()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    text = filters.TEXT & ~filters.COMMAND
+    handler = ConversationHandler(
+        entry_points=[CommandHandler("start", lambda update, context: 1)],
+        states={1: [MessageHandler(text, lambda update, context: 1)]},
+        fallbacks=[],
+        name="flow",
+        persistent=True,
+    )
+    application = (
+        ApplicationBuilder()
+        .token("123:fake")
+        .base_url(f"http://127.0.0.1:{server.server_address[1]}/bot")
+        .persistence(make_persistence(FakeRedis()))
+        .build()
+    )
+    application.add_handler(handler)
+    update = Update.de_json(api.update(5, 42, "hi"), None)
+
+    async def scenario() -> Tuple[bool, bool]:
+        await application.initialize()
+        try:
+            before = bool(handler.check_update(update))
+            _conversation_states(handler).update_no_track({(5, 42): 1})
+            return before, bool(handler.check_update(update))
+        finally:
+            await application.shutdown()
+
+    try:
+        assert asyncio.run(scenario()) == (False, True)
+    finally:
+        server.shutdown()
@@ -0,0 +1,145 @@
+"""Webhook replicas sharing a state store answer card conversations from the fake Bot API."""
+
+import asyncio
+import queue
+import socket
+import threading
+import time
+import urllib.error
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from typing import List
+
+import pytest
+from telegram.ext import ApplicationBuilder
+
+from app.config import settings
+from app.handlers import CardConversationHandler, PerChatUpdateProcessor
+from app.services import (
+    RenderPool,
+    SharedStateApplication,
+    SQLiteStateStore,
+    StatePersistence,
+    access_control,
+)
+from benchmarks.fake_telegram import FakeTelegram, conversation, make_handler, post_update
+
+SECRET = "secret"
+
+# Chats of the conversations, each with its own operator so user quotas do not interfere
+CHATS = [1000, 1001, 1002]
+
+# Time an operator takes to answer; a replica saves the state just after its reply is sent
+THINK_SECONDS = 0.2
+
+
+def free_port() -> int:
+    """Find a port nothing listens on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def authorized(monkeypatch, tmp_path):
+    """Authorize the fake operators and keep the bot's files in a temporary directory."""
+    monkeypatch.setattr(settings, "AUTHORIZED_USERS", ",".join(map(str, CHATS)))
+    monkeypatch.setattr(settings, "DEAD_LETTER_DB_PATH", tmp_path / "dead_letters.db")
+    monkeypatch.setattr(settings, "RENDER_CACHE", False)
+    monkeypatch.setattr(settings, "STATE_BACKEND", "sqlite")
+    access_control.load()
+    yield
+    monkeypatch.undo()
+    access_control.load()
+
+
+def converse(api: FakeTelegram, webhooks: List[str], secret: str, chat_id: int) -> str:
+    """
+    Play one card conversation, sending each message to the next replica in turn.
+
+    The chat's operator has the chat's ID.
+
+    Returns:
+        The Bot API method of the last reply, or "" if a reply never came
+    """
+    replies = api.replies_for(chat_id)
+    method = ""
+    for index, text in enumerate(conversation(chat_id)):
+        post_update(webhooks[index % len(webhooks)], secret, api.update(chat_id, chat_id, text))
+        try:
+            method = replies.get(timeout=30)
+        except queue.Empty:
+            return ""
+        time.sleep(THINK_SECONDS)
+    return method
+
+
+def play(replicas: int, chats: int, secret: str, state_db: Path) -> List[str]:
+    """Run webhook replicas and play a card conversation in each chat across them."""
+    api = FakeTelegram()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ports = [free_port() for _ in range(replicas)]
+    webhooks = [f"http://127.0.0.1:{port}/telegram" for port in ports]
+
+    async def scenario() -> List[str]:
+        render_pool = RenderPool("thread", workers=1, queue_size=chats, memory_limit=0)
+        handlers = []
+        applications = []
+        for port, webhook in zip(ports, webhooks):
+            handler = CardConversationHandler(render_pool=render_pool)
+            application = (
+                ApplicationBuilder()
+                .token("123:fake")
+                .base_url(f"http://127.0.0.1:{server.server_address[1]}/bot")
+                .persistence(StatePersistence(SQLiteStateStore(state_db), update_interval=60))
+                .application_class(SharedStateApplication)
+                .concurrent_updates(PerChatUpdateProcessor(4))
+                .build()
+            )
+            application.add_handler(handler.get_handler())
+            await application.initialize()
+            await application.updater.start_webhook(
+                listen="127.0.0.1",
+                port=port,
+                url_path="telegram",
+                secret_token=SECRET,
+                webhook_url=webhook,
+                allowed_updates=["message"],
+            )
+            await application.start()
+            handlers.append(handler)
+            applications.append(application)
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.gather(
+                *(
+                    loop.run_in_executor(None, converse, api, webhooks, secret, chat_id)
+                    for chat_id in CHATS[:chats]
+                )
+            )
+        finally:
+            for application, handler in zip(applications, handlers):
+                await application.updater.stop()
+                await application.stop()
+                await application.shutdown()
+                handler.delivery_queue.close()
+            render_pool.shutdown()
+
+    try:
+        return asyncio.run(scenario())
+    finally:
+        server.shutdown()
+
+
+def test_conversations_alternate_between_replicas(authorized, tmp_path) -> None:
+    """Conversations whose messages alternate between two replicas each end with a photo."""
+    results = play(replicas=2, chats=len(CHATS), secret=SECRET, state_db=tmp_path / "state.db")
+    assert results == ["sendPhoto"] * len(CHATS)
+
+
+def test_webhook_rejects_wrong_secret(authorized, tmp_path) -> None:
+    """Updates without the webhook's secret token are refused."""
+    with pytest.raises(urllib.error.HTTPError) as error:
+        play(replicas=1, chats=1, secret="wrong", state_db=tmp_path / "state.db")
+    assert error.value.code == 403